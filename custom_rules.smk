@@ -5,144 +5,191 @@ This file is included by the pipeline ``Snakefile``.
 """
 
 
-# Get distances of residues to Mxra8 ----------------------------------------------------
+# Get and parse structures --------------------------------------------------------------
+
+# local directories checked for PDB files before downloading them
+pdb_mirror_dirs = ["data/PDBs"]
 
-rule mxra8_dists:
-    """Get distances to Mxra8 in structures."""
+rule structure_cache:
+    """Get a PDB file once (from local mirror or RCSB) and parse it to a NumPy archive."""
     input:
-        addtl_site_annotations_csv="data/addtl_site_annotations.csv",
-        nb="notebooks/get_mxra8_distances.ipynb",
+        mirror_files=lambda wc: [
+            os.path.join(d, f)
+            for d in pdb_mirror_dirs
+            for f in os.listdir(d)
+            if f.lower().split(".")[0] == wc.pdb_id.lower()
+        ],
+        pdb_cache="scripts/pdb_cache.py",
     output:
-        dists_csv="results/mxra8_distances/mxra8_dists.csv",
-        nb="results/notebooks/get_mxra8_distances.ipynb",
+        pdb="results/structures/{pdb_id}_{pdb_type}.pdb",
+        npy="results/structures/{pdb_id}_{pdb_type}.npy",
+    wildcard_constraints:
+        pdb_type="asymmetric_unit|biological_assembly",
     params:
-        params_yaml=lambda wc: yaml_str(
-            {
-                "chain_defs": {
-                    "6nk7": {
-                        "E1": ["A", "B", "C", "D"],
-                        "E2": ["E", "F", "G", "H"],
-                        "E3": ["U", "V", "W", "X"],
-                        "Mxra8": ["N"],
-                    },
-                    "6nk6": {
-                        "E1": ["A", "B", "C", "D"],
-                        "E2": ["E", "F", "G", "H"],
-                        "Mxra8": ["M", "N", "O", "P"],
-                    },
-                },
-            }
-        ),
+        mirror_dirs=pdb_mirror_dirs,
     conda:
-        os.path.join(config["pipeline_path"], "environment.yml")
+        os.path.join(config["pipeline_path"], "environment.yml"),
     log:
-        "results/logs/mxra8_dists.txt",
+        "results/logs/structure_cache_{pdb_id}_{pdb_type}.txt",
+    benchmark:
+        "results/benchmarks/structure_cache_{pdb_id}_{pdb_type}.tsv",
     shell:
         """
-        papermill {input.nb} {output.nb} \
-            -p addtl_site_annotations_csv {input.addtl_site_annotations_csv} \
-            -p dists_csv {output.dists_csv} \
-            -y "{params.params_yaml}" \
+        python {input.pdb_cache} \
+            --pdb-id {wildcards.pdb_id} \
+            --pdb-type {wildcards.pdb_type} \
+            --mirror-dirs {params.mirror_dirs} \
+            --pdb-file {output.pdb} \
+            --npy-file {output.npy} \
             &> {log}
         """
 
+
+# Cache of notebook outputs -------------------------------------------------------------
+
+# Outputs of notebooks are cached keyed on the contents of their inputs, parameters,
+# and code, and restored rather than rerun if unchanged (see scripts/notebook_cache.py).
+# Show hits and misses for each rule with:
+#   python scripts/notebook_cache.py --cache-dir .notebook_cache stats
+notebook_cache_dir = ".notebook_cache"
+# evict least recently used outputs when the cache is larger than this
+notebook_cache_max_mb = 5000
+
+
+# Analysis notebooks --------------------------------------------------------------------
+
+# Analysis notebooks are all run in one kernel by the `analysis_notebooks` rule, in the
+# order they are added here, so they can use outputs of earlier notebooks. Each has
+# its notebook, input and output files, and a function that returns the papermill
+# parameters given the input and output files.
+analysis_notebooks = {}
+
+
+# Get distances of residues to Mxra8 ----------------------------------------------------
+
+analysis_notebooks["mxra8_dists"] = {
+    "nb": "notebooks/get_mxra8_distances.ipynb",
+    "input": {
+        "addtl_site_annotations_csv": "data/addtl_site_annotations.csv",
+        "npy_6nk7": "results/structures/6nk7_asymmetric_unit.npy",
+        "npy_6nk6": "results/structures/6nk6_asymmetric_unit.npy",
+        "pdb_cache": "scripts/pdb_cache.py",
+        "structure_contacts": "scripts/structure_contacts.py",
+    },
+    "output": {
+        "dists_csv": "results/mxra8_distances/mxra8_dists.csv",
+        "nb": "results/notebooks/get_mxra8_distances.ipynb",
+    },
+    "parameters": lambda input, output: {
+        "addtl_site_annotations_csv": input["addtl_site_annotations_csv"],
+        "dists_csv": output["dists_csv"],
+        "structure_npys": {"6nk7": input["npy_6nk7"], "6nk6": input["npy_6nk6"]},
+        "chain_defs": {
+            "6nk7": {
+                "E1": ["A", "B", "C", "D"],
+                "E2": ["E", "F", "G", "H"],
+                "E3": ["U", "V", "W", "X"],
+                "Mxra8": ["N"],
+            },
+            "6nk6": {
+                "E1": ["A", "B", "C", "D"],
+                "E2": ["E", "F", "G", "H"],
+                "Mxra8": ["M", "N", "O", "P"],
+            },
+        },
+    },
+}
+
 docs["Distances to Mxra8 in structures"] = {
     "Distances to Mxra8": {
-        "CSV of distances": rules.mxra8_dists.output.dists_csv,
-        "Notebook computing distances": rules.mxra8_dists.output.nb,
+        "CSV of distances": analysis_notebooks["mxra8_dists"]["output"]["dists_csv"],
+        "Notebook computing distances": analysis_notebooks["mxra8_dists"]["output"]["nb"],
     }
 }
         
 
 # Compare human and mouse Mxra8 binding -------------------------------------------------
 
-rule compare_human_mouse_mxra8_binding:
-    """Compare human versus mouse Mxra8 binding."""
-    input:
-        nb="notebooks/compare_human_mouse_mxra8_binding.ipynb",
-        entry_csv="results/func_effects/averages/293T-Mxra8_entry_func_effects.csv",
-        binding_human_Mxra8="results/receptor_affinity/averages/human_Mxra8_mut_effect.csv",
-        binding_mouse_Mxra8="results/receptor_affinity/averages/mouse_Mxra8_mut_effect.csv",
-        addtl_site_annotations="data/addtl_site_annotations.csv",
-        mxra8_dists_csv="results/mxra8_distances/mxra8_dists.csv",
-        site_numbering_map=config["site_numbering_map"],
-    output:
-        nb="results/notebooks/compare_human_mouse_mxra8_binding.ipynb",
-        site_csv="results/compare_human_mouse_mxra8/site_binding.csv",
-        mut_corr_chart_html="results/compare_human_mouse_mxra8/mxra8_mut_binding_corr.html",
-        site_corr_chart_html="results/compare_human_mouse_mxra8/mxra8_site_binding_corr.html",
-        dist_corr_chart_html="results/compare_human_mouse_mxra8/mxra8_site_binding_dist_corr.html",
-        site_chart_html = "results/compare_human_mouse_mxra8/mxra8_site_chart.html",
-    conda:
-        os.path.join(config["pipeline_path"], "environment.yml")
-    log:
-        "results/logs/compare_human_mouse_mxra8_binding.txt",
-    shell:
-        """
-        papermill {input.nb} {output.nb} \
-            -p entry_csv {input.entry_csv} \
-            -p binding_human_Mxra8 {input.binding_human_Mxra8} \
-            -p binding_mouse_Mxra8 {input.binding_mouse_Mxra8} \
-            -p addtl_site_annotations {input.addtl_site_annotations} \
-            -p mxra8_dists_csv {input.mxra8_dists_csv} \
-            -p site_numbering_map {input.site_numbering_map} \
-            -p site_csv {output.site_csv} \
-            -p mut_corr_chart_html {output.mut_corr_chart_html} \
-            -p site_corr_chart_html {output.site_corr_chart_html} \
-            -p dist_corr_chart_html {output.dist_corr_chart_html} \
-            -p site_chart_html {output.site_chart_html} \
-            &> {log}
-        """
+analysis_notebooks["compare_human_mouse_mxra8_binding"] = {
+    "nb": "notebooks/compare_human_mouse_mxra8_binding.ipynb",
+    "input": {
+        "entry_csv": "results/func_effects/averages/293T-Mxra8_entry_func_effects.csv",
+        "binding_human_Mxra8": "results/receptor_affinity/averages/human_Mxra8_mut_effect.csv",
+        "binding_mouse_Mxra8": "results/receptor_affinity/averages/mouse_Mxra8_mut_effect.csv",
+        "addtl_site_annotations": "data/addtl_site_annotations.csv",
+        "mxra8_dists_csv": "results/mxra8_distances/mxra8_dists.csv",
+        "site_numbering_map": config["site_numbering_map"],
+        "density_scatter": "scripts/density_scatter.py",
+    },
+    "output": {
+        "nb": "results/notebooks/compare_human_mouse_mxra8_binding.ipynb",
+        "site_csv": "results/compare_human_mouse_mxra8/site_binding.csv",
+        "mut_corr_chart_html": "results/compare_human_mouse_mxra8/mxra8_mut_binding_corr.html",
+        "site_corr_chart_html": "results/compare_human_mouse_mxra8/mxra8_site_binding_corr.html",
+        "dist_corr_chart_html": "results/compare_human_mouse_mxra8/mxra8_site_binding_dist_corr.html",
+        "site_chart_html": "results/compare_human_mouse_mxra8/mxra8_site_chart.html",
+    },
+    "parameters": lambda input, output: {
+        **{key: input[key] for key in input if key != "density_scatter"},
+        **{key: output[key] for key in output if key != "nb"},
+        # plot all mutations as points to keep the minimum-entry slider, or "density"
+        # to bin them and only plot `scatter_max_points` outliers as points
+        "scatter_mode": "points",
+        "scatter_max_points": 1000,
+    },
+}
 
 docs["Compare binding to human vs mouse Mxra8"] = {
     "Charts and notebook": {
-        "site chart of binding effects": rules.compare_human_mouse_mxra8_binding.output.site_chart_html,
-        "site correlation chart": rules.compare_human_mouse_mxra8_binding.output.site_corr_chart_html,
-        "mutation correlation chart": rules.compare_human_mouse_mxra8_binding.output.mut_corr_chart_html,
-        "site effect vs distance to Mxra8": rules.compare_human_mouse_mxra8_binding.output.dist_corr_chart_html,
-        "CSV with site-level effects on Mxra8 binding": rules.compare_human_mouse_mxra8_binding.output.site_csv,
-        "notebook with comparison analysis": rules.compare_human_mouse_mxra8_binding.output.nb,
+        description: analysis_notebooks["compare_human_mouse_mxra8_binding"]["output"][key]
+        for description, key in [
+            ("site chart of binding effects", "site_chart_html"),
+            ("site correlation chart", "site_corr_chart_html"),
+            ("mutation correlation chart", "mut_corr_chart_html"),
+            ("site effect vs distance to Mxra8", "dist_corr_chart_html"),
+            ("CSV with site-level effects on Mxra8 binding", "site_csv"),
+            ("notebook with comparison analysis", "nb"),
+        ]
     },
 }
 
 
 # Compare Mxra8 binding to entry --------------------------------------------------------
 
-rule compare_mxra8_binding_to_entry:
-    """Compare Mxra8 binding to cell entry."""
-    input:
-        data_csv="results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
-        nb="notebooks/compare_mxra8_binding_to_entry.ipynb",
-    output:
-        corr_chart_html="results/compare_mxra8_binding_to_entry/compare_mxra8_binding_to_entry.html",
-        paper_fig_corr_chart_html="results/compare_mxra8_binding_to_entry/compare_mxra8_binding_to_entry_fig.html",
-        nb="results/notebooks/compare_mxra8_binding_to_entry.ipynb",
-    params:
-        params_yaml=lambda wc: yaml_str(
-            {
-                "mut_effects_floor": -5,  # floor mut effects on entry at this value
-                "min_293T_Mxra8_entry": -4,  # only consider binding for mutations w effects on 293T-Mxra8 entry >= this
-                "cells": ["293T_Mxra8", "C636", "293T_TIM1"],
-            }
-        ),
-    conda:
-        os.path.join(config["pipeline_path"], "environment.yml"),
-    log:
-        "results/logs/compare_mxra8_binding_to_entry.txt",
-    shell:
-        """
-        papermill {input.nb} {output.nb} \
-            -p data_csv {input.data_csv} \
-            -p corr_chart_html {output.corr_chart_html} \
-            -p paper_fig_corr_chart_html {output.paper_fig_corr_chart_html} \
-            -y "{params.params_yaml}" \
-            &> {log}
-        """
+analysis_notebooks["compare_mxra8_binding_to_entry"] = {
+    "nb": "notebooks/compare_mxra8_binding_to_entry.ipynb",
+    "input": {
+        "data_csv": "results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
+        "density_scatter": "scripts/density_scatter.py",
+    },
+    "output": {
+        "corr_chart_html": "results/compare_mxra8_binding_to_entry/compare_mxra8_binding_to_entry.html",
+        "paper_fig_corr_chart_html": "results/compare_mxra8_binding_to_entry/compare_mxra8_binding_to_entry_fig.html",
+        "nb": "results/notebooks/compare_mxra8_binding_to_entry.ipynb",
+    },
+    "parameters": lambda input, output: {
+        "data_csv": input["data_csv"],
+        "corr_chart_html": output["corr_chart_html"],
+        "paper_fig_corr_chart_html": output["paper_fig_corr_chart_html"],
+        "mut_effects_floor": -5,  # floor mut effects on entry at this value
+        "min_293T_Mxra8_entry": -4,  # only consider binding for mutations w effects on 293T-Mxra8 entry >= this
+        "cells": ["293T_Mxra8", "C636", "293T_TIM1"],
+        # bin mutations in scatter plots, only plotting this many outliers as points:
+        # the largest chart (about 4 MB as points), whose only interactions (mouseover
+        # and region legend) are kept on the outlier points
+        "scatter_mode": "density",
+        "scatter_max_points": 1500,
+    },
+}
 
 docs["Compare Mxra8 binding to cell entry"] = {
     "Charts and notebooks": {
-        "Interactive scatter plot": rules.compare_mxra8_binding_to_entry.output.corr_chart_html,
-        "293T-Mxra8 entry vs binding paper figure": rules.compare_mxra8_binding_to_entry.output.paper_fig_corr_chart_html,
+        "Interactive scatter plot": (
+            analysis_notebooks["compare_mxra8_binding_to_entry"]["output"]["corr_chart_html"]
+        ),
+        "293T-Mxra8 entry vs binding paper figure": (
+            analysis_notebooks["compare_mxra8_binding_to_entry"]["output"]["paper_fig_corr_chart_html"]
+        ),
     },
 }
 
@@ -152,144 +199,313 @@ rule cell_entry_mut_diffs:
     """Get CSV with differences in entry for mutations between cells after flooring."""
     input:
         mut_effects_csv="results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
-        nb="notebooks/cell_entry_mut_diffs.ipynb",
+        entry_diffs="scripts/entry_diffs.py",
+        fast_csv="scripts/fast_csv.py",
+        file_hashes="scripts/file_hashes.py",
+        incremental_tables="scripts/incremental_tables.py",
+        mut_codec="scripts/mut_codec.py",
     output:
         mut_diffs_csv="results/compare_cell_entry/mut_diffs.csv",
-        nb="results/notebooks/cell_entry_mut_diffs.ipynb",
     params:
-        params_yaml=lambda wc: yaml_str(
-            {
-                # cells names in input CSV file
-                "cells": ["293T_Mxra8", "C636", "293T_TIM1"],
-                # for calculating differences and display, floor mutation effects at this
-                "floor_mut_effects": -5,
-            }
-        ),
+        # cells names in input CSV file
+        cells=["293T_Mxra8", "C636", "293T_TIM1"],
+        # for calculating differences and display, floor mutation effects at this
+        floor_mut_effects=-5,
+        # only recompute sites that changed since the snapshot of the last run
+        incremental_dir="results/incremental/cell_entry_mut_diffs",
     conda:
         os.path.join(config["pipeline_path"], "environment.yml"),
     log:
         "results/logs/cell_entry_mut_diffs.txt",
+    benchmark:
+        "results/benchmarks/cell_entry_mut_diffs.tsv",
     shell:
         """
-        papermill {input.nb} {output.nb} \
-            -p mut_effects_csv {input.mut_effects_csv} \
-            -p mut_diffs_csv {output.mut_diffs_csv} \
-            -y "{params.params_yaml}" \
+        python {input.entry_diffs} \
+            --mut-effects-csv {input.mut_effects_csv} \
+            --cells {params.cells} \
+            --floor {params.floor_mut_effects} \
+            --mut-diffs-csv {output.mut_diffs_csv} \
+            --dtype float64 \
+            --incremental-dir {params.incremental_dir} \
             &> {log}
         """
 
-rule compare_cell_entry:
-    """Compare entry across cell lines."""
+analysis_notebooks["compare_cell_entry"] = {
+    "nb": "notebooks/compare_cell_entry.ipynb",
+    "input": {
+        "mut_effects_csv": "results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
+        "addtl_site_annotations_csv": "data/addtl_site_annotations.csv",
+        "mxra8_dists_csv": "results/mxra8_distances/mxra8_dists.csv",
+        "entry_diffs": "scripts/entry_diffs.py",
+        "mut_codec": "scripts/mut_codec.py",
+        "density_scatter": "scripts/density_scatter.py",
+        "site_pyramid": "scripts/site_pyramid.py",
+    },
+    "output": {
+        "nb": "results/notebooks/compare_cell_entry.ipynb",
+        "site_diffs_csv": "results/compare_cell_entry/site_diffs.csv",
+        "site_diffs_pyramid_csv": "results/compare_cell_entry/site_diffs_pyramid.csv",
+        "mut_scatter_chart": "results/compare_cell_entry/compare_cell_entry_scatter.html",
+        "site_zoom_chart": "results/compare_cell_entry/compare_cell_entry_site_zoom.html",
+    },
+    "parameters": lambda input, output: {
+        "mut_effects_csv": input["mut_effects_csv"],
+        "addtl_site_annotations_csv": input["addtl_site_annotations_csv"],
+        "mxra8_dists_csv": input["mxra8_dists_csv"],
+        "site_diffs_csv": output["site_diffs_csv"],
+        "site_diffs_pyramid_csv": output["site_diffs_pyramid_csv"],
+        "mut_scatter_chart": output["mut_scatter_chart"],
+        "site_zoom_chart": output["site_zoom_chart"],
+        # cells and their names in input CSV file
+        "cells": {
+            "293T-Mxra8": "293T_Mxra8", "C6/36": "C636", "293T-TIM1": "293T_TIM1",
+        },
+        # for calculating differences and display, floor mutation effects at this
+        "floor_mut_effects": -5,
+        # plot all mutations as points to keep the floor slider and brushing, or
+        # "density" to bin them and only plot `scatter_max_points` outliers as points
+        "scatter_mode": "points",
+        "scatter_max_points": 1000,
+    },
+}
+
+rule site_diff_tests:
+    """Permutation p-values and bootstrap CIs for site differences in entry between cells.
+
+    The `method` wildcard is "mutations" to resample amino acids at each site, or
+    "selections" to resample the replicate selections averaged for each cell.
+    """
     input:
-        nb="notebooks/compare_cell_entry.ipynb",
         mut_effects_csv="results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
-        addtl_site_annotations_csv="data/addtl_site_annotations.csv",
-        mxra8_dists_csv="results/mxra8_distances/mxra8_dists.csv",
+        func_effects_config=config["func_effects_config"],
+        by_selection_csvs=lambda wc: (
+            [
+                f"results/func_effects/by_selection/{s}_func_effects.csv"
+                for c in ["293T-Mxra8_entry", "C636_entry", "293T-TIM1_entry"]
+                for s in func_effects_config["avg_func_effects"][c]["selections"]
+            ]
+            if wc.method == "selections"
+            else []
+        ),
+        entry_diff_tests="scripts/entry_diff_tests.py",
+        entry_diffs="scripts/entry_diffs.py",
+        fast_csv="scripts/fast_csv.py",
+        file_hashes="scripts/file_hashes.py",
+        incremental_tables="scripts/incremental_tables.py",
+        mut_codec="scripts/mut_codec.py",
+        replicate_averages="scripts/replicate_averages.py",
     output:
-        nb="results/notebooks/compare_cell_entry.ipynb",
-        site_diffs_csv="results/compare_cell_entry/site_diffs.csv",
-        mut_scatter_chart="results/compare_cell_entry/compare_cell_entry_scatter.html",
-        site_zoom_chart="results/compare_cell_entry/compare_cell_entry_site_zoom.html",
+        tests_csv="results/compare_cell_entry/site_diff_tests_{method}.csv",
+    wildcard_constraints:
+        method="mutations|selections",
     params:
-        params_yaml=lambda wc: yaml_str(
-            {
-                # cells and their names in input CSV file
-                "cells": {
-                    "293T-Mxra8": "293T_Mxra8", "C6/36": "C636", "293T-TIM1": "293T_TIM1",
-                },
-                # for calculating differences and display, floor mutation effects at this
-                "floor_mut_effects": -5,
-            }
-        ),
+        # cells as label=name in input CSV, with same labels as `compare_cell_entry`
+        cells=["293T-Mxra8=293T_Mxra8", "C6/36=C636", "293T-TIM1=293T_TIM1"],
+        # conditions in `avg_func_effects` for each cell
+        conditions=["293T-Mxra8_entry", "C636_entry", "293T-TIM1_entry"],
+        # for calculating differences, floor mutation effects at this
+        floor_mut_effects=-5,
+        n_permutations=1000,
+        n_bootstraps=1000,
+        seed=1,
     conda:
         os.path.join(config["pipeline_path"], "environment.yml"),
     log:
-        "results/logs/compare_cell_entry.txt",
+        "results/logs/site_diff_tests_{method}.txt",
+    benchmark:
+        "results/benchmarks/site_diff_tests_{method}.tsv",
     shell:
         """
-        papermill {input.nb} {output.nb} \
-            -p mut_effects_csv {input.mut_effects_csv} \
-            -p addtl_site_annotations_csv {input.addtl_site_annotations_csv} \
-            -p mxra8_dists_csv {input.mxra8_dists_csv} \
-            -p site_diffs_csv {output.site_diffs_csv} \
-            -p mut_scatter_chart {output.mut_scatter_chart} \
-            -p site_zoom_chart {output.site_zoom_chart} \
-            -y "{params.params_yaml}" \
+        python {input.entry_diff_tests} \
+            --mut-effects-csv {input.mut_effects_csv} \
+            --cells {params.cells} \
+            --floor {params.floor_mut_effects} \
+            --method {wildcards.method} \
+            --conditions {params.conditions} \
+            --func-effects-config {input.func_effects_config} \
+            --n-permutations {params.n_permutations} \
+            --n-bootstraps {params.n_bootstraps} \
+            --seed {params.seed} \
+            --output-csv {output.tests_csv} \
             &> {log}
         """
 
 docs["Compare entry among cells"] = {
     "Final plots": {
-        "Scatter plots of mutation effects in different cells": rules.compare_cell_entry.output.mut_scatter_chart,
-        "Zoomable site chart of differences": rules.compare_cell_entry.output.site_zoom_chart,
+        "Scatter plots of mutation effects in different cells":
+            analysis_notebooks["compare_cell_entry"]["output"]["mut_scatter_chart"],
+        "Zoomable site chart of differences":
+            analysis_notebooks["compare_cell_entry"]["output"]["site_zoom_chart"],
     },
     "Analysis notebooks": {
-        "Notebook making plots comparing entry": rules.compare_cell_entry.output.nb,
+        "Notebook making plots comparing entry":
+            analysis_notebooks["compare_cell_entry"]["output"]["nb"],
     },
     "Data files": {
-        "site-differences in entry effects": rules.compare_cell_entry.output.site_diffs_csv,
+        "site-differences in entry effects":
+            analysis_notebooks["compare_cell_entry"]["output"]["site_diffs_csv"],
+        "site-differences in entry effects at several levels of detail":
+            analysis_notebooks["compare_cell_entry"]["output"]["site_diffs_pyramid_csv"],
         "mutation-differences in entry effects (after flooring negative values)":
             rules.cell_entry_mut_diffs.output.mut_diffs_csv,
+        "site-difference tests resampling mutations at each site":
+            rules.site_diff_tests.output.tests_csv.format(method="mutations"),
+        "site-difference tests resampling replicate selections":
+            rules.site_diff_tests.output.tests_csv.format(method="selections"),
     }
 }
 
 
+# Run analysis notebooks in one kernel --------------------------------------------------
+
+# outputs of analysis notebooks, which are not inputs of the rule when used by later ones
+analysis_notebooks_outputs = {
+    f for nb in analysis_notebooks.values() for f in nb["output"].values()
+}
+
+rule analysis_notebooks:
+    """Run all analysis notebooks in order in one kernel with preloaded imports."""
+    input:
+        nbs=[nb["nb"] for nb in analysis_notebooks.values()],
+        data=sorted(
+            {
+                f
+                for nb in analysis_notebooks.values()
+                for f in nb["input"].values()
+                if f not in analysis_notebooks_outputs
+            }
+        ),
+        analyses="scripts/analyses.py",
+        notebook_runner="scripts/notebook_runner.py",
+        notebook_cache="scripts/notebook_cache.py",
+        file_hashes="scripts/file_hashes.py",
+    output:
+        sorted(analysis_notebooks_outputs),
+    params:
+        notebooks={
+            name: {
+                "input_nb": nb["nb"],
+                "output_nb": nb["output"]["nb"],
+                "parameters": {
+                    **nb["parameters"](nb["input"], nb["output"]),
+                    "scripts_dir": "scripts",
+                },
+                "input_files": [nb["nb"], *nb["input"].values(), "scripts/analyses.py"],
+                "output_files": list(nb["output"].values()),
+            }
+            for name, nb in analysis_notebooks.items()
+        },
+        scripts_dir="scripts",
+        cache_dir=notebook_cache_dir,
+        cache_max_mb=notebook_cache_max_mb,
+    log:
+        "results/logs/analysis_notebooks.txt",
+    benchmark:
+        "results/benchmarks/analysis_notebooks.tsv",
+    conda:
+        os.path.join(config["pipeline_path"], "environment.yml"),
+    script:
+        "scripts/run_analysis_notebooks.py"
+
+
 # Configure dms-viz JSONs ---------------------------------------------------------------
 
 # read configuration for `configure_dms_viz`
 with open("data/dms_viz_config.yaml") as f:
     dms_viz_config = yaml.YAML(typ="safe", pure=True).load(f)
 
+# output files for each visualization, all made by one `configure_dms_viz` job
+dms_viz_outputs = {
+    "dms_viz_json": "results/dms-viz/{viz_name}/{viz_name}.json",
+    "pdb_file": "results/dms-viz/{viz_name}/{viz_name}.pdb",
+    "input_data_csv": "results/dms-viz/{viz_name}/{viz_name}_data.csv",
+    "input_sitemap_csv": "results/dms-viz/{viz_name}/{viz_name}_sitemap.csv",
+    "log": "results/dms-viz/{viz_name}/{viz_name}_log.txt",
+    # compact JSON referencing a gzipped PDB asset shared by all visualizations of a
+    # structure, see `scripts/dms_viz_compact.py`; not in docs as dms-viz cannot load it
+    "compact_json": "results/dms-viz/{viz_name}/{viz_name}_compact.json",
+}
+dms_viz_pdb_asset = "results/dms-viz/structures/{pdb_id}_{pdb_type}.pdb.gz"
+
+# decimal places kept for floats in compact JSONs
+dms_viz_compact_precision = 3
+
+
+def dms_viz_files(viz_name):
+    """Input and output files for a dms-viz visualization."""
+    viz_config = dms_viz_config[viz_name]
+    files = {
+        "data_csv": viz_config["data_csv"],
+        "sitemap_csv": viz_config["sitemap_csv"],
+        "structure_pdb": rules.structure_cache.output.pdb.format(**viz_config),
+        "structure_npy": rules.structure_cache.output.npy.format(**viz_config),
+        **{key: val.format(viz_name=viz_name) for key, val in dms_viz_outputs.items()},
+        "pdb_asset": dms_viz_pdb_asset.format(**viz_config),
+    }
+    if viz_config.get("smoothed_site_effects", False):
+        files["smoothed_site_effects_csv"] = rules.structure_smoothing.output.csv.format(
+            pdb_id=viz_config["pdb_id"]
+        )
+    return files
+
+
 rule configure_dms_viz:
-    """Configure a JSON for `dms-viz`."""
+    """Configure JSONs for `dms-viz`, reading inputs shared by visualizations once."""
     input:
-        data_csv=lambda wc: dms_viz_config[wc.viz_name]["data_csv"],
-        sitemap_csv=lambda wc: dms_viz_config[wc.viz_name]["sitemap_csv"],
-        nb="notebooks/configure_dms_viz.ipynb",
-    output:
-        dms_viz_json="results/dms-viz/{viz_name}/{viz_name}.json",
-        pdb_file="results/dms-viz/{viz_name}/{viz_name}.pdb",
-        input_data_csv="results/dms-viz/{viz_name}/{viz_name}_data.csv",
-        input_sitemap_csv="results/dms-viz/{viz_name}/{viz_name}_sitemap.csv",
-        nb="results/notebooks/configure_dms_viz_{viz_name}.ipynb",
-    params:
-        params_yaml=lambda wc: yaml_str(
+        lambda _: sorted(
             {
-                key: dms_viz_config[wc.viz_name][key]
-                for key in [
-                    "pdb_id",
-                    "pdb_type",
-                    "name",
-                    "melt_condition_metric_cols",
-                    "metric",
-                    "opt_params",
-                ]
+                f
+                for viz_name in dms_viz_config
+                for key, f in dms_viz_files(viz_name).items()
+                if key not in dms_viz_outputs and key != "pdb_asset"
             }
         ),
+        pdb_cache="scripts/pdb_cache.py",
+        dms_viz_prep="scripts/dms_viz_prep.py",
+        dms_viz_compact="scripts/dms_viz_compact.py",
+    output:
+        **{
+            key: expand(val, viz_name=dms_viz_config)
+            for key, val in dms_viz_outputs.items()
+        },
+        pdb_assets=sorted(
+            {dms_viz_pdb_asset.format(**viz) for viz in dms_viz_config.values()}
+        ),
+    params:
+        vizs=lambda _: {
+            viz_name: {
+                **{
+                    key: dms_viz_config[viz_name][key]
+                    for key in [
+                        "name",
+                        "melt_condition_metric_cols",
+                        "metric",
+                        "opt_params",
+                    ]
+                },
+                **dms_viz_files(viz_name),
+            }
+            for viz_name in dms_viz_config
+        },
+        compact_precision=dms_viz_compact_precision,
+    threads: 4
     conda:
         "envs/dms-viz.yml"
     log:
-        "results/logs/configure_dms_viz_{viz_name}.txt",
-    shell:
-        """
-        papermill {input.nb} {output.nb} \
-            -p data_csv {input.data_csv} \
-            -p sitemap_csv {input.sitemap_csv} \
-            -p dms_viz_json {output.dms_viz_json} \
-            -p pdb_file {output.pdb_file} \
-            -p input_data_csv {output.input_data_csv} \
-            -p input_sitemap_csv {output.input_sitemap_csv} \
-            -y "{params.params_yaml}" \
-            &> {log}
-        """
+        "results/logs/configure_dms_viz.txt",
+    benchmark:
+        "results/benchmarks/configure_dms_viz.tsv",
+    script:
+        "scripts/configure_dms_viz.py"
 
 docs["dms-viz visualizations"] = {
     "dms-viz JSON files": {
-        viz_name: rules.configure_dms_viz.output.dms_viz_json.format(viz_name=viz_name)
+        viz_name: dms_viz_outputs["dms_viz_json"].format(viz_name=viz_name)
         for viz_name in dms_viz_config
     },
-    "Notebooks prepping dms-viz JSONs": {
-        viz_name: rules.configure_dms_viz.output.nb.format(viz_name=viz_name)
+    "Logs of prepping dms-viz JSONs": {
+        viz_name: dms_viz_outputs["log"].format(viz_name=viz_name)
         for viz_name in dms_viz_config
     },
 }
@@ -301,24 +517,35 @@ with open("data/wrapped_heatmap_config.yaml") as f:
     wrapped_heatmap_config = yaml.YAML(typ="safe", pure=True).load(f)
 
 
-rule wrapped_heatmap:
-    """Make row-wrapped heatmaps."""
+wrapped_heatmap_html = "results/wrapped_heatmaps/{wrapped_hm}_wrapped_heatmap.html"
+
+
+rule wrapped_heatmaps:
+    """Make all row-wrapped heatmaps, reading each data CSV once."""
     input:
-        data_csv=lambda wc: wrapped_heatmap_config[wc.wrapped_hm]["data_csv"],
+        data_csvs=sorted({hm["data_csv"] for hm in wrapped_heatmap_config.values()}),
+        wrapped_heatmap="scripts/wrapped_heatmap.py",
     output:
-        chart_html="results/wrapped_heatmaps/{wrapped_hm}_wrapped_heatmap.html",
+        chart_htmls=expand(wrapped_heatmap_html, wrapped_hm=wrapped_heatmap_config),
     params:
-        params_dict=lambda wc: wrapped_heatmap_config[wc.wrapped_hm]
+        heatmaps=wrapped_heatmap_config,
+        chart_htmls={
+            wrapped_hm: wrapped_heatmap_html.format(wrapped_hm=wrapped_hm)
+            for wrapped_hm in wrapped_heatmap_config
+        },
+    threads: 4
     log:
-        notebook="results/notebooks/wrapped_heatmap_{wrapped_hm}.ipynb",
+        "results/logs/wrapped_heatmaps.txt",
+    benchmark:
+        "results/benchmarks/wrapped_heatmaps.tsv",
     conda:
         os.path.join(config["pipeline_path"], "environment.yml"),
-    notebook:
-        "notebooks/wrapped_heatmap.py.ipynb"
+    script:
+        "scripts/make_wrapped_heatmaps.py"
 
 docs["Row-wrapped heatmaps"] = {
     "Heatmap HTMLs" : {
-        wrapped_hm: rules.wrapped_heatmap.output.chart_html.format(wrapped_hm=wrapped_hm)
+        wrapped_hm: wrapped_heatmap_html.format(wrapped_hm=wrapped_hm)
         for wrapped_hm in wrapped_heatmap_config
     }
 }
@@ -332,12 +559,25 @@ rule annotated_summary_csvs:
         data="results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
         addtl_annotations="data/addtl_site_annotations.csv",
         site_diffs="results/compare_cell_entry/site_diffs.csv",
+        site_aggregation="scripts/site_aggregation.py",
+        fast_csv="scripts/fast_csv.py",
+        file_hashes="scripts/file_hashes.py",
+        incremental_tables="scripts/incremental_tables.py",
+        # the script itself, so that changes to it recompute all rows
+        annotated_summary_csvs="scripts/annotated_summary_csvs.py",
     output:
         mut="results/annotated_summary_csvs/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding_annotated.csv",
         site_mean="results/annotated_summary_csvs/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding_annotated_site_means.csv",
         site_diffs="results/annotated_summary_csvs/site_diffs_annotated.csv",
+    params:
+        # statistic(s) for site-level summaries: mean, median, min, max, count
+        site_stats="mean",
+        # only recompute sites that changed since the snapshot of the last run
+        incremental_dir="results/incremental/annotated_summary_csvs",
     log:
         "results/logs/annotated_summary_csvs.txt",
+    benchmark:
+        "results/benchmarks/annotated_summary_csvs.tsv",
     conda:
         os.path.join(config["pipeline_path"], "environment.yml"),
     script:
@@ -352,6 +592,94 @@ docs["additional data CSVs"] = {
 }
 
 
+# Smooth site effects over 3-D neighbors in structures ----------------------------------
+
+rule structure_smoothing:
+    """Average site effects over neighboring sites in a structure."""
+    input:
+        structure_npy="results/structures/{pdb_id}_asymmetric_unit.npy",
+        sitemap_csv="data/pdb_sitemaps/{pdb_id}_sitemap.csv",
+        site_effects_csv=rules.annotated_summary_csvs.output.site_mean,
+        pdb_cache="scripts/pdb_cache.py",
+        structure_smoothing="scripts/structure_smoothing.py",
+    output:
+        csv="results/structure_smoothing/{pdb_id}_smoothed_site_effects.csv",
+    params:
+        cols=[
+            "entry in 293T_Mxra8 cells",
+            "entry in C636 cells",
+            "entry in 293T_TIM1 cells",
+            "binding to mouse Mxra8",
+        ],
+        # sites are neighbors if atoms within radius, weighted by Gaussian w bandwidth
+        radius=8,
+        bandwidth=4,
+    log:
+        "results/logs/structure_smoothing_{pdb_id}.txt",
+    benchmark:
+        "results/benchmarks/structure_smoothing_{pdb_id}.tsv",
+    conda:
+        os.path.join(config["pipeline_path"], "environment.yml"),
+    shell:
+        """
+        python {input.structure_smoothing} \
+            --structure-npy {input.structure_npy} \
+            --sitemap-csv {input.sitemap_csv} \
+            --site-effects-csv {input.site_effects_csv} \
+            --cols {params.cols:q} \
+            --radius {params.radius} \
+            --bandwidth {params.bandwidth} \
+            --output-csv {output.csv} \
+            &> {log}
+        """
+
+docs["additional data CSVs"]["CSVs"].update(
+    {
+        f"site effects smoothed over 3-D neighbors in {pdb_id}": (
+            rules.structure_smoothing.output.csv.format(pdb_id=pdb_id)
+        )
+        for pdb_id in ["6nk6", "6nk7"]
+    }
+)
+
+
+# Fit neutralization curves for RVP validations of Mxra8 binding ------------------------
+
+rule mxra8_validation_ic50s:
+    """Fit IC50s with bootstrap confidence intervals to the RVP Mxra8 validations."""
+    input:
+        curves_csv="manual_analyses/experimental_data/RVP.mutants.neutralization.by.soluble.mouse.Mxra8.csv",
+        neut_curves="scripts/neut_curves.py",
+    output:
+        csv="results/mxra8_validation/mxra8_validation_ic50s.csv",
+    params:
+        # same slope bounds as the fits in the paper figures notebook
+        fixslope=[0.5, 2],
+        n_bootstrap=1000,
+        seed=1,
+    log:
+        "results/logs/mxra8_validation_ic50s.txt",
+    benchmark:
+        "results/benchmarks/mxra8_validation_ic50s.tsv",
+    conda:
+        os.path.join(config["pipeline_path"], "environment.yml"),
+    shell:
+        """
+        python {input.neut_curves} \
+            --curves-csv {input.curves_csv} \
+            --fixslope {params.fixslope} \
+            --n-bootstrap {params.n_bootstrap} \
+            --seed {params.seed} \
+            --all-replicates \
+            --output-csv {output.csv} \
+            &> {log}
+        """
+
+docs["additional data CSVs"]["CSVs"][
+    "IC50s fit to RVP validations of mouse Mxra8 binding"
+] = rules.mxra8_validation_ic50s.output.csv
+
+
 # Make some paper figures ---------------------------------------------------------------
 
 rule paper_figures:
@@ -374,25 +702,44 @@ rule paper_figures:
         chikv_titers="manual_analyses/experimental_data/CHIKV_mutant_titers.csv",
         rvp_titers="manual_analyses/experimental_data/RVP_mutant_titers.csv",
         nb="notebooks/paper_figures.ipynb",
+        analyses="scripts/analyses.py",
+        notebook_cache="scripts/notebook_cache.py",
+        file_hashes="scripts/file_hashes.py",
     output:
         nb="results/notebooks/paper_figures.ipynb",
         mxra8_validation_svg="results/paper_figures/mxra8_validation.svg",
     log:
         "results/logs/paper_figures.txt",
+    benchmark:
+        "results/benchmarks/paper_figures.tsv",
     params:
         params_yaml=lambda _, input, output: yaml_str(
             {
+                # inputs that are code rather than data are not notebook parameters
                 "params": dict(
                     tup for tup in list(input.items()) + list(output.items())
-                    if tup[0] != "nb"
+                    if tup[0] not in {"nb", "analyses", "notebook_cache", "file_hashes"}
                 ),
                 "min_times_seen": 2,
                 "cell_entry_clip_lower": -6,
+                "scripts_dir": "scripts",
             }
         ),
+        cache_dir=notebook_cache_dir,
+        cache_max_mb=notebook_cache_max_mb,
     conda:
         os.path.join(config["pipeline_path"], "environment.yml"),
     shell:
-        'papermill {input.nb} {output.nb} -y "{params.params_yaml}" &> {log}'
+        """
+        python {input.notebook_cache} --cache-dir {params.cache_dir} run \
+            --rule paper_figures \
+            --inputs {input} \
+            --outputs {output} \
+            --params "{params.params_yaml}" \
+            --nb {input.nb} \
+            --max-mb {params.cache_max_mb} \
+            -- papermill {input.nb} {output.nb} -y "{params.params_yaml}" \
+            &> {log}
+        """
 
 docs["Custom paper figures"] = {"Notebook w figures" : rules.paper_figures.output.nb}
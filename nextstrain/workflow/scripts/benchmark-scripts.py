@@ -0,0 +1,693 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Nextstrain scripts on synthetic data at increasing scale.
+
+The scripts normally run on records downloaded from NCBI, so there is no way to
+see how they scale past the few thousand CHIKV records in GenBank. This makes a
+seeded, synthetic CHIKV-like dataset at each scale (number of records) and runs
+each script on it as a separate process, recording the wall time, CPU time, and
+peak memory (RSS).
+
+The synthetic GenBank records look like the real ones: a source feature with
+strain or isolate, host, collection date, and location qualifiers; non-structural
+and structural polyprotein CDSs with mat_peptides; ambiguous bases in some records;
+and partial (E1 only or truncated) records with fuzzy coordinates. The protein and
+codon alignments are derived from the same reference structural polyprotein.
+
+Run from the `nextstrain/` directory, eg:
+
+    python workflow/scripts/benchmark-scripts.py --scales 1000 10000 100000
+
+Scaling is reported as the exponent of the wall time with the number of records
+between consecutive scales, and timings are compared to a baseline CSV from an
+earlier run if one is given.
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+import numpy
+import pandas as pd
+from Bio.Data.CodonTable import standard_dna_table
+from Bio.Seq import Seq
+from Bio.SeqFeature import (
+    AfterPosition,
+    BeforePosition,
+    ExactPosition,
+    FeatureLocation,
+    Reference,
+    SeqFeature,
+)
+from Bio.SeqRecord import SeqRecord
+from Genbank import GenBankRecord
+
+# timing of commands and fitting of scaling exponents are shared with the benchmarks
+# of the top-level DMS analysis scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../scripts"))
+import benchmark_runs
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Layout of the CHIKV 181/25 genome (0-based CDS starts, lengths in amino acids)
+GENOME_LENGTH = 11826
+NONSTRUCTURAL_START = 76
+STRUCTURAL_START = 7566
+NONSTRUCTURAL_PEPTIDES = [("nsP1", 535), ("nsP2", 798), ("nsP3", 530), ("nsP4", 611)]
+STRUCTURAL_PEPTIDES = [("capsid", 261), ("E3", 64), ("E2", 423), ("6K", 61), ("E1", 439)]
+
+REFERENCE_ACCESSION = "MW473668.1"
+REFERENCE_STRAIN = "181-25_MW473668"
+OUTGROUP_ACCESSION = "NC_075006.1"
+FEATURE = "structural polyprotein"
+
+HOSTS = [
+    "Homo sapiens",
+    "Homo sapiens; male",
+    "Homo sapiens; female, age 34",
+    "Aedes aegypti",
+    "Aedes aegypti (mosquito)",
+    "Aedes albopictus",
+    "mosquito",
+    "sentinel mouse",
+]
+LOCATIONS = [
+    "India: Kerala",
+    "India",
+    "Brazil: Bahia",
+    "Thailand: Songkhla",
+    "Kenya: Lamu",
+    "Cote d'ivoire",
+    "Italy: Emilia-Romagna",
+    "Borneo: Sabah",
+]
+DATE_FORMATS = ["%Y", "%b-%Y", "%Y-%m-%d", "%d-%b-%Y"]
+IUPAC = numpy.frombuffer(b"RYKMSWN", dtype=numpy.uint8)
+
+# Sense codons and their amino acids, coded by index
+SENSE_CODONS = sorted(standard_dna_table.forward_table)
+CODON_BYTES = numpy.array([list(codon.encode()) for codon in SENSE_CODONS], dtype=numpy.uint8)
+CODON_AAS = numpy.array([ord(standard_dna_table.forward_table[c]) for c in SENSE_CODONS], dtype=numpy.uint8)
+STOP_CODON = numpy.frombuffer(b"TAA", dtype=numpy.uint8)
+
+# Translation table indexed by 25 * first + 5 * second + third base, where bases
+# are indexed as A, C, G, T, or 4 for ambiguous bases
+BASE_INDEX = numpy.full(256, 4, dtype=numpy.int64)
+for _i, _base in enumerate(b"ACGT"):
+    BASE_INDEX[_base] = _i
+CODON_TABLE = numpy.full(125, ord("X"), dtype=numpy.uint8)
+for _codon, _aa in [*standard_dna_table.forward_table.items(), *[(c, "*") for c in standard_dna_table.stop_codons]]:
+    CODON_TABLE[25 * "ACGT".index(_codon[0]) + 5 * "ACGT".index(_codon[1]) + "ACGT".index(_codon[2])] = ord(_aa)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the Nextstrain scripts on synthetic data.")
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Numbers of records (and aligned sequences) to benchmark"
+    )
+    parser.add_argument(
+        "--scripts",
+        nargs="+",
+        default=None,
+        help="Only benchmark these scripts (default all)"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=1,
+        help="Random seed for the synthetic data"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default="results/script_benchmarks/data",
+        help="Directory for the synthetic data, which is reused if it already exists"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="results/script_benchmarks",
+        help="Directory for the script outputs, logs, and benchmark results"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=3600,
+        help="Stop a script after this many seconds, and skip it at larger scales"
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Benchmark CSV from an earlier run to compare against"
+    )
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=1.25,
+        help="Flag a regression if wall time or memory is more than this times the baseline"
+    )
+    parser.add_argument(
+        "--max-exponent",
+        type=float,
+        default=1.3,
+        help="Flag a script whose wall time grows faster than records to this power"
+    )
+    return parser.parse_args()
+
+
+def translate(sequence):
+    """
+    Translate a nucleotide array, with 'X' for codons with ambiguous bases.
+
+    Parameters
+    ----------
+    sequence : numpy.ndarray
+        Array of nucleotide bytes, trailing partial codons are ignored.
+
+    Returns
+    -------
+    str
+        The translation without any trailing stop codon.
+    """
+    codons = BASE_INDEX[sequence[:len(sequence) // 3 * 3]].reshape(-1, 3)
+    protein = CODON_TABLE[25 * codons[:, 0] + 5 * codons[:, 1] + codons[:, 2]].tobytes().decode()
+    return protein[:-1] if protein.endswith("*") else protein
+
+
+class SyntheticCHIKV:
+    """
+    Seeded generator of synthetic CHIKV-like GenBank records and alignments.
+
+    Each sequence is the reference with a random fraction of its codons changed
+    to other sense codons, so the CDSs stay open reading frames.
+
+    Parameters
+    ----------
+    seed : int
+        Random seed.
+    max_divergence : float
+        Sequences have up to this fraction of codons changed from the reference.
+    """
+    def __init__(self, seed=1, max_divergence=0.06):
+        self.rng = numpy.random.default_rng(seed)
+        self.max_divergence = max_divergence
+        self.n_nonstructural = sum(length for _, length in NONSTRUCTURAL_PEPTIDES)
+        self.n_structural = sum(length for _, length in STRUCTURAL_PEPTIDES)
+        self.genome = self.rng.choice(numpy.frombuffer(b"ACGT", dtype=numpy.uint8), GENOME_LENGTH)
+        self.nonstructural_codons = self._random_codons(self.n_nonstructural)
+        self.structural_codons = self._random_codons(self.n_structural)
+        # start with Met
+        self.nonstructural_codons[0] = SENSE_CODONS.index("ATG")
+        self.structural_codons[0] = SENSE_CODONS.index("ATG")
+
+    def _random_codons(self, n):
+        return self.rng.integers(len(SENSE_CODONS), size=n)
+
+    def _mutate_codons(self, codons, divergence):
+        codons = codons.copy()
+        changed = self.rng.random(len(codons)) < divergence
+        changed[0] = False
+        codons[changed] = self._random_codons(changed.sum())
+        return codons
+
+    def structural_protein(self, codons=None):
+        """The structural polyprotein for codons (default the reference)."""
+        if codons is None:
+            codons = self.structural_codons
+        return CODON_AAS[codons].tobytes().decode()
+
+    def genome_sequence(self, divergence):
+        """
+        A mutated genome and the ranges of its CDSs.
+
+        Returns
+        -------
+        tuple
+            The genome as a nucleotide array and a dict of CDS (start, end) keyed
+            by polyprotein name.
+        """
+        genome = self.genome.copy()
+        utr_changed = self.rng.random(GENOME_LENGTH) < divergence / 3
+        genome[utr_changed] = self.rng.choice(numpy.frombuffer(b"ACGT", dtype=numpy.uint8), utr_changed.sum())
+        cds = {}
+        for name, start, codons in [
+            ("nonstructural polyprotein", NONSTRUCTURAL_START, self.nonstructural_codons),
+            (FEATURE, STRUCTURAL_START, self.structural_codons),
+        ]:
+            nucleotides = numpy.concatenate([CODON_BYTES[self._mutate_codons(codons, divergence)].ravel(), STOP_CODON])
+            genome[start:start + len(nucleotides)] = nucleotides
+            cds[name] = (start, start + len(nucleotides))
+        return genome, cds
+
+    def _source(self, length, accession):
+        qualifiers = {
+            "organism": ["Chikungunya virus"],
+            "mol_type": ["genomic RNA"],
+            "strain" if self.rng.random() < 0.5 else "isolate": [f"CHIKV/{accession.split('.')[0]}/{self.rng.integers(1960, 2025)}"],
+        }
+        if self.rng.random() < 0.9:
+            qualifiers["host"] = [str(self.rng.choice(HOSTS))]
+        if self.rng.random() < 0.9:
+            date = pd.Timestamp("1960-01-01") + pd.Timedelta(days=int(self.rng.integers(365 * 64)))
+            qualifiers["collection_date"] = [date.strftime(str(self.rng.choice(DATE_FORMATS)))]
+        if self.rng.random() < 0.95:
+            qualifiers["geo_loc_name"] = [str(self.rng.choice(LOCATIONS))]
+        return SeqFeature(FeatureLocation(0, length, strand=1), type="source", qualifiers=qualifiers)
+
+    def _references(self):
+        submission = Reference()
+        submission.authors = "Doe,J., Roe,R. and Moe,M."
+        submission.title = "Direct Submission"
+        submission.journal = "Submitted (01-JAN-2020) Department of Virology, Institute, City, Country"
+        references = [submission]
+        if self.rng.random() < 0.5:
+            paper = Reference()
+            paper.authors = "Doe,J. and Roe,R."
+            paper.title = "Genomic surveillance of chikungunya virus"
+            paper.journal = "J. Virol. 94 (1), e00001-20 (2020)"
+            paper.pubmed_id = str(self.rng.integers(30000000, 40000000))
+            references.insert(0, paper)
+        return references
+
+    def _cds_features(self, sequence, name, start, end, peptides, protein_id):
+        """
+        CDS and mat_peptide features for a polyprotein from `start` to `end`.
+
+        If the CDS extends past either end of the sequence, its coordinates there
+        are fuzzy and the `codon_start` is set to keep the reading frame.
+        """
+        cds_start, codon_start = max(start, 0), 1
+        if start < 0:
+            codon_start = 1 if start % 3 == 0 else 4 - (-start) % 3
+        cds_end = min(end, len(sequence))
+        location = FeatureLocation(
+            BeforePosition(cds_start) if start < 0 else ExactPosition(cds_start),
+            AfterPosition(cds_end) if end > len(sequence) else ExactPosition(cds_end),
+            strand=1,
+        )
+        qualifiers = {
+            "codon_start": [str(codon_start)],
+            "product": [name],
+            "translation": [translate(sequence[cds_start + codon_start - 1:cds_end])],
+        }
+        if protein_id is not None:
+            qualifiers["protein_id"] = [protein_id]
+        features = [SeqFeature(location, type="CDS", qualifiers=qualifiers)]
+        peptide_start = start
+        for peptide, length in peptides:
+            peptide_end = peptide_start + 3 * length
+            if peptide_end > cds_start and peptide_start < cds_end:
+                features.append(SeqFeature(
+                    FeatureLocation(
+                        BeforePosition(cds_start) if peptide_start < cds_start else ExactPosition(peptide_start),
+                        AfterPosition(cds_end) if peptide_end > cds_end else ExactPosition(peptide_end),
+                        strand=1,
+                    ),
+                    type="mat_peptide",
+                    qualifiers={"product": [f"{peptide} protein"]},
+                ))
+            peptide_start = peptide_end
+        return features
+
+    def record(self, accession, divergence=None):
+        """
+        A synthetic GenBank record.
+
+        Most records are complete genomes. Some are only the E1 gene, have the
+        5' or 3' end truncated within a CDS (fuzzy coordinates), have ambiguous
+        bases, or lack a protein_id.
+
+        Parameters
+        ----------
+        accession : str
+        divergence : float, optional
+            Fraction of codons changed, random by default.
+
+        Returns
+        -------
+        GenBankRecord
+        """
+        if divergence is None:
+            divergence = self.rng.random() * self.max_divergence
+        genome, cds = self.genome_sequence(divergence)
+        kind = self.rng.choice(["complete", "e1", "truncated_5", "truncated_3"], p=[0.85, 0.09, 0.03, 0.03])
+        offset = 0
+        if kind == "e1":
+            e1_start = cds[FEATURE][1] - 3 * (STRUCTURAL_PEPTIDES[-1][1] + 1)
+            offset, end = e1_start - int(self.rng.integers(0, 30)), cds[FEATURE][1] - int(self.rng.integers(0, 30))
+            genome = genome[offset:end]
+        elif kind == "truncated_5":
+            offset = int(self.rng.integers(NONSTRUCTURAL_START + 1, NONSTRUCTURAL_START + 600))
+            genome = genome[offset:]
+        elif kind == "truncated_3":
+            genome = genome[:int(self.rng.integers(cds[FEATURE][1] - 600, cds[FEATURE][1] - 1))]
+        if self.rng.random() < 0.1:
+            # scattered ambiguous bases and a run of Ns
+            genome = genome.copy()
+            ambiguous = self.rng.integers(len(genome), size=self.rng.integers(1, 20))
+            genome[ambiguous] = self.rng.choice(IUPAC, len(ambiguous))
+            run_start = int(self.rng.integers(len(genome)))
+            genome[run_start:run_start + int(self.rng.integers(0, 200))] = ord("N")
+
+        features = [self._source(len(genome), accession)]
+        for i, (name, peptides) in enumerate([
+            ("nonstructural polyprotein", NONSTRUCTURAL_PEPTIDES),
+            (FEATURE, STRUCTURAL_PEPTIDES),
+        ]):
+            start, end = cds[name][0] - offset, cds[name][1] - offset
+            if end <= 0 or start >= len(genome):
+                continue
+            if kind == "e1":
+                # E1-only records annotate the E1 CDS rather than the polyprotein
+                name, peptides = "E1 envelope glycoprotein", []
+                start = cds[FEATURE][1] - 3 * (STRUCTURAL_PEPTIDES[-1][1] + 1) - offset
+            protein_id = None if self.rng.random() < 0.05 else f"SYP{accession.split('.')[0][3:]}{i}.1"
+            features += self._cds_features(genome, name, start, end, peptides, protein_id)
+
+        record = SeqRecord(
+            Seq(genome.tobytes().decode()),
+            id=accession,
+            name=accession.split(".")[0],
+            description=f"Chikungunya virus isolate {accession}, {'complete genome' if kind == 'complete' else 'partial genome'}",
+            features=features,
+            annotations={
+                "molecule_type": "RNA",
+                "organism": "Chikungunya virus",
+                "source": "Chikungunya virus",
+                "references": self._references(),
+            },
+        )
+        return GenBankRecord(accession, record=record)
+
+    def records(self, n):
+        """
+        A dict of `n` GenBank records keyed by accession.
+
+        Includes the reference (library) record, identical to the reference
+        sequence, and a divergent outgroup record.
+        """
+        records = {
+            REFERENCE_ACCESSION: self.record(REFERENCE_ACCESSION, divergence=0),
+            OUTGROUP_ACCESSION: self.record(OUTGROUP_ACCESSION, divergence=0.3),
+        }
+        for i in range(n - len(records)):
+            accession = f"SYN{i:06d}.1"
+            records[accession] = self.record(accession)
+        return records
+
+    def alignments(self, n, n_insertions=12, insertion_frequency=0.02, deletion_frequency=0.2):
+        """
+        Protein and matching codon sequences of the structural polyprotein.
+
+        The alignment has columns where the reference (and most sequences) have
+        gaps, and some sequences have a deletion of a few codons.
+
+        Returns
+        -------
+        tuple
+            Dicts keyed by sequence name of the aligned proteins, the protein
+            alignment with the reference gap columns removed, and the unaligned
+            codon sequences.
+        """
+        names = [REFERENCE_STRAIN] + [f"SYN{i:06d}" for i in range(n - 1)]
+        length = self.n_structural
+        insertions = numpy.sort(self.rng.choice(numpy.arange(1, length), n_insertions, replace=False))
+        # aligned column of each reference residue
+        columns = numpy.arange(length) + numpy.searchsorted(insertions, numpy.arange(length), side="right")
+        insertion_columns = numpy.setdiff1d(numpy.arange(length + n_insertions), columns)
+        proteins, ungapped, codons = {}, {}, {}
+        for i, name in enumerate(names):
+            divergence = 0 if i == 0 else self.rng.random() * self.max_divergence
+            sequence_codons = self._mutate_codons(self.structural_codons, divergence)
+            aligned_codons = numpy.full(length + n_insertions, -1)
+            aligned_codons[columns] = sequence_codons
+            if i > 0:
+                inserted = insertion_columns[self.rng.random(n_insertions) < insertion_frequency]
+                aligned_codons[inserted] = self._random_codons(len(inserted))
+                if self.rng.random() < deletion_frequency:
+                    deletion_start = int(self.rng.integers(1, length - 10))
+                    aligned_codons[columns[deletion_start:deletion_start + int(self.rng.integers(1, 10))]] = -1
+            gap = aligned_codons < 0
+            aligned = numpy.where(gap, ord("-"), CODON_AAS[numpy.maximum(aligned_codons, 0)]).astype(numpy.uint8)
+            proteins[name] = aligned.tobytes().decode()
+            ungapped[name] = aligned[columns].tobytes().decode()
+            codons[name] = CODON_BYTES[aligned_codons[~gap]].tobytes().decode()
+        return proteins, ungapped, codons
+
+    def dms_data(self, metric):
+        """
+        Mutation effects for E3 through E1 like the DMS data used to color the tree.
+
+        The data start one site before E3 (so an offset of 1), with the wildtype
+        and every other amino acid at each site.
+        """
+        protein = self.structural_protein()
+        first = STRUCTURAL_PEPTIDES[0][1] - 1
+        records = []
+        for sequential_site, wildtype in enumerate(protein[first:], start=1):
+            for mutant in "ACDEFGHIKLMNPQRSTVWY":
+                records.append({
+                    "site": sequential_site - 1,
+                    "sequential_site": sequential_site,
+                    "wildtype": wildtype,
+                    "mutant": mutant,
+                    metric: 0.0 if mutant == wildtype else self.rng.normal(-1, 1.5),
+                })
+        return pd.DataFrame(records)
+
+
+def write_fasta(sequences, path):
+    """Write a dict of sequences keyed by name to a FASTA file."""
+    with open(path, "w") as f:
+        for name, sequence in sequences.items():
+            f.write(f">{name}\n{sequence}\n")
+
+
+def parsed_features(records, reference):
+    """
+    The table `parse-feature.py` makes from the records, from the known features.
+
+    So the downstream scripts can be benchmarked without first running the
+    slow alignment in `parse-feature.py`. The identity approximates its
+    score from an ungapped `blastn` alignment (match 2, mismatch -3) to the
+    `reference` feature sequence.
+    """
+    reference = numpy.frombuffer(reference.encode(), dtype=numpy.uint8)
+    rows = []
+    for accession, record in records.items():
+        queries = record.coding_regions
+        matches = [cds for cds in queries if cds.product in [FEATURE, "E1 envelope glycoprotein"]]
+        if matches:
+            sequence, translation = str(matches[0].sequence), matches[0].translation
+            compared = numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)[:len(reference)]
+            n_match = (compared == reference[:len(compared)]).sum()
+            identity = max(100 * (n_match - 1.5 * (len(compared) - n_match)) / len(reference), 0)
+        else:
+            sequence, translation, identity = "", "", 0
+        rows.append((
+            accession,
+            identity,
+            matches[0].product if matches else "no coding sequence",
+            len(queries),
+            len(sequence),
+            len(translation),
+            sequence,
+            translation,
+        ))
+    return pd.DataFrame(rows, columns=['accession', 'identity', 'feature', 'n_cds',  'feature_length', 'feature_translation_length', 'sequence', 'translation'])
+
+
+def make_data(n, data_dir, seed=1):
+    """
+    Write the synthetic data for `n` records, unless already written.
+
+    Returns
+    -------
+    dict
+        Paths of the data files keyed by name.
+    """
+    scale_dir = os.path.join(data_dir, f"n{n}_seed{seed}")
+    files = {
+        "records": os.path.join(scale_dir, "records.pickle"),
+        "features": os.path.join(scale_dir, "parsed_features.csv"),
+        "include": os.path.join(scale_dir, "include.acc"),
+        "protein": os.path.join(scale_dir, "protein.fa"),
+        "protein_ungapped": os.path.join(scale_dir, "protein_ungapped.fa"),
+        "codon": os.path.join(scale_dir, "codon.fa"),
+        "dms": os.path.join(scale_dir, "dms_data.csv"),
+        "auspice": os.path.join(scale_dir, "auspice-config.json"),
+    }
+    if all(os.path.isfile(f) for f in files.values()):
+        print(f"Using existing synthetic data for {n} records in {scale_dir}")
+        return files
+    os.makedirs(scale_dir, exist_ok=True)
+    start_time = time.time()
+    generator = SyntheticCHIKV(seed=seed)
+    records = generator.records(n)
+    with open(files["records"], "wb") as f:
+        pickle.dump(records, f)
+    reference = str(records[REFERENCE_ACCESSION].coding_regions[1].sequence)
+    parsed_features(records, reference).to_csv(files["features"], index=False)
+    with open(files["include"], "w") as f:
+        f.write("\n".join([REFERENCE_ACCESSION, *list(records)[2:12]]) + "\n")
+    del records
+    proteins, ungapped, codons = generator.alignments(n)
+    write_fasta(proteins, files["protein"])
+    write_fasta(ungapped, files["protein_ungapped"])
+    write_fasta(codons, files["codon"])
+    del proteins, ungapped, codons
+    generator.dms_data("entry").to_csv(files["dms"], index=False)
+    with open(files["auspice"], "w") as f:
+        json.dump({"title": "", "colorings": []}, f)
+    print(f"Made synthetic data for {n} records in {scale_dir} in {time.time() - start_time:.1f} seconds")
+    return files
+
+
+def script_commands(files, output_dir):
+    """The command to benchmark each script on the data `files`, keyed by script."""
+    dms_config = {"entry": {"file": files["dms"], "offset": 1, "title": "entry", "scale": ["#eb4034", "#a1a1a1", "#1e1bcc"]}}
+    python = [sys.executable]
+    return {
+        "parse-feature": python + [
+            os.path.join(SCRIPTS_DIR, "parse-feature.py"),
+            "--input", files["records"],
+            "--feature", FEATURE,
+            "--reference", REFERENCE_ACCESSION,
+            "--output", os.path.join(output_dir, "parsed_features.csv"),
+        ],
+        "filter-records": python + [
+            os.path.join(SCRIPTS_DIR, "filter-records.py"),
+            "--features", files["features"],
+            "--records", files["records"],
+            "--include", files["include"],
+            "--outgroup", OUTGROUP_ACCESSION,
+            "--min_feature_length", "1000",
+            "--max_feature_length", "4200",
+            "--max_ambiguous_positions", "0.1",
+            "--remove_duplicates", "False",
+            "--remove_partial", "True",
+            "--min_alignment_score", "35",
+            "--output", os.path.join(output_dir, "filtered_features.csv"),
+        ],
+        "extract-metadata": python + [
+            os.path.join(SCRIPTS_DIR, "extract-metadata.py"),
+            "--records", files["records"],
+            "--filtered", files["features"],
+            "--country_mapping", json.dumps({"Cote d'ivoire": "Ivory Coast"}),
+            "--host_mapping", json.dumps({"mosquito": "Mosquito"}),
+            "--offline",
+            "--output", os.path.join(output_dir, "metadata.tsv"),
+        ],
+        "ungap-alignment": python + [
+            os.path.join(SCRIPTS_DIR, "ungap-alignment.py"),
+            "--alignment", files["protein"],
+            "--reference", REFERENCE_STRAIN,
+            "--output", os.path.join(output_dir, "protein_ungapped.fa"),
+        ],
+        "align-codons": python + [
+            os.path.join(SCRIPTS_DIR, "align-codons.py"),
+            "--alignment", files["protein"],
+            "--sequences", files["codon"],
+            "--output", os.path.join(output_dir, "codon.fa"),
+        ],
+        "color-by-dms": python + [
+            os.path.join(SCRIPTS_DIR, "color-by-dms.py"),
+            "--alignment", files["protein_ungapped"],
+            "--template-auspice", files["auspice"],
+            "--reference", REFERENCE_STRAIN,
+            "--dms-config", json.dumps(dms_config),
+            "--auspice-config", os.path.join(output_dir, "auspice-config.json"),
+            "--dms-scores", os.path.join(output_dir, "entry.json"),
+        ],
+    }
+
+
+def compare_to_baseline(results, baseline, max_ratio=1.25):
+    """
+    Flag benchmarks that are slower or use more memory than the baseline.
+
+    Parameters
+    ----------
+    results : pd.DataFrame
+    baseline : pd.DataFrame
+        Results of an earlier run with the same seed.
+    max_ratio : float
+
+    Returns
+    -------
+    pd.DataFrame
+        The results with the baseline "wall_s" and "max_rss_mb", their ratios,
+        and a "regression" column.
+    """
+    comparison = results.merge(
+        baseline[["script", "n_records", "wall_s", "max_rss_mb"]],
+        on=["script", "n_records"],
+        how="left",
+        suffixes=("", "_baseline"),
+    ).assign(
+        wall_ratio=lambda x: x["wall_s"] / x["wall_s_baseline"],
+        rss_ratio=lambda x: x["max_rss_mb"] / x["max_rss_mb_baseline"],
+    )
+    comparison["regression"] = (comparison["wall_ratio"] > max_ratio) | (comparison["rss_ratio"] > max_ratio)
+    return comparison
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    scripts = args.scripts
+    results = []
+    skip = set()
+    for n in sorted(args.scales):
+        files = make_data(n, args.data_dir, seed=args.seed)
+        input_mb = sum(os.path.getsize(f) for f in files.values()) / 1e6
+        output_dir = os.path.join(args.output_dir, f"n{n}")
+        os.makedirs(output_dir, exist_ok=True)
+        commands = script_commands(files, output_dir)
+        if scripts is None:
+            scripts = list(commands)
+        invalid = set(scripts) - set(commands)
+        if invalid:
+            raise ValueError(f"Unknown scripts {invalid}, choose from {list(commands)}")
+        for script in scripts:
+            if script in skip:
+                print(f"Skipping {script} for {n} records as it timed out at a smaller scale")
+                continue
+            log = os.path.join(output_dir, f"{script}.log")
+            print(f"Running {script} on {n} records...")
+            result = benchmark_runs.run_benchmark(commands[script], log, timeout=args.timeout)
+            print(f"\t{result['status']} in {result['wall_s']:.2f} seconds using {result['max_rss_mb']:.0f} MB")
+            if result["status"] == "failed":
+                print(f"\tWarning: {script} failed, see {log}")
+            elif result["status"] == "timeout":
+                skip.add(script)
+            results.append({"script": script, "n_records": n, "seed": args.seed, "input_mb": input_mb, **result})
+
+    results = pd.DataFrame(results)
+    results_csv = os.path.join(args.output_dir, "benchmarks.csv")
+    results.to_csv(results_csv, index=False, float_format="%.4g")
+    print(f"\nBenchmarks:\n{results.to_string(index=False)}")
+    print(f"Results exported to {results_csv}")
+
+    scaling_df = benchmark_runs.scaling_exponents(results, "script", "n_records", consecutive=True)
+    scaling_df.to_csv(os.path.join(args.output_dir, "scaling.csv"), index=False, float_format="%.3g")
+    print(f"\nScaling exponents (1 is linear):\n{scaling_df.to_string(index=False)}")
+    superlinear = scaling_df.query("wall_exponent > @args.max_exponent")
+    for row in superlinear.itertuples():
+        print(f"Warning: {row.script} wall time scales as records^{row.wall_exponent:.2f} from {row.from_n_records} to {row.to_n_records} records")
+
+    if args.baseline:
+        comparison = compare_to_baseline(results, pd.read_csv(args.baseline), max_ratio=args.max_ratio)
+        comparison.to_csv(os.path.join(args.output_dir, "baseline_comparison.csv"), index=False, float_format="%.4g")
+        for row in comparison.query("regression").itertuples():
+            print(f"Warning: {row.script} on {row.n_records} records took {row.wall_ratio:.2f}x the time and {row.rss_ratio:.2f}x the memory of the baseline")
+        if not comparison["regression"].any():
+            print(f"\nNo regressions relative to the baseline {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,18 @@
 import argparse
 import json
 import os
+import sys
+import numpy
 import pandas as pd
 from Bio import AlignIO 
 from augur.utils import write_json
 from collections import defaultdict
 
+# the integer mutation codec is shared with the top-level DMS analysis scripts, and
+# is an input of the `color_by_dms` rule so that changes to it rerun this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../scripts"))
+import mut_codec
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Make an Auspice color scheme for traits of interest.")
     parser.add_argument(
@@ -57,15 +64,16 @@ def main():
     # Get the sequence of the reference (library) strain
     assert args.reference in alignment_dict, f"{args.reference} not in alignment_dict"
     reference_seq = alignment_dict[args.reference]
-    # Get the mutations for each sequence relative to the reference
-    mutant_dict = dict()
+    # Check that this is a valid alignment
     for id, seq in alignment_dict.items():
-        # Check that this is a valid alignment
         if len(seq) != len(reference_seq):
             raise ValueError(f"Length of {seq} does not match length of reference sequence {reference_seq}, alignment is corrupted")
-        # Find mutations relative to the reference
-        mutations = [(ref, i, alt) for i, (ref, alt) in enumerate(zip(reference_seq, seq)) if ref != alt]
-        mutant_dict[id] = mutations
+    # Hold the alignment as a sequences x positions character array
+    ids = list(alignment_dict)
+    alignment_array = numpy.array([list(alignment_dict[id]) for id in ids], dtype="<U1")
+    reference_array = numpy.array(list(reference_seq), dtype="<U1")
+    # Mutations are positions where a sequence differs from the reference
+    is_mutated = alignment_array != reference_array
 
     # Read in the template auspice configuration file
     print(f"Reading in template auspice configuration file {args.template_auspice}:\n")
@@ -92,24 +100,28 @@ def main():
         assert data_seq[offset:] in reference_seq, "Reference sequence does not contain the data sequence."
         reference_start = reference_seq.find(data_seq[offset:])
 
-        # Update the mutant_dict to match the positions in the data
-        data_mutant_dict = dict()
-        for id, mutations in mutant_dict.items():
-            data_mutants = []
-            for ref, pos, alt in mutations:
-                if pos >= reference_start and alt != "-":
-                    data_mutants.append((ref, (((pos - reference_start) + 1) + offset), alt))
-            data_mutant_dict[id] = data_mutants
+        # Dense site x amino-acid tensor of the metric, missing mutations score 0
+        codec = mut_codec.MutationCodec.from_data(data_df)
+        metric_tensor = numpy.nan_to_num(codec.effect_tensor(data_df, metric, dtype=numpy.float64))
+
+        # Map alignment positions to the sites in the data, keeping only sites where
+        # the reference matches the wildtype in the data
+        positions = numpy.arange(reference_start, len(reference_seq))
+        sites = (positions - reference_start) + 1 + offset
+        in_data = (sites >= 1) & (sites <= codec.n_sites)
+        positions, sites = positions[in_data], sites[in_data]
+        wildtype_match = codec.wildtype_array[sites] == reference_array[positions]
+        positions, sites = positions[wildtype_match], sites[wildtype_match]
 
-        # Score each sequence based on its mutations
-        lookup_dict = {}
-        for _, row in data_df.iterrows():
-            key = (row['wildtype'], row['sequential_site'], row['mutant'])
-            lookup_dict[key] = row[metric]
-        score_dict = {}
-        for id, mutations in data_mutant_dict.items():
-            score = sum(lookup_dict.get((ref, pos, alt), 0) for ref, pos, alt in mutations)
-            score_dict[id] = score
+        # Score each sequence as the sum of the effects of its mutations; gaps and
+        # other characters not in the codec alphabet have index -1 and score 0
+        aa_indices = codec.aa_indices(alignment_array[:, positions])
+        mutation_scores = numpy.where(
+            is_mutated[:, positions] & (aa_indices >= 0),
+            metric_tensor[sites, numpy.maximum(aa_indices, 0)],
+            0.0,
+        )
+        score_dict = dict(zip(ids, mutation_scores.sum(axis=1).tolist()))
 
         # Update the auspice configuration file for this metric
         if len(args.dms_config[metric]['scale']) == 2:
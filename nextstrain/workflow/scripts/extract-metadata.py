@@ -35,10 +35,15 @@ def parse_arguments():
         default=None,
         help="Custom host name mappings"
     )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Skip fetching geographic information from the REST Countries API"
+    )
     return parser.parse_args()
 
 
-def extract_metadata(records, country_mapping=None):
+def extract_metadata(records, country_mapping=None, offline=False):
     """
     Extract metadata from GenBank records.
 
@@ -46,6 +51,11 @@ def extract_metadata(records, country_mapping=None):
     ----------
     records: dict of GenBankRecords
         A dictionary of GenBank records keyed by accession.
+    country_mapping: dict, optional
+        Custom country name mappings for the REST Countries API.
+    offline: bool
+        If True, don't fetch geographic information from the REST Countries API,
+        so the region and subregion are unknown.
 
     Returns
     -------
@@ -76,14 +86,18 @@ def extract_metadata(records, country_mapping=None):
         # Get base properties
         record_metadata = [getattr(record, prop, None) for prop in base_properties]
         # Fetch the geographic properties from a REST API
-        geographic_information = record.fetch_geographic_information(
-            country_mapping=country_mapping
-        )
-        if geographic_information is None:
+        if offline:
+            geographic_information = None
+        else:
+            geographic_information = record.fetch_geographic_information(
+                country_mapping=country_mapping
+            )
+        if geographic_information is None and not offline:
             if record.country == "?":
                 print(f"Warning: Country is Unknown for {accession}")
             else:
                 print(f"Warning: Unable to fetch geographic information for {record.country}: {accession}")
+        if geographic_information is None:
             record_metadata.extend([
                 getattr(record, 'country', "?"),
                 getattr(record, 'local', "?"),
@@ -202,7 +216,7 @@ def main():
 
     # Parse the metadata from the records
     print(f"Extracting metadata for {len(records)} records...")
-    metadata_df = extract_metadata(records, country_mapping=args.country_mapping)
+    metadata_df = extract_metadata(records, country_mapping=args.country_mapping, offline=args.offline)
 
     # Check the strains, accessions, and species
     metadata_df = make_strain_unique(metadata_df)
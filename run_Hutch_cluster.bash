@@ -2,9 +2,28 @@
 #
 #SBATCH -c 16
 
+# per-rule memory and runtime from benchmarks of previous runs, packed under the
+# memory of the job (or 90% of the node's memory if not set)
+MEM_MB=${SLURM_MEM_PER_NODE:-$(awk '/MemTotal/ {print int($2 / 1024 * 0.9)}' /proc/meminfo)}
+python scripts/resource_profile.py \
+    --history-csv results/benchmarks/benchmark_history.csv \
+    --workflow custom \
+    --snakefiles custom_rules.smk \
+    --profile-dir profiles/resources \
+    --cores 16 \
+    --mem-mb $MEM_MB
+
 snakemake \
     -j 16 \
     -s dms-vep-pipeline-3/Snakefile \
+    --profile profiles/resources \
     --software-deployment-method conda \
     --rerun-incomplete \
     --keep-going
+
+# aggregate per-rule benchmarks across runs and flag regressions
+python scripts/benchmark_report.py \
+    --benchmark-dirs custom=results/benchmarks nextstrain=nextstrain/results/benchmarks \
+    --history-csv results/benchmarks/benchmark_history.csv \
+    --report-csv results/benchmarks/benchmark_report.csv \
+    --report-html docs/benchmark_report.html
@@ -0,0 +1,844 @@
+"""Analyses from the custom notebooks as plain functions.
+
+The notebooks run by ``custom_rules.smk`` (including the ``paper_figures`` notebook)
+call these functions and only make the charts, so the analyses can also be imported and run without a notebook. Input CSVs
+are read through :func:`read_csv`, which caches the parsed data frames for the life
+of the process: when several notebooks are run in one kernel by
+:mod:`notebook_runner`, files read by one notebook (eg, the summary CSV of mutation
+effects) are not re-parsed by the next.
+
+"""
+
+
+import itertools
+import os
+
+import numpy
+
+import pandas as pd
+
+import entry_diffs
+import site_pyramid
+import structure_contacts
+
+
+_csv_cache = {}
+
+
+def read_csv(csv_file, **kwargs):
+    """Read a CSV, caching the data frame for later calls on the same unchanged file.
+
+    Parameters
+    ----------
+    csv_file : str
+    **kwargs
+        Keyword arguments to ``pandas.read_csv``, which must be hashable.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A copy of the cached data frame, so callers can modify it.
+
+    """
+    stat = os.stat(csv_file)
+    key = (
+        os.path.abspath(csv_file),
+        stat.st_mtime_ns,
+        stat.st_size,
+        tuple(sorted(kwargs.items())),
+    )
+    if key not in _csv_cache:
+        _csv_cache[key] = pd.read_csv(csv_file, **kwargs)
+    return _csv_cache[key].copy()
+
+
+def clear_csv_cache():
+    """Empty the cache of :func:`read_csv`."""
+    _csv_cache.clear()
+
+
+def mxra8_distances(structure_npys, chain_defs, *, max_distance=None):
+    """Closest distance of each E-protein site to Mxra8 in each structure.
+
+    Parameters
+    ----------
+    structure_npys : dict
+        Passed to :func:`structure_contacts.closest_sites`.
+    chain_defs : dict
+        Passed to :func:`structure_contacts.closest_sites`, with Mxra8 chains keyed
+        by "Mxra8".
+    max_distance : None or float
+        Only keep sites within this many angstroms of Mxra8.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "PDB", "region", "site", "distance_to_Mxra8", "E_chain",
+        "Mxra8_chain", and "Mxra8_site".
+
+    """
+    return (
+        structure_contacts.closest_sites(
+            structure_npys, chain_defs, "Mxra8", max_distance=max_distance
+        )
+        [["structure", "protein", "site", "distance", "chain", "target_chain", "target_site"]]
+        .rename(
+            columns={
+                "structure": "PDB",
+                "protein": "region",
+                "chain": "E_chain",
+                "target_chain": "Mxra8_chain",
+                "target_site": "Mxra8_site",
+                "distance": "distance_to_Mxra8",
+            }
+        )
+    )
+
+
+def binding_vs_entry(
+    data_csv,
+    cells,
+    *,
+    bind_col="binding to mouse Mxra8",
+    mut_effects_floor=None,
+    min_293T_Mxra8_entry=None,
+):
+    """Effects on Mxra8 binding and entry in each cell, and differences between cells.
+
+    Parameters
+    ----------
+    data_csv : str
+        Summary CSV with columns "site", "wildtype", "mutant", "sequential_site",
+        `bind_col`, and "entry in {cell} cells" for each cell.
+    cells : list
+        Cells to compare.
+    bind_col : str
+        Column with binding effects. Mutations without binding effects are dropped.
+    mut_effects_floor : None or float
+        Floor effects on entry at this value.
+    min_293T_Mxra8_entry : None or float
+        Only keep mutations with at least this effect on entry in 293T-Mxra8 cells.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        Mutations with entry effect columns and their differences.
+    entry_cols : list
+        Names of columns with entry effects in each cell.
+    diff_cols : list
+        Names of columns with differences in entry between pairs of cells, which are
+        "{cell1} minus {cell2} entry".
+
+    """
+    entry_cols = [f"entry in {c} cells" for c in cells]
+    data = (
+        read_csv(data_csv)
+        .sort_values("sequential_site")
+        .query(f"`{bind_col}`.notnull()")
+        .query("wildtype != mutant")
+    )
+    missing = set(entry_cols) - set(data.columns)
+    if missing:
+        raise ValueError(f"{data_csv} lacks columns {missing}")
+    if min_293T_Mxra8_entry is not None:
+        data = data.query("`entry in 293T_Mxra8 cells` >= @min_293T_Mxra8_entry")
+
+    for entry_col in entry_cols:
+        data[entry_col] = data[entry_col].clip(lower=mut_effects_floor)
+
+    diff_cols = []
+    for (c1, e1), (c2, e2) in itertools.combinations(zip(cells, entry_cols, strict=True), 2):
+        diff_col = f"{c1} minus {c2} entry"
+        diff_cols.append(diff_col)
+        data[diff_col] = data[e1] - data[e2]
+
+    return data, entry_cols, diff_cols
+
+
+def effect_corrs(data, bind_col, effect_cols):
+    """Pearson correlation of binding with each type of effect across mutations.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Has columns "site", "mutant", `bind_col`, and `effect_cols`.
+    bind_col : str
+    effect_cols : list
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "entry type" (the effect column) and "correlation".
+
+    """
+    return (
+        data
+        .melt(
+            id_vars=["site", "mutant", bind_col],
+            value_vars=effect_cols,
+            var_name="entry type",
+            value_name="effect",
+        )
+        .groupby("entry type")
+        [[bind_col, "effect"]]
+        .corr(method="pearson")
+        .reset_index(level=1)
+        .query("level_1 != 'effect'")
+        .drop(columns=[bind_col, "level_1"])
+        .reset_index()
+        .rename(columns={"effect": "correlation"})
+    )
+
+
+def human_mouse_binding(
+    entry_csv,
+    binding_csvs,
+    site_numbering_map,
+    addtl_site_annotations,
+    *,
+    min_times_seen=2,
+    min_entry_std=2.25,
+    binding_csv_col_names,
+    max_binding_stds,
+    addtl_site_annotations_cols,
+):
+    """Effects of mutations on entry and binding to each Mxra8 ligand.
+
+    Parameters
+    ----------
+    entry_csv : str
+        Averaged effects on entry.
+    binding_csvs : dict
+        Averaged effects on binding keyed by ligand.
+    site_numbering_map : str
+        CSV mapping "reference_site" to "sequential_site" and "region".
+    addtl_site_annotations : str
+        CSV of site annotations by "sequential_site".
+    min_times_seen : int
+        Only keep mutations seen at least this many times.
+    min_entry_std : float
+        Only keep mutations with at most this standard deviation of entry effect.
+    binding_csv_col_names : dict
+        Name used in columns of the binding CSV for each ligand.
+    max_binding_stds : dict
+        Only keep mutations with at most this standard deviation of binding for
+        each ligand.
+    addtl_site_annotations_cols : dict
+        Columns to add from `addtl_site_annotations`, and their new names.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per mutation with columns "site", "wildtype", "mutant", "entry", a
+        column with the binding and "{ligand}_label" (binding and replicate values)
+        for each ligand, "sequential_site", "region", the added site annotations,
+        and "mutation".
+
+    """
+    print(f"Reading cell entry from {entry_csv=}")
+    data_df = (
+        read_csv(entry_csv)
+        .query("times_seen >= @min_times_seen")
+        .query("effect_std <= @min_entry_std")
+        [["site", "wildtype", "mutant", "effect"]]
+        .rename(columns={"effect": "entry"})
+    )
+
+    for ligand, binding_csv in binding_csvs.items():
+        print(f"Reading binding to {ligand=} from {binding_csv=}")
+        max_std = max_binding_stds[ligand]
+        col_name = binding_csv_col_names[ligand]
+        bind_df = (
+            read_csv(binding_csv)
+            .query("times_seen >= @min_times_seen")
+            .query("frac_models == 1")
+            .query(f"`{col_name} binding_std` <= @max_std")
+            .rename(columns={f"{col_name} binding_median": ligand})
+        )
+        bind_rep_cols = bind_df.columns[11:].tolist()
+        bind_df = (
+            bind_df
+            .assign(
+                label=lambda x: x.apply(
+                    lambda r: f"{r[ligand]:.2f} ({', '.join(str(round(r[c], 2)) for c in bind_rep_cols)})",
+                    axis=1,
+                )
+            )
+            .rename(columns={"label": f"{ligand}_label"})
+            [["site", "wildtype", "mutant", ligand, f"{ligand}_label"]]
+        )
+        data_df = data_df.merge(
+            bind_df, how="left", on=["site", "mutant", "wildtype"], validate="1:1"
+        )
+
+    print(f"Adding sequential site from {site_numbering_map=}")
+    data_df = data_df.merge(
+        read_csv(site_numbering_map).rename(columns={"reference_site": "site"})[
+            ["site", "sequential_site", "region"]
+        ],
+        on="site",
+        validate="many_to_one",
+    )
+
+    print(f"Adding site annotations from {addtl_site_annotations=}")
+    data_df = data_df.merge(
+        (
+            read_csv(addtl_site_annotations)
+            [["sequential_site"] + list(addtl_site_annotations_cols)]
+            .rename(columns=addtl_site_annotations_cols)
+        ),
+        on="sequential_site",
+        validate="many_to_one",
+        how="left",
+    )
+
+    return (
+        data_df
+        .query("wildtype != mutant")
+        .assign(
+            mutation=lambda x: x["wildtype"] + x["site"].astype(str) + x["mutant"],
+            **{"Mxra8 contact": lambda x: x["Mxra8 contact"].fillna("no")},
+        )
+        .sort_values(["sequential_site", "mutant"])
+        .reset_index(drop=True)
+    )
+
+
+def cell_entry_tidy(mut_effects, cells):
+    """Effects of mutations on entry in each cell, one row per mutation and cell.
+
+    Parameters
+    ----------
+    mut_effects : pandas.DataFrame
+        Has columns "site", "sequential_site", "wildtype", "mutant", "region", and
+        "entry in {name} cells" for each cell.
+    cells : dict
+        Keyed by cell label with values the cell name in columns of `mut_effects`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "site", "sequential_site", "wildtype", "mutant", "region",
+        "cell" (the cell label), and "effect".
+
+    """
+    col_to_cell = {f"entry in {name} cells": cell for (cell, name) in cells.items()}
+    missing = set(col_to_cell) - set(mut_effects.columns)
+    if missing:
+        raise ValueError(f"mutation effects lack columns {missing}")
+    return (
+        mut_effects.rename(columns=col_to_cell)
+        .melt(
+            id_vars=["site", "sequential_site", "wildtype", "mutant", "region"],
+            value_vars=col_to_cell.values(),
+            var_name="cell",
+            value_name="effect",
+        )
+        .sort_values("sequential_site")
+    )
+
+
+def cell_entry_by_aa(mut_effects_tidy, aas):
+    """Effects of amino-acid mutations on entry with a column for each cell.
+
+    Parameters
+    ----------
+    mut_effects_tidy : pandas.DataFrame
+        From :func:`cell_entry_tidy`.
+    aas : list
+        Amino acids to keep as mutants, all wildtype identities must be among them.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "site", "sequential_site", "wildtype", "mutant", "region", and
+        the effect for each cell label.
+
+    """
+    mut_data = (
+        mut_effects_tidy
+        .query("mutant in @aas")
+        .pivot_table(
+            index=["site", "sequential_site", "wildtype", "mutant", "region"],
+            columns="cell",
+            values="effect",
+        )
+        .sort_values("sequential_site")
+        .reset_index()
+    )
+    other_wts = set(mut_data["wildtype"]) - set(aas)
+    if other_wts:
+        raise ValueError(f"wildtype identities {other_wts} not in {aas=}")
+    return mut_data
+
+
+def cell_entry_site_diffs(mut_effects, cells, floor_mut_effects, aas):
+    """Site-level differences in entry effects between each pair of cells.
+
+    Parameters
+    ----------
+    mut_effects : pandas.DataFrame
+        As for :func:`cell_entry_tidy`.
+    cells : dict
+        As for :func:`cell_entry_tidy`.
+    floor_mut_effects : float
+        Floor effects at this value before computing differences.
+    aas : list
+        Amino-acid alphabet.
+
+    Returns
+    -------
+    pandas.DataFrame
+        From :meth:`entry_diffs.EntryDiffs.site_diffs`, with a column for each of
+        ``entry_diffs.SITE_DIFF_METRICS``.
+
+    """
+    return entry_diffs.EntryDiffs(
+        mut_effects, cells, floor_mut_effects, alphabet="".join(aas), dtype="float64"
+    ).site_diffs()
+
+
+def site_diffs_pyramid(site_diffs, addtl_site_annotations_csv, metrics):
+    """Site differences between cells summarized at each level of detail.
+
+    Parameters
+    ----------
+    site_diffs : pandas.DataFrame
+        From :func:`cell_entry_site_diffs`.
+    addtl_site_annotations_csv : str
+        CSV with columns "sequential_site", "region", and "domain". Sites without a
+        domain are assigned to their region.
+    metrics : list
+        Columns of `site_diffs` to summarize.
+
+    Returns
+    -------
+    pandas.DataFrame
+        From :func:`site_pyramid.site_pyramid` with pairs of cells as groups.
+
+    """
+    site_domains = (
+        read_csv(addtl_site_annotations_csv)
+        [["sequential_site", "region", "domain"]]
+        .assign(domain=lambda x: x["domain"].fillna(x["region"]))
+        [["sequential_site", "domain"]]
+    )
+    return site_pyramid.site_pyramid(
+        site_diffs.merge(
+            site_domains, on="sequential_site", how="left", validate="many_to_one"
+        ),
+        metrics,
+        group_cols=["cell_1", "cell_2"],
+        domain_col="domain",
+    )
+
+
+def site_mean_entry(mut_data, cells, floor_mut_effects):
+    """Mean effect on entry in each cell of the mutations at each site.
+
+    Parameters
+    ----------
+    mut_data : pandas.DataFrame
+        From :func:`cell_entry_by_aa`.
+    cells : list
+        Cell labels.
+    floor_mut_effects : float
+        Floor effects at this value before averaging.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "wildtype", "site", "region", and the mean for each cell.
+
+    """
+    return (
+        mut_data
+        .query("wildtype != mutant")
+        .groupby(["wildtype", "site", "region"], as_index=False)
+        .aggregate(
+            **{
+                cell: pd.NamedAgg(cell, lambda s: s.clip(lower=floor_mut_effects).mean())
+                for cell in cells
+            }
+        )
+    )
+
+
+def site_diff_comparisons(site_diffs, metric="mean difference"):
+    """Site differences labeled by the comparison of cells they are for.
+
+    Parameters
+    ----------
+    site_diffs : pandas.DataFrame
+        From :func:`cell_entry_site_diffs`.
+    metric : str
+        Column of `site_diffs` to keep.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "site", "sequential_site", "region", "comparison" (as
+        "{cell_1} minus {cell_2}"), and `metric`.
+
+    """
+    return (
+        site_diffs
+        .assign(comparison=lambda x: x["cell_1"] + " minus " + x["cell_2"])
+        [["site", "sequential_site", "region", "comparison", metric]]
+    )
+
+
+def site_diffs_vs_mxra8_dists(
+    comparison_diffs,
+    mxra8_dists_csv,
+    comparison="293T-Mxra8 minus 293T-TIM1",
+    metric="mean difference",
+):
+    """Site differences between cells along with the distance of sites to Mxra8.
+
+    Parameters
+    ----------
+    comparison_diffs : pandas.DataFrame
+        From :func:`site_diff_comparisons`.
+    mxra8_dists_csv : str
+        CSV from :func:`mxra8_distances`.
+    comparison : str
+        Comparison of cells to keep.
+    metric : str
+        Column of `comparison_diffs` with the differences.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "PDB" (as "distance in PDB {PDB}"), "region", "site" (as
+        "{site}({region})"), "distance_to_Mxra8", and `metric`.
+
+    """
+    return (
+        read_csv(mxra8_dists_csv)
+        .assign(
+            site=lambda x: x["site"].astype(str) + "(" + x["region"] + ")",
+            PDB=lambda x: "distance in PDB " + x["PDB"],
+        )
+        [["PDB", "region", "site", "distance_to_Mxra8"]]
+        .merge(
+            (
+                comparison_diffs
+                .query("comparison == @comparison")
+                [["site", metric]]
+            ),
+            on="site",
+            validate="m:1",
+        )
+    )
+
+
+def mxra8_validation_curves(curves_csv):
+    """Neutralization of validation variants by soluble Mxra8 in tidy format.
+
+    Parameters
+    ----------
+    curves_csv : str
+        CSV with a "Concentration (ug/mL)" column and three replicate columns for
+        each variant, the first of which is named for the variant (eg, "E2-R119K")
+        and the first variant of which is "unmutated".
+
+    Returns
+    -------
+    curves : pandas.DataFrame
+        Columns "concentration", "variant" (ordered categorical), "replicate",
+        "fraction_infectivity", and "serum" for ``neutcurve.CurveFits``.
+    variants : list
+        Variants with "unmutated" first and then sorted by region, site, and mutant.
+
+    """
+    mxra8_curves = (
+        read_csv(curves_csv)
+        .rename(columns={"Concentration (ug/mL)": "concentration"})
+        .set_index("concentration")
+    )
+
+    variants = [c for c in mxra8_curves.columns if not c.startswith("Unnamed:")]
+    if variants[0] != "unmutated":
+        raise ValueError(f"first variant in {curves_csv} not 'unmutated': {variants}")
+    variants = ["unmutated"] + [
+        tup[1]
+        for tup in sorted(
+            ((v.split("-")[0], int(v.split("-")[1][1:-1]), v[-1]), v) for v in variants[1:]
+        )
+    ]
+
+    curves = []
+    for variant in variants:
+        variant_index = mxra8_curves.columns.tolist().index(variant)
+        cols = mxra8_curves.columns[variant_index : variant_index + 3].tolist()
+        curves.append(
+            mxra8_curves[cols].assign(variant=variant).rename(
+                columns={c: f"replicate {i + 1}" for (i, c) in enumerate(cols)}
+            )
+        )
+    curves = (
+        pd.concat(curves)
+        .reset_index()
+        .melt(
+            id_vars=["concentration", "variant"],
+            var_name="replicate",
+            value_name="fraction_infectivity",
+        )
+        .query("concentration != 0")
+        .assign(
+            serum="serum",
+            variant=lambda x: pd.Categorical(x["variant"], variants, ordered=True),
+        )
+        .sort_values("variant")
+    )
+    return curves, variants
+
+
+def mxra8_validation_ic50s(binding_effects_csv, ic50s):
+    """Effects on Mxra8 binding in the DMS and IC50s of validation variants.
+
+    Parameters
+    ----------
+    binding_effects_csv : str
+        CSV with columns "region", "wildtype", "site", "mutant", and "binding to
+        mouse Mxra8".
+    ic50s : pandas.DataFrame
+        Columns "virus" (the variant) and "ic50", as from ``neutcurve.CurveFits``.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns "virus", "DMS_effect" (0 for the unmutated variant), "ic50", and
+        "inv_ic50", one row per row of `ic50s`.
+
+    """
+    return (
+        read_csv(binding_effects_csv)
+        .assign(
+            mutation=lambda x: (
+                x["region"] + "-" + x["wildtype"] + x["site"].str.split("(").str[0] + x["mutant"]
+            ),
+        )
+        .rename(columns={"mutation": "virus", "binding to mouse Mxra8": "DMS_effect"})
+        [["virus", "DMS_effect"]]
+        .merge(ic50s[["virus", "ic50"]], on="virus", how="right", validate="1:1")
+        .assign(
+            DMS_effect=lambda x: x["DMS_effect"].where(x["virus"] != "unmutated", 0),
+            inv_ic50=lambda x: 1 / x["ic50"],
+        )
+    )
+
+
+def _classify_selection(selection):
+    """Label of cell and library for a functional selection."""
+    cells = {"293T-Mxra8": "293T-Mxra8", "293T-TIM1": "293T-TIM1", "C636": "C6/36"}
+    libs = {"-A-": "library A", "-B-": "library B"}
+    label = []
+    for labels in [cells, libs]:
+        matches = [labels[key] for key in labels if key in selection]
+        if len(matches) != 1:
+            raise ValueError(f"cannot classify {selection=} with {labels=}")
+        label.append(matches[0])
+    return " ".join(label)
+
+
+def func_scores(func_scores_csvs):
+    """Functional scores of variants in each selection, labeled by cell and library.
+
+    Parameters
+    ----------
+    func_scores_csvs : dict
+        Functional scores CSVs keyed by selection name.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Concatenated functional scores, with "selection" as "{cell} {library}".
+
+    """
+    return pd.concat(
+        [read_csv(f).assign(selection=sel) for (sel, f) in func_scores_csvs.items()]
+    ).assign(selection=lambda x: x["selection"].map(_classify_selection))
+
+
+def n_muts_dist(codon_variants_csv, lib_rename, max_muts):
+    """Number of barcoded variants with each number of amino-acid mutations.
+
+    Parameters
+    ----------
+    codon_variants_csv : str
+    lib_rename : dict
+        Only keep these libraries, and rename them.
+    max_muts : int
+        Group variants with at least this many mutations.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns "library", "n_muts", "n_variants", and "n_muts_label".
+
+    """
+    return (
+        read_csv(codon_variants_csv)
+        .query("library in @lib_rename")
+        .assign(
+            library=lambda x: x["library"].map(lib_rename),
+            n_muts=lambda x: x["n_aa_substitutions"].clip(upper=max_muts),
+        )
+        .groupby(["library", "n_muts"], as_index=False)
+        .aggregate(n_variants=pd.NamedAgg("barcode", "count"))
+        .assign(
+            n_muts_label=lambda x: x["n_muts"].map(
+                lambda n: str(n) if n < max_muts else f">{n - 1}"
+            )
+        )
+    )
+
+
+def func_effects_by_lib(func_effects_csvs, min_times_seen):
+    """Effects of mutations on entry in each library and replicate.
+
+    Parameters
+    ----------
+    func_effects_csvs : dict
+        Functional effects CSVs keyed by names like
+        "func_effects_{cell}_LibE3E2-A-...-1", giving the cell, region, library,
+        and replicate.
+    min_times_seen : int
+        Only keep mutations seen at least this many times.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns "site", "wildtype", "mutant", "functional_effect",
+        "library_replicate", and "cell" (as "entry in {cell} cells"), only for
+        mutations in the region mutagenized by each library.
+
+    """
+    return (
+        pd.concat(
+            [
+                read_csv(f).assign(
+                    name=name,
+                    cell=name.split("_")[2],
+                    replicate=name.split("-")[-1],
+                    library="library A" if "-A-" in name else "library B",
+                    region="E3E2" if "E3E2" in name else "6KE1",
+                )
+                for (name, f) in func_effects_csvs.items()
+            ],
+            ignore_index=True,
+        )
+        .query("wildtype != mutant")
+        .query("times_seen >= @min_times_seen")
+        .assign(
+            mut_in_region=lambda x: x.apply(
+                lambda r: (
+                    ("6K" in r["site"] or "E1" in r["site"]) and (r["region"] == "6KE1")
+                    or ("E2" in r["site"] or "E2" in r["site"]) and (r["region"] == "E3E2")
+                ),
+                axis=1,
+            ),
+        )
+        .query("mut_in_region")
+        .assign(
+            library_replicate=lambda x: x["library"] + ", replicate " + x["replicate"],
+            cell=lambda x: x["cell"].map(
+                {
+                    "C636": "entry in C6/36 cells",
+                    "293T-Mxra8": "entry in 293T-Mxra8 cells",
+                    "293T-TIM1": "entry in 293T-TIM1 cells",
+                }
+            ),
+        )
+        [["site", "wildtype", "mutant", "functional_effect", "library_replicate", "cell"]]
+    )
+
+
+def cell_entry_sites(annotated_mut_summary, cell_entry_types, clip_lower):
+    """Mutational tolerance and mean effect of mutations on entry at each site.
+
+    Parameters
+    ----------
+    annotated_mut_summary : str
+        CSV of annotated mutation effects with columns "site", "sequential_site",
+        "wildtype", "mutant", "region", "domain", "contacts", and the keys of
+        `cell_entry_types`.
+    cell_entry_types : dict
+        Columns with entry effects and the cell they are for.
+    clip_lower : float
+        Clip entry effects at this value.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per cell and site with the site annotations, "n_effective" (the
+        effective number of amino acids tolerated), and "site_mean_entry" (mean
+        effect of mutations), sorted by sequential site.
+
+    """
+    return (
+        read_csv(annotated_mut_summary)
+        .rename(columns=cell_entry_types)
+        .melt(
+            id_vars=["site", "sequential_site", "wildtype", "mutant", "region", "domain", "contacts"],
+            value_vars=cell_entry_types.values(),
+            var_name="cell",
+            value_name="cell entry",
+        )
+        .assign(
+            **{"cell entry": lambda x: x["cell entry"].clip(lower=clip_lower)},
+            p_unnorm=lambda x: numpy.exp(x["cell entry"]),
+            p=lambda x: x["p_unnorm"] / x.groupby(["cell", "site"])["p_unnorm"].transform("sum"),
+            entry_no_wt=lambda x: x["cell entry"].where(x["wildtype"] != x["mutant"], pd.NA),
+        )
+        .groupby(
+            ["cell", "site", "sequential_site", "wildtype", "region", "domain", "contacts"],
+            dropna=False,
+            as_index=False,
+        )
+        .aggregate(
+            n_effective=pd.NamedAgg("p", lambda p: numpy.exp((-p * numpy.log(p)).sum())),
+            site_mean_entry=pd.NamedAgg("entry_no_wt", lambda s: s.dropna().mean()),
+        )
+        .sort_values("sequential_site")
+    )
+
+
+def titers(titers_csv, by, *, clip_errorbars=False):
+    """Mean and standard error of titers of each virus.
+
+    Parameters
+    ----------
+    titers_csv : str
+        CSV with columns "titer" and `by`.
+    by : list
+        Columns to group replicate titers by, including "virus".
+    clip_errorbars : bool
+        Clip the lower error bar at half the lowest mean titer, as log-scale plots
+        cannot show error bars that reach zero.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns `by` (with "virus" as mutations like "R119K-K120D"), "titer",
+        "titer_sem", "titer_upper", and "titer_lower".
+
+    """
+    df = (
+        read_csv(titers_csv)
+        .groupby(by, as_index=False)
+        .aggregate(
+            titer=pd.NamedAgg("titer", "mean"),
+            titer_sem=pd.NamedAgg("titer", "sem"),
+        )
+        .assign(
+            virus=lambda x: x["virus"].str.replace("E2_", "").str.replace("_", "-"),
+            titer_upper=lambda x: x["titer"] + x["titer_sem"],
+            titer_lower=lambda x: x["titer"] - x["titer_sem"],
+        )
+    )
+    if clip_errorbars:
+        df["titer_lower"] = df["titer_lower"].clip(lower=df["titer"].min() / 2)
+    return df
@@ -0,0 +1,357 @@
+"""Benchmark how the custom analysis steps scale on synthetic data sets.
+
+For each combination of number of sites, cells, and replicates, a data set is made
+with :func:`synthetic_dms.make_dataset` (and cached), and then each step in
+:data:`STEPS` is run on it in a separate process, recording the wall time, CPU time,
+and peak RSS of that process (including any worker processes it joins). The steps run
+the same functions as the rules in ``custom_rules.smk``:
+
+ - ``cell_entry_mut_diffs``: :meth:`entry_diffs.EntryDiffs.mut_diffs`;
+ - ``compare_cell_entry``: :meth:`entry_diffs.EntryDiffs.site_diffs` and
+   :func:`site_pyramid.site_pyramid`, the computations in the notebook;
+ - ``annotated_summary_csvs``: :func:`site_aggregation.annotated_summaries`;
+ - ``wrapped_heatmaps``: :func:`wrapped_heatmap.make_all_heatmaps`, a heatmap of
+   entry in each cell;
+ - ``dms_viz``: :func:`dms_viz_prep.read_sitemap` and :func:`dms_viz_prep.format_data`
+   on a sitemap of all sites. The structure is not used, since synthetic sites do not
+   map to a real one.
+
+The results are written to a CSV, with the fitted exponent of the growth of time and
+memory with the number of mutations for each step, and an HTML chart of the curves::
+
+    python scripts/benchmark_custom_steps.py --n-sites 1000 4000 16000 --n-cells 3 6
+
+"""
+
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+import benchmark_runs
+
+
+STEPS = [
+    "cell_entry_mut_diffs",
+    "compare_cell_entry",
+    "annotated_summary_csvs",
+    "wrapped_heatmaps",
+    "dms_viz",
+]
+
+# floor on effects for differences between cells, as in the rules
+FLOOR_MUT_EFFECTS = -5
+
+ALPHABET = "RKHDEQNSTYWFAILMVGPC"
+
+
+def _cell_cols(paths):
+    return [f"entry in {cell} cells" for cell in paths["cells"]]
+
+
+def step_cell_entry_mut_diffs(paths, outdir, threads):
+    """Mutation differences between cells, as in the ``cell_entry_mut_diffs`` rule."""
+    import entry_diffs
+    import fast_csv
+
+    diffs = entry_diffs.EntryDiffs(
+        paths["summary"], paths["cells"], FLOOR_MUT_EFFECTS, dtype="float64"
+    )
+    mut_diffs = diffs.mut_diffs()
+    fast_csv.write_csv(
+        mut_diffs, os.path.join(outdir, "mut_diffs.csv"), float_format="%.3f"
+    )
+    return len(mut_diffs)
+
+
+def step_compare_cell_entry(paths, outdir, threads):
+    """Site differences and their pyramid, as in the ``compare_cell_entry`` notebook."""
+    import entry_diffs
+    import fast_csv
+    import site_pyramid
+
+    site_diffs = entry_diffs.EntryDiffs(
+        pd.read_csv(paths["summary"]),
+        paths["cells"],
+        FLOOR_MUT_EFFECTS,
+        alphabet=ALPHABET,
+        dtype="float64",
+    ).site_diffs()
+    fast_csv.write_csv(
+        site_diffs, os.path.join(outdir, "site_diffs.csv"), float_format="%.3f"
+    )
+    site_domains = (
+        pd.read_csv(paths["addtl_site_annotations"])
+        [["sequential_site", "region", "domain"]]
+        .assign(domain=lambda x: x["domain"].fillna(x["region"]))
+        [["sequential_site", "domain"]]
+    )
+    pyramid = site_pyramid.site_pyramid(
+        site_diffs.merge(
+            site_domains, on="sequential_site", how="left", validate="many_to_one"
+        ),
+        entry_diffs.SITE_DIFF_METRICS,
+        group_cols=["cell_1", "cell_2"],
+        domain_col="domain",
+    )
+    fast_csv.write_csv(
+        pyramid, os.path.join(outdir, "site_diffs_pyramid.csv"), float_format="%.3f"
+    )
+    return len(site_diffs)
+
+
+def step_annotated_summary_csvs(paths, outdir, threads):
+    """Annotated summaries, as in the ``annotated_summary_csvs`` rule.
+
+    Uses the site differences from the ``compare_cell_entry`` step.
+
+    """
+    import fast_csv
+    import site_aggregation
+
+    mut, site_mean, site_diffs = site_aggregation.annotated_summaries(
+        pd.read_csv(paths["summary"]),
+        pd.read_csv(paths["addtl_site_annotations"]),
+        pd.read_csv(os.path.join(outdir, "site_diffs.csv")),
+    )
+    for df, name, float_format in [
+        (mut, "annotated.csv", "%.4g"),
+        (site_mean, "annotated_site_means.csv", "%.4f"),
+        (site_diffs, "site_diffs_annotated.csv", "%.4g"),
+    ]:
+        fast_csv.write_csv(df, os.path.join(outdir, name), float_format=float_format)
+    return len(mut)
+
+
+def step_wrapped_heatmaps(paths, outdir, threads):
+    """Heatmap of entry in each cell, as in the ``wrapped_heatmaps`` rule."""
+    import wrapped_heatmap
+
+    heatmaps = {
+        f"entry_{cell}": {
+            "data_csv": paths["summary"],
+            "title": f"effect of mutations on entry in {cell} cells",
+            "effect_col": col,
+            "sites_per_row": 142,
+            "site_label_freq": 5,
+            "color_scheme": "redblue",
+            "fixed_min": -6,
+            "fixed_max": 2,
+            "alphabet": ALPHABET,
+        }
+        for cell, col in zip(paths["cells"], _cell_cols(paths))
+    }
+    wrapped_heatmap.make_all_heatmaps(
+        heatmaps,
+        {name: os.path.join(outdir, f"{name}_wrapped_heatmap.html") for name in heatmaps},
+        max_workers=threads,
+    )
+    return len(heatmaps)
+
+
+def step_dms_viz(paths, outdir, threads):
+    """Sitemap and data for ``configure-dms-viz``, as in ``configure_dms_viz``."""
+    import dms_viz_prep
+
+    data = pd.read_csv(paths["summary"])
+    sitemap_csv = os.path.join(outdir, "sitemap.csv")
+    (
+        data[["site", "sequential_site"]]
+        .drop_duplicates()
+        .rename(columns={"site": "reference_site"})
+        .assign(protein_site=lambda x: x["sequential_site"], chains="A")
+        .to_csv(sitemap_csv, index=False)
+    )
+    with open(os.path.join(outdir, "dms_viz_log.txt"), "w") as log:
+        sitemap = dms_viz_prep.read_sitemap(sitemap_csv, data, log)
+    data_to_use, _ = dms_viz_prep.format_data(
+        data,
+        "entry",
+        _cell_cols(paths),
+        {
+            "condition": "cells",
+            "alphabet": ALPHABET,
+            "summary-stat": "mean",
+            "tooltip-cols": {"sequential_site": "sequential site", "region": "region"},
+        },
+    )
+    data_to_use.to_csv(os.path.join(outdir, "dms_viz_data.csv"), index=False)
+    sitemap.to_csv(os.path.join(outdir, "dms_viz_sitemap.csv"), index=False)
+    return len(data_to_use)
+
+
+def run_step(step, dataset_json, outdir, threads=1):
+    """Run a step in this process on a data set made by :func:`get_dataset`."""
+    with open(dataset_json) as f:
+        paths = json.load(f)
+    os.makedirs(outdir, exist_ok=True)
+    start = time.time()
+    n = globals()[f"step_{step}"](paths, outdir, threads)
+    print(f"Ran {step} with {n} outputs in {time.time() - start:.2f} sec")
+
+
+def get_dataset(data_dir, *, n_sites, n_mutants, n_cells, n_replicates, seed):
+    """Make a synthetic data set, or get the cached one.
+
+    Returns
+    -------
+    str
+        JSON file with the paths returned by :func:`synthetic_dms.make_dataset`.
+
+    """
+    import synthetic_dms
+
+    outdir = os.path.join(
+        data_dir,
+        f"sites{n_sites}_mutants{n_mutants}_cells{n_cells}_reps{n_replicates}_seed{seed}",
+    )
+    dataset_json = os.path.join(outdir, "dataset.json")
+    if not os.path.isfile(dataset_json):
+        print(f"Making synthetic data set in {outdir}")
+        paths = synthetic_dms.make_dataset(
+            outdir,
+            n_sites=n_sites,
+            n_mutants=n_mutants,
+            n_cells=n_cells,
+            n_replicates=n_replicates,
+            n_variants=0,
+            seed=seed,
+        )
+        with open(dataset_json, "w") as f:
+            json.dump(paths, f, indent=2)
+    return dataset_json
+
+
+def scaling_chart(results):
+    """Altair chart of wall time and peak RSS against number of mutations."""
+    import altair as alt
+
+    df = results.query("status == 'ok'").melt(
+        id_vars=["step", "n_sites", "n_cells", "n_replicates", "n_mutations"],
+        value_vars=["wall_s", "max_rss_mb"],
+        var_name="metric",
+    )
+    return (
+        alt.Chart(df)
+        .encode(
+            x=alt.X("n_mutations", scale=alt.Scale(type="log"), title="mutations"),
+            y=alt.Y("value", scale=alt.Scale(type="log"), title=None),
+            color="step",
+            strokeDash=alt.StrokeDash("n_cells:N", title="cells"),
+            detail="n_replicates:N",
+            tooltip=df.columns.tolist(),
+        )
+        .mark_line(point=True)
+        .properties(width=300, height=250)
+        .facet(column=alt.Column("metric", title=None))
+        .resolve_scale(y="independent")
+        .properties(title="Scaling of custom steps on synthetic data")
+    )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark custom analysis steps on synthetic data sets."
+    )
+    parser.add_argument("--n-sites", type=int, nargs="+", default=[1000, 4000, 16000])
+    parser.add_argument("--n-cells", type=int, nargs="+", default=[3])
+    parser.add_argument("--n-replicates", type=int, nargs="+", default=[2])
+    parser.add_argument("--n-mutants", type=int, default=19, help="Mutants per site.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--steps", nargs="+", choices=STEPS, default=STEPS)
+    parser.add_argument("--threads", type=int, default=1, help="Workers for steps.")
+    parser.add_argument("--timeout", type=float, help="Kill steps after this long.")
+    parser.add_argument(
+        "--data-dir", default="results/custom_step_benchmarks/data", help="Data sets."
+    )
+    parser.add_argument(
+        "--outdir", default="results/custom_step_benchmarks", help="Results."
+    )
+    # used to run one step in a child process
+    parser.add_argument("--run-step", choices=STEPS, help=argparse.SUPPRESS)
+    parser.add_argument("--dataset-json", help=argparse.SUPPRESS)
+    parser.add_argument("--step-outdir", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    if args.run_step:
+        run_step(args.run_step, args.dataset_json, args.step_outdir, args.threads)
+        return
+    if "annotated_summary_csvs" in args.steps and "compare_cell_entry" not in args.steps:
+        raise ValueError("`annotated_summary_csvs` needs the `compare_cell_entry` step")
+
+    os.makedirs(args.outdir, exist_ok=True)
+    records = []
+    for n_cells in args.n_cells:
+        for n_replicates in args.n_replicates:
+            for n_sites in sorted(args.n_sites):
+                dataset_json = get_dataset(
+                    args.data_dir,
+                    n_sites=n_sites,
+                    n_mutants=args.n_mutants,
+                    n_cells=n_cells,
+                    n_replicates=n_replicates,
+                    seed=args.seed,
+                )
+                n_mutations = n_sites * args.n_mutants
+                run_name = f"sites{n_sites}_cells{n_cells}_reps{n_replicates}"
+                step_outdir = os.path.join(args.outdir, "outputs", run_name)
+                os.makedirs(step_outdir, exist_ok=True)
+                for step in args.steps:
+                    result = benchmark_runs.run_benchmark(
+                        [
+                            sys.executable,
+                            os.path.abspath(__file__),
+                            "--run-step",
+                            step,
+                            "--dataset-json",
+                            dataset_json,
+                            "--step-outdir",
+                            step_outdir,
+                            "--threads",
+                            str(args.threads),
+                        ],
+                        os.path.join(step_outdir, f"{step}_log.txt"),
+                        timeout=args.timeout,
+                    )
+                    print(
+                        f"{step} on {run_name}: {result['status']}, "
+                        f"{result['wall_s']:.2f} sec, {result['max_rss_mb']:.0f} MB"
+                    )
+                    records.append(
+                        {
+                            "step": step,
+                            "n_sites": n_sites,
+                            "n_cells": n_cells,
+                            "n_replicates": n_replicates,
+                            "n_mutations": n_mutations,
+                            **result,
+                        }
+                    )
+
+    results = pd.DataFrame(records)
+    results_csv = os.path.join(args.outdir, "benchmarks.csv")
+    print(f"\nWriting results to {results_csv}")
+    results.to_csv(results_csv, index=False, float_format="%.4g")
+
+    exponents = benchmark_runs.scaling_exponents(results, "step", "n_mutations")
+    print("\nExponents of growth with number of mutations (1 is linear):")
+    print(exponents.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+    exponents.to_csv(
+        os.path.join(args.outdir, "scaling.csv"), index=False, float_format="%.3f"
+    )
+
+    chart_html = os.path.join(args.outdir, "scaling.html")
+    print(f"Writing chart to {chart_html}")
+    scaling_chart(results).save(chart_html)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Aggregate ``snakemake`` benchmarks of rules across runs and flag regressions.
+
+Each rule in ``custom_rules.smk`` and ``nextstrain/workflow/Snakefile`` writes a
+``benchmark:`` TSV with the wall time, CPU time, peak RSS, and I/O of its last run.
+Since ``snakemake`` overwrites these on each run, :func:`update_history` appends new
+ones (those written since they were last recorded) to a history CSV, and
+:func:`compare_runs` compares the latest run of each benchmark to the previous one,
+flagging regressions in wall time or memory. The comparison is written as a CSV and
+an HTML page for the docs.
+
+Run after the pipeline by ``run_Hutch_cluster.bash``.
+
+"""
+
+
+import argparse
+import glob
+import html
+import os
+import time
+
+import pandas as pd
+
+
+# columns of the history, with their names in snakemake benchmark TSVs
+METRICS = {
+    "wall_s": "s",
+    "cpu_s": "cpu_time",
+    "max_rss_mb": "max_rss",
+    "io_in_mb": "io_in",
+    "io_out_mb": "io_out",
+}
+
+HISTORY_COLS = ["workflow", "benchmark", "run", "mtime", *METRICS]
+
+
+def read_benchmarks(benchmark_dirs):
+    """Read the benchmark TSVs in directories.
+
+    Parameters
+    ----------
+    benchmark_dirs : dict
+        Directories keyed by name of their workflow.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "workflow", "benchmark" (path of the TSV relative to its directory
+        without the suffix), "mtime" (when the TSV was written, in seconds since the
+        epoch), and the columns in :data:`METRICS`, averaged over repeats. Metrics not
+        in a TSV (eg, "cpu_time" in old versions of ``snakemake``) are missing.
+
+    """
+    records = []
+    for workflow, benchmark_dir in benchmark_dirs.items():
+        tsvs = glob.glob(os.path.join(benchmark_dir, "**", "*.tsv"), recursive=True)
+        for tsv in sorted(tsvs):
+            df = pd.read_csv(tsv, sep="\t", na_values=["-", "NA"])
+            records.append(
+                {
+                    "workflow": workflow,
+                    "benchmark": os.path.splitext(os.path.relpath(tsv, benchmark_dir))[0],
+                    "mtime": int(os.path.getmtime(tsv)),
+                    **{
+                        col: pd.to_numeric(df[tsv_col], errors="coerce").mean()
+                        if tsv_col in df.columns
+                        else None
+                        for col, tsv_col in METRICS.items()
+                    },
+                }
+            )
+    return pd.DataFrame(records, columns=["workflow", "benchmark", "mtime", *METRICS])
+
+
+def update_history(history_csv, benchmarks, run=None):
+    """Add benchmarks to the history if they are not already in it.
+
+    Parameters
+    ----------
+    history_csv : str
+        CSV with columns :data:`HISTORY_COLS`, created if it does not exist.
+    benchmarks : pandas.DataFrame
+        From :func:`read_benchmarks`.
+    run : None or str
+        Label for the run of the new benchmarks, by default the current time.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The updated history.
+
+    """
+    if os.path.isfile(history_csv):
+        history = pd.read_csv(history_csv)
+    else:
+        history = pd.DataFrame(columns=HISTORY_COLS)
+    if run is None:
+        run = time.strftime("%Y-%m-%d %H:%M:%S")
+    new = (
+        benchmarks.merge(
+            history[["workflow", "benchmark", "mtime"]],
+            on=["workflow", "benchmark", "mtime"],
+            how="left",
+            indicator=True,
+        )
+        .query("_merge == 'left_only'")
+        .drop(columns="_merge")
+        .assign(run=run)
+        [HISTORY_COLS]
+    )
+    print(f"Adding {len(new)} new of {len(benchmarks)} benchmarks to {history_csv}")
+    history = pd.concat(
+        [df for df in [history, new] if len(df)], ignore_index=True
+    ).reindex(columns=HISTORY_COLS)
+    if os.path.dirname(history_csv):
+        os.makedirs(os.path.dirname(history_csv), exist_ok=True)
+    history.to_csv(history_csv, index=False, float_format="%.4g")
+    return history
+
+
+def compare_runs(history, *, max_ratio=1.25, min_wall_s=10, min_rss_mb=100):
+    """Compare the latest run of each benchmark to the previous one.
+
+    Parameters
+    ----------
+    history : pandas.DataFrame
+        From :func:`update_history`.
+    max_ratio : float
+        Flag a regression if wall time or peak RSS is more than this times the
+        previous run.
+    min_wall_s : float
+        Only flag wall time regressions that are at least this many seconds.
+    min_rss_mb : float
+        Only flag peak RSS regressions that are at least this many MB.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per benchmark, sorted by wall time, with the metrics of the latest
+        run, "previous_wall_s" and "previous_max_rss_mb", "n_runs", and
+        "regression" (empty if none).
+
+    """
+    history = history.sort_values("mtime")
+    latest = history.groupby(["workflow", "benchmark"]).tail(1)
+    previous = (
+        history.drop(latest.index)
+        .groupby(["workflow", "benchmark"])
+        .tail(1)
+        [["workflow", "benchmark", "wall_s", "max_rss_mb"]]
+        .rename(columns={"wall_s": "previous_wall_s", "max_rss_mb": "previous_max_rss_mb"})
+    )
+    n_runs = (
+        history.groupby(["workflow", "benchmark"]).size().rename("n_runs").reset_index()
+    )
+    comparison = (
+        latest.merge(previous, on=["workflow", "benchmark"], how="left")
+        .merge(n_runs, on=["workflow", "benchmark"])
+    )
+
+    def regression(row):
+        flags = []
+        for col, prev_col, min_diff, units in [
+            ("wall_s", "previous_wall_s", min_wall_s, "sec"),
+            ("max_rss_mb", "previous_max_rss_mb", min_rss_mb, "MB"),
+        ]:
+            now, prev = row[col], row[prev_col]
+            if pd.notnull(now) and pd.notnull(prev) and prev > 0:
+                if now > max_ratio * prev and now - prev >= min_diff:
+                    flags.append(
+                        f"{col} {prev:.4g} to {now:.4g} {units} ({now / prev:.2f}x)"
+                    )
+        return "; ".join(flags)
+
+    return (
+        comparison.assign(
+            regression=lambda x: x.apply(regression, axis=1) if len(x) else ""
+        )
+        [
+            [
+                "workflow",
+                "benchmark",
+                "run",
+                *METRICS,
+                "previous_wall_s",
+                "previous_max_rss_mb",
+                "n_runs",
+                "regression",
+            ]
+        ]
+        .sort_values("wall_s", ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+def report_html(comparison, title="Rule benchmarks"):
+    """HTML page with the comparison from :func:`compare_runs`.
+
+    Parameters
+    ----------
+    comparison : pandas.DataFrame
+    title : str
+
+    Returns
+    -------
+    str
+
+    """
+    regressions = comparison.query("regression != ''")
+    by_workflow = (
+        comparison.groupby("workflow")
+        .aggregate(
+            n_benchmarks=pd.NamedAgg("benchmark", "count"),
+            total_wall_s=pd.NamedAgg("wall_s", "sum"),
+            total_cpu_s=pd.NamedAgg("cpu_s", "sum"),
+            max_rss_mb=pd.NamedAgg("max_rss_mb", "max"),
+        )
+        .reset_index()
+    )
+    table = comparison.to_html(
+        index=False, na_rep="", float_format=lambda x: f"{x:.4g}", border=0
+    )
+    # highlight regressions
+    for regression in set(regressions["regression"]):
+        table = table.replace(
+            f"<td>{html.escape(regression)}</td>",
+            f'<td class="regression">{html.escape(regression)}</td>',
+        )
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="UTF-8">
+  <title>{html.escape(title)}</title>
+  <style>
+    body {{ font-family: sans-serif; margin: 2em; }}
+    table {{ border-collapse: collapse; font-size: 13px; }}
+    th, td {{ padding: 3px 8px; border-bottom: 1px solid #ddd; text-align: right; }}
+    td.regression {{ background-color: #f8d7da; text-align: left; }}
+  </style>
+</head>
+<body>
+  <h1>{html.escape(title)}</h1>
+  <p>Wall time, CPU time, peak RSS, and I/O of the latest run of each rule
+  benchmark, compared to its previous run. {len(regressions)} of
+  {len(comparison)} benchmarks have regressions in wall time or memory.</p>
+  <h2>Totals by workflow</h2>
+  {by_workflow.to_html(index=False, float_format=lambda x: f"{x:.4g}", border=0)}
+  <h2>Benchmarks</h2>
+  {table}
+</body>
+</html>
+"""
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Aggregate snakemake benchmarks across runs and flag regressions."
+    )
+    parser.add_argument(
+        "--benchmark-dirs",
+        nargs="+",
+        required=True,
+        help="Benchmark directories, as workflow=directory.",
+    )
+    parser.add_argument("--history-csv", required=True, help="History of benchmarks.")
+    parser.add_argument("--report-csv", required=True, help="Comparison to last run.")
+    parser.add_argument("--report-html", required=True, help="HTML of comparison.")
+    parser.add_argument("--max-ratio", type=float, default=1.25)
+    parser.add_argument("--min-wall-s", type=float, default=10)
+    parser.add_argument("--min-rss-mb", type=float, default=100)
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    benchmark_dirs = {}
+    for workflow_dir in args.benchmark_dirs:
+        workflow, sep, benchmark_dir = workflow_dir.partition("=")
+        if not sep:
+            raise ValueError(f"{workflow_dir=} not workflow=directory")
+        benchmark_dirs[workflow] = benchmark_dir
+    benchmarks = read_benchmarks(benchmark_dirs)
+    history = update_history(args.history_csv, benchmarks)
+    comparison = compare_runs(
+        history,
+        max_ratio=args.max_ratio,
+        min_wall_s=args.min_wall_s,
+        min_rss_mb=args.min_rss_mb,
+    )
+    regressions = comparison.query("regression != ''")
+    print(f"{len(regressions)} of {len(comparison)} benchmarks have regressions")
+    for row in regressions.itertuples():
+        print(f"  {row.workflow} {row.benchmark}: {row.regression}")
+    print(f"Writing comparison to {args.report_csv} and {args.report_html}")
+    for f in [args.report_csv, args.report_html]:
+        if os.path.dirname(f):
+            os.makedirs(os.path.dirname(f), exist_ok=True)
+    comparison.to_csv(args.report_csv, index=False, float_format="%.4g")
+    with open(args.report_html, "w") as f:
+        f.write(report_html(comparison))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Time commands and fit how their time and memory scale with the size of the data.
+
+Shared by the scaling benchmarks of the custom analysis steps
+(:mod:`benchmark_custom_steps`) and of the Nextstrain scripts
+(``nextstrain/workflow/scripts/benchmark-scripts.py``).
+
+"""
+
+
+import math
+import os
+import subprocess
+import sys
+import time
+
+import numpy
+
+import pandas as pd
+
+
+# columns of benchmark results and of the exponents fit to them
+EXPONENT_COLS = {"wall_s": "wall_exponent", "max_rss_mb": "rss_exponent"}
+
+
+def run_benchmark(cmd, log, timeout=None):
+    """Run a command, measuring its wall time, CPU time, and peak memory.
+
+    Parameters
+    ----------
+    cmd : list
+    log : str
+        File for the standard output and error of the command.
+    timeout : None or float
+        Kill the command after this many seconds.
+
+    Returns
+    -------
+    dict
+        The "status" ("ok", "failed", or "timeout"), "wall_s", "cpu_s", and
+        "max_rss_mb" of the command, including any worker processes it joins.
+
+    """
+    start = time.time()
+    with open(log, "w") as f:
+        process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT)
+        status = "ok"
+        while True:
+            # usage of the process and of the worker processes it has joined
+            pid, exit_status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if timeout is not None and time.time() - start > timeout:
+                process.kill()
+                pid, exit_status, usage = os.wait4(process.pid, 0)
+                status = "timeout"
+                break
+            time.sleep(0.05)
+    # so Popen does not try to wait on the reaped process
+    process.returncode = os.waitstatus_to_exitcode(exit_status)
+    if status == "ok" and process.returncode != 0:
+        status = "failed"
+    return {
+        "status": status,
+        "wall_s": time.time() - start,
+        "cpu_s": usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in KB on Linux but bytes on macOS
+        "max_rss_mb": usage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10),
+    }
+
+
+def _log_log_slope(sizes, values):
+    """Least-squares slope of log `values` on log `sizes`, ignoring values <= 0."""
+    keep = values > 0
+    if len(numpy.unique(sizes[keep])) < 2:
+        return math.nan
+    return numpy.polyfit(numpy.log(sizes[keep]), numpy.log(values[keep]), 1)[0]
+
+
+def scaling_exponents(results, by, size_col, *, consecutive=False):
+    """Exponents of the growth of wall time and peak RSS with the size of the data.
+
+    Fit by least squares on a log-log scale to the successful runs of each group, so
+    an exponent of 1 is linear scaling.
+
+    Parameters
+    ----------
+    results : pandas.DataFrame
+        Has columns `by`, `size_col`, "status", "wall_s", and "max_rss_mb".
+    by : str
+        Column with the step or script benchmarked.
+    size_col : str
+        Column with the size of the data (eg, number of mutations).
+    consecutive : bool
+        Fit between each pair of consecutive sizes rather than over all sizes.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are `by`, then "n_runs" (or ``f"from_{size_col}"`` and
+        ``f"to_{size_col}"`` if `consecutive`), "wall_exponent", and "rss_exponent".
+
+    """
+    if consecutive:
+        window_cols = [f"from_{size_col}", f"to_{size_col}"]
+    else:
+        window_cols = ["n_runs"]
+    records = []
+    ok = results.query("status == 'ok'").sort_values(size_col, kind="stable")
+    for key, df in ok.groupby(by, sort=False):
+        sizes = df[size_col].to_numpy(dtype=float)
+        values = {col: df[col].to_numpy(dtype=float) for col in EXPONENT_COLS}
+        if consecutive:
+            windows = [
+                (dict(zip(window_cols, df[size_col].iloc[i : i + 2])), slice(i, i + 2))
+                for i in range(len(df) - 1)
+            ]
+        else:
+            windows = [({"n_runs": len(df)}, slice(None))]
+        for record, window in windows:
+            records.append(
+                {
+                    by: key,
+                    **record,
+                    **{
+                        exponent_col: _log_log_slope(sizes[window], values[col][window])
+                        for col, exponent_col in EXPONENT_COLS.items()
+                    },
+                }
+            )
+    return pd.DataFrame(records, columns=[by, *window_cols, *EXPONENT_COLS.values()])
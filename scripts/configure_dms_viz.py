@@ -0,0 +1,13 @@
+"""Configure all ``dms-viz`` JSONs in one process."""
+
+import sys
+
+import dms_viz_prep
+
+
+sys.stderr = sys.stdout = open(snakemake.log[0], "w")
+
+batch = dms_viz_prep.DmsVizBatch(
+    snakemake.params.vizs, compact_precision=snakemake.params.compact_precision
+)
+batch.configure_all(max_workers=snakemake.threads)
@@ -0,0 +1,121 @@
+"""Density-binned scatter plots of many mutations.
+
+Rather than sending every mutation to the browser as a point, the points are binned
+into a 2-D histogram in NumPy and only the bins are plotted, as rects shaded by the
+number of mutations in them. Points in the sparsest bins (the outliers) are kept as
+individual points with tooltips, up to a budget on the number of points, along with
+any mutations that are always shown. Points drawn individually are not also counted
+in the bins.
+
+"""
+
+
+import altair as alt
+
+import numpy
+
+import pandas as pd
+
+
+def density_bins(x, y, *, max_points=1000, bins=50, keep=None):
+    """Bin points into a 2-D histogram and choose outlier points to show.
+
+    Parameters
+    ----------
+    x : array-like
+    y : array-like
+    max_points : int
+        Budget on the number of outlier points shown individually, which are the
+        points in the sparsest bins (ties broken by distance from the mean).
+    bins : int
+        Number of bins along each axis.
+    keep : None or array-like
+        Boolean mask of points always shown individually, in addition to the outliers.
+
+    Returns
+    -------
+    bins_df : pandas.DataFrame
+        Has columns "x_start", "x_end", "y_start", "y_end", and "count" (number of
+        points not shown individually) for bins with such points.
+    show : numpy.ndarray
+        Boolean mask of points to show individually.
+
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    if x.shape != y.shape or x.ndim != 1:
+        raise ValueError(f"{x.shape=} and {y.shape=} not same length 1-D")
+    if not (numpy.isfinite(x).all() and numpy.isfinite(y).all()):
+        raise ValueError("x and y must be finite")
+    if keep is None:
+        keep = numpy.zeros(len(x), dtype=bool)
+    else:
+        keep = numpy.asarray(keep, dtype=bool)
+        if keep.shape != x.shape:
+            raise ValueError(f"{keep.shape=} differs from {x.shape=}")
+
+    counts, x_edges, y_edges = numpy.histogram2d(x, y, bins=bins)
+
+    # bin of each point, with points on the upper edge in the last bin
+    ix = numpy.clip(numpy.searchsorted(x_edges, x, side="right") - 1, 0, bins - 1)
+    iy = numpy.clip(numpy.searchsorted(y_edges, y, side="right") - 1, 0, bins - 1)
+
+    # outliers are points in the sparsest bins, breaking ties by standardized
+    # distance from the mean
+    dist = numpy.hypot(
+        (x - x.mean()) / (x.std() or 1), (y - y.mean()) / (y.std() or 1)
+    )
+    order = numpy.lexsort((-dist, counts[ix, iy]))
+    show = keep.copy()
+    show[order[:max_points]] = True
+
+    # bins only count points that are not shown individually
+    counts_hidden, _, _ = numpy.histogram2d(
+        x[~show], y[~show], bins=[x_edges, y_edges]
+    )
+    ibin_x, ibin_y = numpy.nonzero(counts_hidden)
+    x_edges, y_edges = x_edges.round(4), y_edges.round(4)
+    bins_df = pd.DataFrame(
+        {
+            "x_start": x_edges[ibin_x],
+            "x_end": x_edges[ibin_x + 1],
+            "y_start": y_edges[ibin_y],
+            "y_end": y_edges[ibin_y + 1],
+            "count": counts_hidden[ibin_x, ibin_y].astype(int),
+        }
+    )
+    return bins_df, show
+
+
+def bins_chart(bins_df, *, x_title, y_title, x_scale=None, y_scale=None):
+    """Chart of bins from :func:`density_bins` as rects shaded by count.
+
+    Parameters
+    ----------
+    bins_df : pandas.DataFrame
+    x_title : str
+    y_title : str
+    x_scale : None or altair.Scale
+    y_scale : None or altair.Scale
+
+    Returns
+    -------
+    altair.Chart
+
+    """
+    return (
+        alt.Chart(bins_df)
+        .encode(
+            alt.X("x_start:Q", title=x_title, scale=x_scale or alt.Undefined),
+            alt.X2("x_end"),
+            alt.Y("y_start:Q", title=y_title, scale=y_scale or alt.Undefined),
+            alt.Y2("y_end"),
+            alt.Color(
+                "count:Q",
+                title="mutations in bin",
+                scale=alt.Scale(type="log", scheme="greys"),
+            ),
+            tooltip=[alt.Tooltip("count:Q", title="mutations in bin")],
+        )
+        .mark_rect()
+    )
@@ -0,0 +1,205 @@
+"""Compact encoding of ``dms-viz`` JSONs.
+
+``configure-dms-viz`` writes the mutation data as a list of records (repeating every
+column name in every row, with floats at full precision) and inlines the full PDB
+text. :func:`compact_experiment` re-encodes an experiment to store the mutation data
+column-oriented, with string columns dictionary-encoded and float columns quantized
+to integers at a fixed number of decimal places, and to reference a shared gzipped
+PDB asset rather than inlining it. :func:`decode_experiment` reverses the encoding,
+and :func:`check_against_csv` checks decoded values against the CSV given to
+``configure-dms-viz`` (run by ``tests/test_dms_viz_compact.py``).
+
+"""
+
+
+import gzip
+import json
+
+import numpy
+
+import pandas as pd
+
+
+ENCODING = "dms-viz-compact-1"
+
+
+def encode_column(values, precision):
+    """Encode a column of mutation data.
+
+    Parameters
+    ----------
+    values : pandas.Series
+    precision : int
+        Floats are rounded to this many decimal places and stored as integers.
+
+    Returns
+    -------
+    dict
+        Has key "type" that is "dictionary" (with "dictionary" and "codes"),
+        "quantized" (with "scale" and "values", null for missing values), or "plain"
+        (with "values").
+
+    """
+    if pd.api.types.is_float_dtype(values) or values.isnull().all():
+        quantized = numpy.round(values.to_numpy(dtype=float) * 10**precision)
+        return {
+            "type": "quantized",
+            "scale": 10**-precision,
+            "values": [None if numpy.isnan(q) else int(q) for q in quantized],
+        }
+    elif pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return {"type": "plain", "values": values.tolist()}
+    else:
+        codes, dictionary = pd.factorize(values, use_na_sentinel=True)
+        return {
+            "type": "dictionary",
+            "dictionary": dictionary.tolist(),
+            "codes": [None if c < 0 else int(c) for c in codes],
+        }
+
+
+def decode_column(encoded):
+    """Decode a column encoded by :func:`encode_column` into a list."""
+    if encoded["type"] == "quantized":
+        scale = encoded["scale"]
+        return [None if v is None else v * scale for v in encoded["values"]]
+    elif encoded["type"] == "plain":
+        return encoded["values"]
+    elif encoded["type"] == "dictionary":
+        dictionary = encoded["dictionary"]
+        return [None if c is None else dictionary[c] for c in encoded["codes"]]
+    else:
+        raise ValueError(f"invalid {encoded['type']=}")
+
+
+def write_pdb_asset(pdb_file, asset_file):
+    """Write gzipped PDB asset, without a timestamp so it is reproducible."""
+    with open(pdb_file, "rb") as f_in, open(asset_file, "wb") as f_out:
+        f_out.write(gzip.compress(f_in.read(), mtime=0))
+
+
+def compact_experiment(experiment, precision, pdb_asset):
+    """Compact encoding of an experiment in a ``configure-dms-viz`` JSON.
+
+    Parameters
+    ----------
+    experiment : dict
+        Experiment as written by ``configure-dms-viz format``.
+    precision : int
+        Decimal places kept for float columns.
+    pdb_asset : str
+        Path (relative to the compact JSON) of the gzipped PDB asset, which
+        replaces the inlined PDB.
+
+    Returns
+    -------
+    dict
+
+    """
+    compact = {
+        key: val for key, val in experiment.items() if key not in {"mut_metric_df", "pdb"}
+    }
+    mut_metric_df = pd.DataFrame.from_records(experiment["mut_metric_df"])
+    compact["encoding"] = ENCODING
+    compact["pdb_asset"] = pdb_asset
+    compact["mut_metric_columns"] = {
+        "n_rows": len(mut_metric_df),
+        "columns": {
+            col: encode_column(mut_metric_df[col], precision)
+            for col in mut_metric_df.columns
+        },
+    }
+    return compact
+
+
+def decode_experiment(compact):
+    """Decode the mutation data in an experiment from :func:`compact_experiment`.
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    """
+    if compact.get("encoding") != ENCODING:
+        raise ValueError(f"not encoded with {ENCODING}")
+    columns = compact["mut_metric_columns"]["columns"]
+    df = pd.DataFrame({col: decode_column(encoded) for col, encoded in columns.items()})
+    assert len(df) == compact["mut_metric_columns"]["n_rows"]
+    return df
+
+
+def write_compact_json(dms_viz_json, compact_json, precision, pdb_asset):
+    """Write compact version of a ``configure-dms-viz`` JSON.
+
+    Parameters
+    ----------
+    dms_viz_json : str
+        JSON from ``configure-dms-viz format``, keyed by the visualization name.
+    compact_json : str
+        Compact JSON written here.
+    precision : int
+    pdb_asset : str
+        Path of gzipped PDB asset relative to `compact_json`.
+
+    Returns
+    -------
+    dict
+        The compact JSON contents.
+
+    """
+    with open(dms_viz_json) as f:
+        experiments = json.load(f)
+    compact = {
+        name: compact_experiment(experiment, precision, pdb_asset)
+        for name, experiment in experiments.items()
+    }
+    with open(compact_json, "w") as f:
+        json.dump(compact, f, sort_keys=True, separators=(",", ":"))
+    return compact
+
+
+def check_against_csv(compact, input_data_csv, precision):
+    """Check decoded data matches CSV given to ``configure-dms-viz`` to `precision`.
+
+    Every decoded row must be in the CSV (``configure-dms-viz`` drops some rows, such
+    as those with missing metric values), and every float column must match to within
+    half of the last kept decimal place.
+
+    Parameters
+    ----------
+    compact : dict
+        As returned by :func:`write_compact_json`.
+    input_data_csv : str
+    precision : int
+
+    """
+    source = pd.read_csv(input_data_csv).rename(columns={"site": "reference_site"})
+    tol = 0.5 * 10**-precision * (1 + 1e-6)
+    for name, experiment in compact.items():
+        decoded = decode_experiment(experiment)
+        float_cols = [
+            col
+            for col, encoded in experiment["mut_metric_columns"]["columns"].items()
+            if encoded["type"] == "quantized" and col in source.columns
+        ]
+        key_cols = [
+            c for c in decoded.columns if c not in float_cols and c in source.columns
+        ]
+        merged = decoded.merge(
+            source[key_cols + float_cols],
+            on=key_cols,
+            how="left",
+            validate="one_to_one",
+            suffixes=("", "_source"),
+            indicator=True,
+        )
+        if (merged["_merge"] != "both").any():
+            raise ValueError(f"{name}: decoded rows not in {input_data_csv=}")
+        for col in float_cols:
+            decoded_vals = merged[col].astype(float)
+            source_vals = merged[f"{col}_source"].astype(float)
+            if not (decoded_vals.isnull() == source_vals.isnull()).all():
+                raise ValueError(f"{name}: missing values in {col=} differ from source")
+            max_diff = (decoded_vals - source_vals).abs().max()
+            if max_diff > tol:
+                raise ValueError(f"{name}: {col=} differs from source by {max_diff}")
@@ -0,0 +1,491 @@
+"""Prepare inputs for and run ``configure-dms-viz`` for many visualizations.
+
+Visualizations in ``data/dms_viz_config.yaml`` often share the same data CSV, sitemap,
+and structure. :class:`DmsVizBatch` reads and validates each of these once, and then
+formats the data and runs ``configure-dms-viz format`` for each visualization, in
+parallel threads since most of the time is spent in the ``configure-dms-viz``
+subprocess.
+
+Used by ``scripts/configure_dms_viz.py`` for the ``configure_dms_viz`` rule.
+
+"""
+
+
+import concurrent.futures
+import functools
+import os
+import shutil
+import subprocess
+import sys
+
+import matplotlib.colors
+
+import pandas as pd
+
+import seaborn
+
+import dms_viz_compact
+import pdb_cache
+
+
+# allowed optional params from:
+# https://dms-viz.github.io/dms-viz-docs/preparing-data/command-line-api/#configure-dms-viz-format
+ALLOWED_PARAMS = [
+    "condition",
+    "metric-name",
+    "condition-name",
+    "tooltip-cols",
+    "filter-cols",
+    "filter-limits",
+    "heatmap-limits",
+    "included-chains",
+    "excluded-chains",
+    "alphabet",
+    "colors",
+    "negative-colors",
+    "exclude-amino-acids",
+    "description",
+    "title",
+    "floor",
+    "summary-stat",
+]
+
+SITEMAP_REQ_COLS = ["reference_site", "sequential_site", "protein_site", "chains"]
+
+
+def hex_color_palette(num_colors):
+    """List of `num_colors` hex colors."""
+    colors = seaborn.color_palette("hls", num_colors)
+    return [matplotlib.colors.to_hex(color) for color in colors]
+
+
+def read_sitemap(sitemap_csv, data, log):
+    """Read sitemap, compare its sites to `data`, and add wildtypes from `data`.
+
+    Parameters
+    ----------
+    sitemap_csv : str
+        Has columns "reference_site", "sequential_site", "protein_site", "chains".
+    data : pandas.DataFrame
+        DMS data with columns "site" and "wildtype".
+    log : file-like
+        Where comparisons are written.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Sitemap with "chains" as lists and a "wildtype" column.
+
+    """
+    print(f"Reading the sitemap from {sitemap_csv=}", file=log)
+    sitemap = pd.read_csv(sitemap_csv, dtype={"protein_site": str}).assign(
+        chains=lambda x: x["chains"].map(lambda c: [] if pd.isnull(c) else c.split())
+    )
+    if not set(sitemap.columns).issubset(SITEMAP_REQ_COLS):
+        raise ValueError(f"{sitemap_csv} has {sitemap.columns}, lacks {SITEMAP_REQ_COLS=}")
+    sitemap = sitemap[SITEMAP_REQ_COLS]
+
+    assert len(sitemap) == sitemap["reference_site"].nunique()
+    assert len(sitemap) == sitemap["sequential_site"].nunique()
+
+    print("\nComparing `site` in data to `reference_site` in sitemap:", file=log)
+    if sitemap["reference_site"].dtype != data["site"].dtype:
+        raise ValueError(f'{sitemap["reference_site"].dtype=}, {data["site"].dtype=}')
+
+    nshared = len(set(sitemap["reference_site"]).intersection(data["site"]))
+    print(f"\n{nshared} sites in both data and sitemap", file=log)
+
+    sitemap_only = sitemap[~sitemap["reference_site"].isin(data["site"])]
+    print(f"\n{len(sitemap_only)} sites in sitemap but not data", file=log)
+    if len(sitemap_only):
+        print(sitemap_only.reset_index(drop=True).to_string(), file=log)
+
+    data_only = data[~data["site"].isin(sitemap["reference_site"])][["site"]]
+    data_only = data_only.drop_duplicates().reset_index(drop=True)
+    print(f"\n{len(data_only)} sites in data but not sitemap", file=log)
+    if len(data_only):
+        print(data_only.to_string(), file=log)
+
+    return sitemap.merge(
+        data[["site", "wildtype"]].drop_duplicates().rename(
+            columns={"site": "reference_site"}
+        ),
+        on="reference_site",
+        validate="one_to_one",
+        how="left",
+    )
+
+
+def chain_sitemap(sitemap, structure_chains, pdb_residues, opt_params, log):
+    """Restrict sitemap to included chains and compare wildtypes to structure.
+
+    Parameters
+    ----------
+    sitemap : pandas.DataFrame
+        As returned by :func:`read_sitemap`.
+    structure_chains : list
+        All chains in the structure.
+    pdb_residues : pandas.DataFrame
+        Residues in the structure, as from :meth:`pdb_cache.Structure.residues`.
+    opt_params : dict
+        Optional ``configure-dms-viz`` params, may have "included-chains" and
+        "excluded-chains".
+    log : file-like
+
+    Returns
+    -------
+    pandas.DataFrame
+        Sitemap with "chains" as space-delimited strings of included chains.
+
+    """
+    print(f"PDB has {structure_chains=}", file=log)
+
+    if "included-chains" in opt_params:
+        included_chains = opt_params["included-chains"].split()
+        print(f"Included chains for mapping DMS data: {included_chains=}", file=log)
+        assert set(included_chains).issubset(structure_chains)
+    else:
+        included_chains = structure_chains
+        print("Including all chains for mapping DMS data", file=log)
+
+    if "excluded-chains" in opt_params:
+        if not set(opt_params["excluded-chains"].split()).issubset(structure_chains):
+            raise ValueError(
+                f"{opt_params['excluded-chains']=} not in {structure_chains=}"
+            )
+
+    sitemap_chains = set().union(*sitemap["chains"])
+    print(f"The chains specified in the sitemap are {sitemap_chains=}", file=log)
+    if sitemap_chains - set(included_chains):
+        print(
+            "Removing the following sitemap chains which are not in included-chains:\n"
+            + str(sitemap_chains - set(included_chains)),
+            file=log,
+        )
+        sitemap = sitemap.assign(
+            chains=lambda x: x["chains"].map(
+                lambda cs: [c for c in cs if c in included_chains]
+            )
+        )
+    elif set(included_chains) - sitemap_chains:
+        raise ValueError(f"some {included_chains=} not in {sitemap_chains=}")
+    sitemap = sitemap.assign(chains=lambda x: x["chains"].map(lambda c: " ".join(c)))
+
+    # get wildtype residue at each site
+    pdb_df = pdb_residues.query("chain in @included_chains")
+    if pdb_df["aa"].isnull().any():
+        raise ValueError(f"non-standard residues:\n{pdb_df[pdb_df['aa'].isnull()]}")
+    pdb_df = pdb_df.assign(protein_site=lambda x: x["resnum"].astype(str)).rename(
+        columns={"aa": "pdb_aa"}
+    )[["chain", "protein_site", "pdb_aa"]]
+    assert pdb_df["protein_site"].dtype == sitemap["protein_site"].dtype
+
+    # compare wildtypes in DMS data and actual PDB
+    for chainset, chainset_df in sitemap.query("chains != ''").groupby(
+        "chains", dropna=True
+    ):
+        chainset = chainset.split()
+        print(
+            f"\nComparing wildtype residues in DMS data and PDB for {chainset=}",
+            file=log,
+        )
+        pdb_chainset_df = (
+            pdb_df
+            .query("chain in @chainset")
+            .groupby("protein_site", as_index=False)
+            .aggregate(
+                pdb_aa=pd.NamedAgg("pdb_aa", lambda s: " ".join(s.unique())),
+                n_pdb_aas=pd.NamedAgg("pdb_aa", "nunique"),
+            )
+        )
+        if (pdb_chainset_df["n_pdb_aas"] != 1).any():
+            raise ValueError(
+                "PDB does not have same amino-acid at all chains in {chainset=}:\n"
+                + str(pdb_chainset_df.query("n_pdb_aas != 1"))
+            )
+        df = (
+            chainset_df
+            .merge(
+                pdb_chainset_df.drop(columns="n_pdb_aas"),
+                on="protein_site",
+                how="outer",
+                validate="one_to_one",
+            )
+            .assign(
+                differ=lambda x: (
+                    (x["wildtype"] != x["pdb_aa"])
+                    & x["pdb_aa"].notnull()
+                    & x["wildtype"].notnull()
+                )
+            )
+            .sort_values("sequential_site")
+        )
+        assert (df["wildtype"].notnull() | df["pdb_aa"].notnull()).all()
+        print(
+            "Comparing wildtype amino acids for sites with DMS data versus sites in PDB:\n"
+            f"  - sites with same amino acid: {sum(df['wildtype'] == df['pdb_aa'])}\n"
+            f"  - sites with different amino acid: {df['differ'].sum()}\n"
+            f"  - sites missing in DMS data: {df['wildtype'].isnull().sum()}\n"
+            f"  - sites missing in PDB: {df['pdb_aa'].isnull().sum()}",
+            file=log,
+        )
+        if df["differ"].any():
+            print(
+                "Here are sites with different amino acids between DMS data and PDB:\n"
+                + df.query("differ").drop(columns="differ").reset_index(drop=True).to_string(),
+                file=log,
+            )
+
+    return sitemap
+
+
+def format_data(data, metric, melt_condition_metric_cols, opt_params):
+    """Get data and optional params as passed to ``configure-dms-viz``.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        DMS data, not modified.
+    metric : str
+    melt_condition_metric_cols : None or list
+    opt_params : dict
+
+    Returns
+    -------
+    data_to_use : pandas.DataFrame
+        Data with only the columns used by ``configure-dms-viz``.
+    opt_params : dict
+        Copy of optional params, with filter columns renamed to remove spaces and
+        colors for each condition.
+
+    """
+    opt_params = {
+        key: val.copy() if isinstance(val, dict) else val
+        for key, val in opt_params.items()
+    }
+    if not set(opt_params).issubset(ALLOWED_PARAMS):
+        raise ValueError(f"invalid `opt_params` {set(opt_params) - set(ALLOWED_PARAMS)=}")
+
+    # cannot have spaces in filter-cols, so rename columns with underscore if needed
+    if "filter-cols" in opt_params:
+        for col, name in list(opt_params["filter-cols"].items()):
+            if " " in col:
+                new_col = col.replace(" ", "_")
+                assert new_col not in data.columns, f"{new_col=}, {data.columns=}"
+                data = data.assign(**{new_col: data[col]})
+                opt_params["filter-cols"][new_col] = name
+                del opt_params["filter-cols"][col]
+                if "filter-limits" in opt_params:
+                    opt_params["filter-limits"][new_col] = opt_params["filter-limits"][col]
+                    del opt_params["filter-limits"][col]
+
+    # get required columns
+    data_cols = ["site", "wildtype", "mutant"]
+    for param in ["tooltip-cols", "filter-cols"]:
+        if param in opt_params:
+            data_cols += opt_params[param]
+    if not set(data_cols).issubset(data.columns):
+        raise ValueError(f"{data_cols=} not in {data.columns=}")
+
+    # melt data if needed
+    if melt_condition_metric_cols:
+        order_map = {c: i for (i, c) in enumerate(melt_condition_metric_cols)}
+        if not set(melt_condition_metric_cols).issubset(data.columns):
+            raise ValueError(f"{melt_condition_metric_cols} not in {data.columns=}")
+        if "condition" not in opt_params:
+            raise ValueError(
+                f"`melt_condition_metric_cols` requires 'condition' in {opt_params=}"
+            )
+        data_to_use = (
+            data.melt(
+                id_vars=data_cols,
+                value_vars=melt_condition_metric_cols,
+                var_name=opt_params["condition"],
+                value_name=metric,
+            )
+            .sort_values(opt_params["condition"], key=lambda col: col.map(order_map))
+        )
+    else:
+        data_to_use = data
+    data_cols.append(metric)
+    if "condition" in opt_params:
+        data_cols.append(opt_params["condition"])
+    if not set(data_cols).issubset(data_to_use.columns):
+        raise ValueError(f"{data_cols=} not in {data_to_use.columns=}")
+
+    # if there are more than 4 conditions, need to define more colors as
+    # `configure-dms-viz` only handles up to four by default
+    if "colors" not in opt_params:
+        if "condition" in opt_params:
+            nconditions = data_to_use[opt_params["condition"]].nunique()
+        else:
+            nconditions = 1
+        opt_params["colors"] = ",".join(hex_color_palette(nconditions))
+
+    return data_to_use[data_cols], opt_params
+
+
+class DmsVizBatch:
+    """Configure many ``dms-viz`` visualizations, reading shared inputs once.
+
+    Parameters
+    ----------
+    vizs : dict
+        Keyed by visualization name, values are dicts with the keys in
+        ``data/dms_viz_config.yaml`` ("name", "data_csv", "sitemap_csv", "metric",
+        "melt_condition_metric_cols", "opt_params", and optionally
+        "smoothed_site_effects_csv"), the cached structure files "structure_pdb" and
+        "structure_npy", and the output files "dms_viz_json", "pdb_file",
+        "input_data_csv", "input_sitemap_csv", and "log". If `compact_precision` is
+        set, also has output files "compact_json" and "pdb_asset" (the gzipped
+        structure, which can be shared among visualizations).
+    compact_precision : None or int
+        If set, also write compact JSONs (see :mod:`dms_viz_compact`) with floats
+        kept to this many decimal places.
+
+    """
+
+    def __init__(self, vizs, compact_precision=None):
+        """See main class docstring."""
+        self.vizs = vizs
+        self.compact_precision = compact_precision
+
+    @functools.cache
+    def _data(self, data_csv, smoothed_site_effects_csv):
+        data = pd.read_csv(data_csv)
+        if smoothed_site_effects_csv:
+            smoothed = pd.read_csv(smoothed_site_effects_csv).drop(
+                columns="sequential_site"
+            )
+            assert not set(smoothed.columns[1:]).intersection(data.columns)
+            data = data.merge(smoothed, on="site", how="left", validate="many_to_one")
+        return data
+
+    @functools.cache
+    def _sitemap(self, data_csv, sitemap_csv):
+        # shared by several visualizations, so comparison goes to the main log
+        return read_sitemap(sitemap_csv, self._data(data_csv, None), sys.stdout)
+
+    @functools.cache
+    def _structure(self, structure_npy):
+        structure = pdb_cache.Structure.load(structure_npy)
+        return structure.chains, structure.select().residues()
+
+    def _groups(self):
+        """Visualizations grouped by the data, sitemap, and structure they share."""
+        groups = {}
+        for viz_name, viz in self.vizs.items():
+            key = (viz["data_csv"], viz["sitemap_csv"], viz["structure_npy"])
+            groups.setdefault(key, []).append(viz_name)
+        return groups
+
+    def configure_viz(self, viz_name):
+        """Configure one visualization, writing its output files.
+
+        Parameters
+        ----------
+        viz_name : str
+
+        Returns
+        -------
+        subprocess.CompletedProcess
+            The ``configure-dms-viz`` run.
+
+        """
+        viz = self.vizs[viz_name]
+        with open(viz["log"], "w") as log:
+            print(f"Configuring {viz_name}, sitemap comparison is in main log", file=log)
+            data = self._data(viz["data_csv"], viz.get("smoothed_site_effects_csv"))
+            opt_params = dict(viz["opt_params"])
+            if viz.get("smoothed_site_effects_csv"):
+                smoothed_cols = [
+                    c for c in data.columns if c.startswith("smoothed ")
+                ]
+                opt_params["tooltip-cols"] = {
+                    **opt_params.get("tooltip-cols", {}),
+                    **{c: c for c in smoothed_cols},
+                }
+            sitemap = self._sitemap(viz["data_csv"], viz["sitemap_csv"])
+            chains, pdb_residues = self._structure(viz["structure_npy"])
+            sitemap = chain_sitemap(sitemap, chains, pdb_residues, opt_params, log)
+
+            print(f"\nCopying {viz['structure_pdb']=} to {viz['pdb_file']=}", file=log)
+            shutil.copyfile(viz["structure_pdb"], viz["pdb_file"])
+
+            data_to_use, opt_params = format_data(
+                data, viz["metric"], viz["melt_condition_metric_cols"], opt_params
+            )
+
+            # write the sitemap and data, keeping only sites with a protein site
+            sitemap = sitemap.query("protein_site.notnull()")
+            print(f"Writing sitemap to {viz['input_sitemap_csv']=}", file=log)
+            sitemap.to_csv(viz["input_sitemap_csv"], index=False)
+            print(f"Writing data to {viz['input_data_csv']=}", file=log)
+            data_to_use[
+                data_to_use["site"].isin(set(sitemap["reference_site"]))
+            ].to_csv(viz["input_data_csv"], index=False, float_format="%.4g")
+
+            cmds = [
+                "configure-dms-viz",
+                "format",
+                "--name", viz["name"],
+                "--input", viz["input_data_csv"],
+                "--metric", viz["metric"],
+                "--sitemap", viz["input_sitemap_csv"],
+                "--structure", viz["pdb_file"],
+                "--output", viz["dms_viz_json"],
+            ]
+            for key, val in opt_params.items():
+                cmds += [f"--{key}", str(val)]
+
+            print(f"\nRunning the following cmds:\n{' '.join(cmds)}\n", file=log)
+            res = subprocess.run(cmds, capture_output=True, text=True)
+            res_str = "\n\n".join(
+                f"{attr}:\n{getattr(res, attr)}"
+                for attr in ["returncode", "args", "stdout", "stderr"]
+            )
+            if res.returncode != 0:
+                raise RuntimeError(f"Command for {viz_name} failed:\n\n{res_str}")
+            print(f"Command succeeded:\n\n{res_str}", file=log)
+
+            if self.compact_precision is not None:
+                pdb_asset = os.path.relpath(
+                    viz["pdb_asset"], os.path.dirname(viz["compact_json"])
+                )
+                print(f"Writing compact JSON to {viz['compact_json']=}", file=log)
+                dms_viz_compact.write_compact_json(
+                    viz["dms_viz_json"],
+                    viz["compact_json"],
+                    self.compact_precision,
+                    pdb_asset,
+                )
+        return res
+
+    def configure_all(self, max_workers=1):
+        """Configure all visualizations.
+
+        Shared inputs are read once per group before the visualizations in that
+        group are configured by a pool of `max_workers` threads.
+
+        """
+        groups = self._groups()
+        print(f"Configuring {len(self.vizs)} visualizations in {len(groups)} groups")
+        if self.compact_precision is not None:
+            pdb_assets = {(v["structure_pdb"], v["pdb_asset"]) for v in self.vizs.values()}
+            for structure_pdb, pdb_asset in sorted(pdb_assets):
+                print(f"Writing {structure_pdb=} to shared {pdb_asset=}")
+                dms_viz_compact.write_pdb_asset(structure_pdb, pdb_asset)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {}
+            for (data_csv, sitemap_csv, structure_npy), viz_names in groups.items():
+                print(f"Reading {data_csv=}, {sitemap_csv=}, {structure_npy=}")
+                self._sitemap(data_csv, sitemap_csv)
+                self._structure(structure_npy)
+                for viz_name in viz_names:
+                    self._data(
+                        data_csv, self.vizs[viz_name].get("smoothed_site_effects_csv")
+                    )
+                    futures[pool.submit(self.configure_viz, viz_name)] = viz_name
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                print(f"Configured {futures[future]}")
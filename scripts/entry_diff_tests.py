@@ -0,0 +1,481 @@
+"""Permutation tests and bootstrap confidence intervals for site differences in entry.
+
+The site-level metrics computed by :meth:`entry_diffs.EntryDiffs.site_diffs` are
+point estimates. Here the data are resampled many times, and the metrics for all
+resamples, sites, and pairs of cells are computed at once by broadcasting
+:func:`entry_diffs.site_metrics` over a leading resample dimension. Resamples are
+processed in chunks to bound memory. Two ways of resampling are implemented:
+
+  - :class:`MutationResampler` resamples the amino acids at each site. For the
+    permutation test the effects of each mutation in the two cells are randomly
+    swapped, and for the bootstrap the amino acids at each site are drawn with
+    replacement.
+  - :class:`SelectionResampler` resamples the replicate selections (as in
+    ``results/func_effects/by_selection``) that are averaged to get the effects in
+    each cell. For the permutation test the selections are randomly re-assigned
+    between the two cells (only among selections covering the same sites), and for
+    the bootstrap the selections for each cell are drawn with replacement.
+
+P-values are two-sided, computed as the fraction of permutations with an absolute
+value of the metric at least as large as observed (with a pseudocount of one).
+Confidence intervals are bootstrap percentile intervals.
+
+"""
+
+
+import abc
+import argparse
+import os
+import warnings
+
+import numpy
+
+import pandas as pd
+
+import entry_diffs
+import fast_csv
+import replicate_averages
+
+
+def _nanquantiles(values, qs):
+    """Quantiles along first axis ignoring `nan`, vectorized over other axes.
+
+    Same as ``numpy.nanquantile(values, qs, axis=0)`` with linear interpolation, but
+    does not loop over the other axes.
+
+    """
+    values = numpy.sort(values, axis=0)  # nan sorted to end
+    n = (~numpy.isnan(values)).sum(axis=0)
+    quantiles = []
+    for q in qs:
+        pos = q * numpy.maximum(n - 1, 0)
+        lo = numpy.floor(pos).astype(int)
+        hi = numpy.minimum(lo + 1, numpy.maximum(n - 1, 0))
+        v_lo = numpy.take_along_axis(values, lo[None], axis=0)[0]
+        v_hi = numpy.take_along_axis(values, hi[None], axis=0)[0]
+        quantiles.append(numpy.where(n > 0, v_lo + (pos - lo) * (v_hi - v_lo), numpy.nan))
+    return quantiles
+
+
+def _nanmedian(values, axis):
+    """Same as ``numpy.nanmedian``, but faster when `axis` is short.
+
+    Values along `axis` are sorted with an odd-even transposition network of
+    element-wise minima and maxima over the other axes, rather than sorting each
+    short slice separately.
+
+    """
+    values = numpy.moveaxis(values, axis, 0)
+    n = (~numpy.isnan(values)).sum(axis=0)
+    k = len(values)
+    if k > 16:
+        ordered = numpy.sort(values, axis=0)  # nan sorted to end
+    else:
+        ordered = list(numpy.where(numpy.isnan(values), numpy.inf, values))
+        for step in range(k):
+            for i in range(step % 2, k - 1, 2):
+                ordered[i], ordered[i + 1] = (
+                    numpy.minimum(ordered[i], ordered[i + 1]),
+                    numpy.maximum(ordered[i], ordered[i + 1]),
+                )
+        ordered = numpy.stack(ordered)
+    lo = numpy.take_along_axis(ordered, numpy.maximum((n - 1) // 2, 0)[None], axis=0)[0]
+    hi = numpy.take_along_axis(ordered, numpy.maximum(n // 2, 0)[None], axis=0)[0]
+    return numpy.where(n > 0, (lo + hi) / 2, numpy.nan)
+
+
+class _Resampler(abc.ABC):
+    """Base class for resampling site differences; see subclasses."""
+
+    def __init__(self, diffs):
+        """See subclass docstrings."""
+        self.diffs = diffs
+        self.sites, tensor, self.is_wildtype = diffs.site_tensor()
+        self._i, self._j = diffs._pair_indices()
+        # pairs x sites x amino acids
+        self.x = numpy.moveaxis(tensor[:, :, self._i], -1, 0)
+        self.y = numpy.moveaxis(tensor[:, :, self._j], -1, 0)
+
+    @abc.abstractmethod
+    def observed(self):
+        """Observed metrics, each a pairs x sites array."""
+
+    @abc.abstractmethod
+    def permutations(self, n, rng):
+        """Metrics for `n` permutations, each a n x pairs x sites array."""
+
+    @abc.abstractmethod
+    def bootstraps(self, n, rng):
+        """Metrics for `n` bootstrap samples, each a n x pairs x sites array."""
+
+    def test(self, n_permutations=1000, n_bootstraps=1000, ci=0.95, seed=1, chunksize=50):
+        """Permutation p-values and bootstrap confidence intervals.
+
+        Parameters
+        ----------
+        n_permutations : int
+        n_bootstraps : int
+        ci : float
+            Width of the confidence intervals.
+        seed : int
+            Seed for the random number generator, so results are reproducible.
+        chunksize : int
+            Compute metrics for this many resamples at a time.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns "site", "sequential_site", "region", and for each metric its
+            observed value and columns "{metric} p-value", "{metric} CI lower", and
+            "{metric} CI upper", then "cell_1" and "cell_2". Rows are grouped by pair
+            of cells, then sorted by site. Values are `nan` when the metric is
+            undefined (eg, the mean difference at a site with only the wildtype).
+
+        """
+        if not (0 < ci < 1):
+            raise ValueError(f"invalid {ci=}")
+        rng = numpy.random.default_rng(seed)
+        observed = self.observed()
+        defined = {m: numpy.isfinite(v) for m, v in observed.items()}
+
+        n_extreme = {m: numpy.zeros(v.shape, dtype=int) for m, v in observed.items()}
+        for start in range(0, n_permutations, chunksize):
+            null = self.permutations(min(chunksize, n_permutations - start), rng)
+            for m, v in null.items():
+                # small tolerance so ties in floating point are counted as extreme
+                n_extreme[m] += (
+                    numpy.abs(v) >= numpy.abs(observed[m]) * (1 - 1e-9) - 1e-12
+                ).sum(axis=0)
+
+        boots = {m: [] for m in observed}
+        for start in range(0, n_bootstraps, chunksize):
+            for m, v in self.bootstraps(min(chunksize, n_bootstraps - start), rng).items():
+                boots[m].append(v)
+        alpha = (1 - ci) / 2
+
+        values = {}
+        for m, v in observed.items():
+            values[m] = v
+            values[f"{m} p-value"] = numpy.where(
+                defined[m], (n_extreme[m] + 1) / (n_permutations + 1), numpy.nan
+            )
+            lower, upper = _nanquantiles(numpy.concatenate(boots[m]), [alpha, 1 - alpha])
+            values[f"{m} CI lower"] = numpy.where(defined[m], lower, numpy.nan)
+            values[f"{m} CI upper"] = numpy.where(defined[m], upper, numpy.nan)
+        return self.diffs.pair_frame(self.sites, values)
+
+
+class MutationResampler(_Resampler):
+    """Resample amino acids at each site.
+
+    Parameters
+    ----------
+    diffs : entry_diffs.EntryDiffs
+
+    """
+
+    def _metrics(self, x, y, weights=None):
+        return entry_diffs.site_metrics(
+            x, y, self.is_wildtype, self.diffs.floor, weights=weights
+        )
+
+    def observed(self):
+        """Observed metrics, each a pairs x sites array."""
+        return self._metrics(self.x, self.y)
+
+    def permutations(self, n, rng):
+        """Metrics after randomly swapping effects of each mutation between cells."""
+        swap = rng.random((n, *self.x.shape)) < 0.5
+        return self._metrics(
+            numpy.where(swap, self.y, self.x), numpy.where(swap, self.x, self.y)
+        )
+
+    def bootstraps(self, n, rng):
+        """Metrics after drawing amino acids at each site with replacement."""
+        both = ~numpy.isnan(self.x) & ~numpy.isnan(self.y)
+        n_both = both.sum(axis=-1)
+        weights = rng.multinomial(
+            n_both, both / numpy.maximum(n_both, 1)[..., None], size=(n, *n_both.shape)
+        )
+        return self._metrics(self.x, self.y, weights=weights)
+
+
+class SelectionResampler(_Resampler):
+    """Resample the replicate selections averaged to get effects in each cell.
+
+    Effects in each resample are recomputed by averaging the selections, but only
+    for mutations that have effects for both cells in `diffs` (so the filters used
+    to make the summary still apply).
+
+    Parameters
+    ----------
+    diffs : entry_diffs.EntryDiffs
+    selections : dict
+        Keyed by cell labels in `diffs`. Values are dicts keyed by CSV files (eg, in
+        ``results/func_effects/by_selection``) with effects of mutations in each
+        selection, with values the sequential sites to use from that selection (or
+        `None` for all sites).
+    avg_method : {"median", "mean"}
+        How effects are averaged across selections, as in ``avg_func_effects``.
+    effect_col : str
+        Column in the CSVs with the effect of each mutation.
+
+    """
+
+    def __init__(self, diffs, selections, avg_method="median", effect_col="functional_effect"):
+        """See main class docstring."""
+        super().__init__(diffs)
+        if set(selections) != set(diffs.cells):
+            raise ValueError(f"{selections.keys()=} do not match {diffs.cells=}")
+        if avg_method == "median":
+            self._avg = _nanmedian
+        elif avg_method == "mean":
+            self._avg = numpy.nanmean
+        else:
+            raise ValueError(f"invalid {avg_method=}")
+
+        codec = diffs.codec
+        csvs = []
+        cell_index = []
+        stratum_keys = []
+        for cell in diffs.cells:
+            for csv, sites in selections[cell].items():
+                csvs.append((csv, sites))
+                cell_index.append(diffs.cells.index(cell))
+                # selections are only exchangeable if they cover the same sites
+                stratum_keys.append(None if sites is None else tuple(sorted(sites)))
+        cell_index = numpy.array(cell_index)
+
+        # selections x (sites x amino acids)
+        selection_effects = numpy.full(
+            (len(csvs), len(self.sites) * codec.n_aas), numpy.nan
+        )
+        site_index = pd.Series(
+            numpy.arange(len(self.sites)), index=diffs.site_info(self.sites)["site"]
+        )
+        for k, (csv, sites) in enumerate(csvs):
+            df = pd.read_csv(csv)
+            df = df[
+                df["mutant"].isin(list(codec.alphabet))
+                & df[effect_col].notnull()
+                & df["site"].isin(site_index.index)
+            ]
+            indices = site_index.loc[df["site"]].to_numpy()
+            if sites is not None:
+                in_sites = numpy.isin(self.sites[indices], list(sites))
+                df = df[in_sites]
+                indices = indices[in_sites]
+            selection_effects[
+                k, indices * codec.n_aas + codec.aa_indices(df["mutant"].to_numpy())
+            ] = df[effect_col].to_numpy()
+
+        # For each stratum, keep cell of each selection, the (site x amino acid)
+        # columns with data, and a selections x columns array of effects.
+        self._strata = []
+        for key in dict.fromkeys(stratum_keys):
+            members = numpy.array([s == key for s in stratum_keys])
+            cols = numpy.flatnonzero(~numpy.isnan(selection_effects[members]).all(axis=0))
+            self._strata.append(
+                (
+                    cell_index[members],
+                    cols,
+                    selection_effects[members][:, cols],
+                )
+            )
+        all_cols = numpy.concatenate([cols for _, cols, _ in self._strata])
+        if len(all_cols) != len(numpy.unique(all_cols)):
+            raise ValueError("selections must cover either the same or disjoint sites")
+
+        # only use mutations with effects in both cells of each pair
+        self._in_pair = ~numpy.isnan(self.x) & ~numpy.isnan(self.y)
+
+    def _metrics(self, effects_i, effects_j):
+        """Metrics from effects with shape resamples x pairs x sites x amino acids."""
+        return entry_diffs.site_metrics(
+            numpy.where(self._in_pair, effects_i, numpy.nan),
+            numpy.where(self._in_pair, effects_j, numpy.nan),
+            self.is_wildtype,
+            self.diffs.floor,
+        )
+
+    def _average(self, choices):
+        """Average effects of chosen selections.
+
+        Parameters
+        ----------
+        choices : list
+            For each stratum, indices of selections within that stratum to average
+            over the last axis. Leading axes (eg, resamples) must be the same for all
+            strata.
+
+        Returns
+        -------
+        numpy.ndarray
+            Leading axes of `choices` followed by sites and amino acids.
+
+        """
+        lead = choices[0].shape[:-1]
+        avg = numpy.full((*lead, len(self.sites) * self.diffs.codec.n_aas), numpy.nan)
+        for (_, cols, effects), chosen in zip(self._strata, choices):
+            if chosen.shape[-1]:
+                with warnings.catch_warnings():
+                    # all-nan slices for mutations not in chosen selections
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    avg[..., cols] = self._avg(effects[chosen], axis=-2)
+        return avg.reshape(*lead, len(self.sites), self.diffs.codec.n_aas)
+
+    def observed(self):
+        """Observed metrics, each a pairs x sites array."""
+        effects = numpy.stack(
+            [
+                self._average([numpy.flatnonzero(cells == c) for cells, _, _ in self._strata])
+                for c in range(len(self.diffs.cells))
+            ]
+        )
+        return self._metrics(effects[self._i], effects[self._j])
+
+    def permutations(self, n, rng):
+        """Metrics after randomly re-assigning selections between cells in each pair."""
+        effects_i = []
+        effects_j = []
+        for i, j in zip(self._i, self._j):
+            choices_i = []
+            choices_j = []
+            for cells, _, _ in self._strata:
+                n_i = (cells == i).sum()
+                pool = numpy.concatenate(
+                    [numpy.flatnonzero(cells == i), numpy.flatnonzero(cells == j)]
+                )
+                shuffled = pool[rng.random((n, len(pool))).argsort(axis=1)]
+                choices_i.append(shuffled[:, :n_i])
+                choices_j.append(shuffled[:, n_i:])
+            effects_i.append(self._average(choices_i))
+            effects_j.append(self._average(choices_j))
+        return self._metrics(numpy.stack(effects_i, axis=1), numpy.stack(effects_j, axis=1))
+
+    def bootstraps(self, n, rng):
+        """Metrics after drawing selections for each cell with replacement."""
+        effects = []
+        for c in range(len(self.diffs.cells)):
+            choices = []
+            for cells, _, _ in self._strata:
+                pool = numpy.flatnonzero(cells == c)
+                choices.append(pool[rng.integers(max(len(pool), 1), size=(n, len(pool)))])
+            effects.append(self._average(choices))
+        effects = numpy.stack(effects, axis=1)
+        return self._metrics(effects[:, self._i], effects[:, self._j])
+
+
+def selections_from_config(func_effects_config, conditions, by_selection_dir):
+    """Get selections for :class:`SelectionResampler` from functional effects config.
+
+    Parameters
+    ----------
+    func_effects_config : dict
+        Configuration like ``data/func_effects_config.yml``.
+    conditions : dict
+        Keyed by cell label, values are conditions in ``avg_func_effects``.
+    by_selection_dir : str
+        Directory with ``{selection}_func_effects.csv`` files.
+
+    Returns
+    -------
+    selections : dict
+    avg_method : str
+        The averaging method, which must be the same for all conditions.
+
+    """
+    selections = {}
+    avg_methods = set()
+    for cell, condition in conditions.items():
+        condition_config = func_effects_config["avg_func_effects"][condition]
+        avg_methods.add(condition_config["avg_method"])
+        cell_selections = condition_config["selections"]
+        if not isinstance(cell_selections, dict):
+            cell_selections = {s: None for s in cell_selections}
+        selections[cell] = {
+            os.path.join(by_selection_dir, f"{s}_func_effects.csv"): (
+                None if sites is None else replicate_averages.expand_sites(sites)
+            )
+            for s, sites in cell_selections.items()
+        }
+    if len(avg_methods) != 1:
+        raise ValueError(f"conditions have different {avg_methods=}")
+    return selections, avg_methods.pop()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Permutation tests and bootstrap CIs for site differences in entry."
+    )
+    parser.add_argument("--mut-effects-csv", required=True, help="Mutation effects CSV.")
+    parser.add_argument(
+        "--cells", nargs="+", required=True, help="Cells as LABEL=NAME, or just NAME."
+    )
+    parser.add_argument("--floor", type=float, required=True, help="Floor effects here.")
+    parser.add_argument(
+        "--method",
+        choices=["mutations", "selections"],
+        required=True,
+        help="Resample amino acids at each site or replicate selections.",
+    )
+    parser.add_argument(
+        "--conditions",
+        nargs="+",
+        help="For selections, condition in `avg_func_effects` for each cell.",
+    )
+    parser.add_argument("--func-effects-config", help="For selections, config YAML.")
+    parser.add_argument(
+        "--by-selection-dir",
+        default="results/func_effects/by_selection",
+        help="For selections, directory with per-selection effects.",
+    )
+    parser.add_argument("--n-permutations", type=int, default=1000)
+    parser.add_argument("--n-bootstraps", type=int, default=1000)
+    parser.add_argument("--ci", type=float, default=0.95, help="Confidence interval.")
+    parser.add_argument("--seed", type=int, default=1, help="Random number seed.")
+    parser.add_argument("--chunksize", type=int, default=50, help="Resamples at a time.")
+    parser.add_argument("--output-csv", required=True, help="Output CSV.")
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    cells = dict(c.split("=", 1) if "=" in c else (c, c) for c in args.cells)
+    print(f"Reading mutation effects in {cells=} from {args.mut_effects_csv}")
+    diffs = entry_diffs.EntryDiffs(
+        args.mut_effects_csv, cells, args.floor, dtype="float64"
+    )
+    if args.method == "mutations":
+        resampler = MutationResampler(diffs)
+    else:
+        if args.func_effects_config is None or args.conditions is None:
+            raise ValueError("specify `--func-effects-config` and `--conditions`")
+        if len(args.conditions) != len(cells):
+            raise ValueError(f"need one condition per cell: {args.conditions=}")
+        from ruamel import yaml
+
+        with open(args.func_effects_config) as f:
+            func_effects_config = yaml.YAML(typ="safe", pure=True).load(f)
+        selections, avg_method = selections_from_config(
+            func_effects_config, dict(zip(cells, args.conditions)), args.by_selection_dir
+        )
+        resampler = SelectionResampler(diffs, selections, avg_method=avg_method)
+    print(
+        f"Resampling {args.method} with {args.n_permutations=}, {args.n_bootstraps=}, "
+        f"{args.seed=}, {args.chunksize=}"
+    )
+    tests = resampler.test(
+        n_permutations=args.n_permutations,
+        n_bootstraps=args.n_bootstraps,
+        ci=args.ci,
+        seed=args.seed,
+        chunksize=args.chunksize,
+    )
+    print(f"Writing tests for {len(tests)} sites and pairs to {args.output_csv}")
+    fast_csv.write_csv(tests, args.output_csv, float_format="%.4g")
+
+
+if __name__ == "__main__":
+    main()
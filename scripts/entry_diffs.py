@@ -0,0 +1,399 @@
+"""Differences in mutation effects on entry between all pairs of cells.
+
+Effects in all cells are held as one mutations x cells matrix (``float32`` by
+default), floored once, and all pairwise mutation differences and site-level distances are computed
+by broadcasting over the cell pairs, so adding cells does not add passes over the
+data. Used by the ``cell_entry_mut_diffs`` rule (run as a script) and by the
+``compare_cell_entry`` notebook.
+
+"""
+
+import argparse
+import itertools
+
+import numpy
+
+import pandas as pd
+
+import fast_csv
+import incremental_tables
+import mut_codec
+
+
+# metrics computed by :meth:`EntryDiffs.site_diffs`
+SITE_DIFF_METRICS = ["mean difference", "Jensen-Shannon divergence", "difference in constraint"]
+
+
+class EntryDiffs:
+    """Effects of mutations on entry in several cells.
+
+    Parameters
+    ----------
+    mut_effects : pandas.DataFrame or str
+        Mutation-level data (or CSV with it) with columns "site", "sequential_site",
+        "wildtype", "mutant", "region", and ``col_template.format(name)`` for each
+        cell.
+    cells : list or dict
+        Names of cells as used in the column names, or a dict keyed by the labels to
+        use for the cells with values the names used in the column names.
+    floor : float
+        Floor effects at this value before computing mutation-level and mean
+        differences.
+    alphabet : str
+        Only keep mutations to these characters.
+    col_template : str
+        Template for the column with the effects in each cell.
+    dtype : numpy.dtype
+        Type of the effects matrix. The default ``float32`` halves memory for large
+        data sets; use ``float64`` to exactly reproduce differences computed in
+        ``pandas``, since values rounded for output can differ at ties.
+
+    Attributes
+    ----------
+    cells : list
+        Cell labels.
+    pairs : list
+        All pairs of cells as 2-tuples, in the order of ``itertools.combinations``.
+    muts : pandas.DataFrame
+        Mutation identifiers, sorted by site and mutant.
+    codes : numpy.ndarray
+        Integer mutation codes for the rows of `muts`.
+    codec : mut_codec.MutationCodec
+    effects : numpy.ndarray
+        Matrix of effects of mutations (rows) in cells (columns).
+    floored : numpy.ndarray
+        `effects` floored at `floor`.
+
+    """
+
+    id_cols = ["site", "sequential_site", "mutant", "wildtype", "region"]
+
+    def __init__(
+        self,
+        mut_effects,
+        cells,
+        floor,
+        alphabet=mut_codec.AAS_WITHSTOP,
+        col_template="entry in {} cells",
+        dtype=numpy.float32,
+    ):
+        """See main class docstring."""
+        if isinstance(mut_effects, str):
+            mut_effects = pd.read_csv(mut_effects)
+        if not isinstance(cells, dict):
+            cells = {c: c for c in cells}
+        if len(cells) < 2:
+            raise ValueError(f"need at least two cells: {cells=}")
+        self.cells = list(cells)
+        self.pairs = list(itertools.combinations(self.cells, 2))
+        self.floor = floor
+
+        cols = [col_template.format(name) for name in cells.values()]
+        missing_cols = set(self.id_cols + cols) - set(mut_effects.columns)
+        if missing_cols:
+            raise ValueError(f"{missing_cols=} in {mut_effects.columns=}")
+        mut_effects = mut_effects[mut_effects["mutant"].isin(list(alphabet))]
+
+        self.codec = mut_codec.MutationCodec.from_data(mut_effects, alphabet=alphabet)
+        codes = self.codec.encode_df(mut_effects)
+        order = codes.argsort(kind="stable")
+        self.codes = codes[order]
+        self.muts = mut_effects[self.id_cols].iloc[order].reset_index(drop=True)
+        self.effects = mut_effects[cols].to_numpy(dtype=dtype)[order]
+        # numpy.maximum propagates nan, as does clipping in pandas
+        self.floored = numpy.maximum(self.effects, self.effects.dtype.type(floor))
+
+    def _pair_indices(self):
+        """Column indices of first and second cell in each pair."""
+        i, j = zip(*[(self.cells.index(c1), self.cells.index(c2)) for c1, c2 in self.pairs])
+        return numpy.array(i), numpy.array(j)
+
+    def wide(self, floored=False):
+        """Data frame of mutation identifiers and effects in each cell.
+
+        Parameters
+        ----------
+        floored : bool
+            Return the floored rather than raw effects.
+
+        Returns
+        -------
+        pandas.DataFrame
+
+        """
+        values = self.floored if floored else self.effects
+        return pd.concat(
+            [self.muts, pd.DataFrame(values, columns=self.cells).astype(float)], axis=1
+        )
+
+    def mut_diffs(self):
+        """Floored differences in effects of each mutation for all pairs of cells.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Mutation identifiers, raw effects in each cell, and the difference of
+            floored effects in columns named "{cell_1} minus {cell_2}".
+
+        """
+        i, j = self._pair_indices()
+        diffs = self.floored[:, i] - self.floored[:, j]
+        return pd.concat(
+            [
+                self.wide(),
+                pd.DataFrame(
+                    diffs, columns=[f"{c1} minus {c2}" for c1, c2 in self.pairs]
+                ).astype(float),
+            ],
+            axis=1,
+        )
+
+    def site_tensor(self):
+        """Sites x amino acids x cells tensor of effects.
+
+        Returns
+        -------
+        sites : numpy.ndarray
+            Sequential sites with data.
+        tensor : numpy.ndarray
+            Effects (`nan` if missing) for each site in `sites`, each character in
+            the codec alphabet, and each cell.
+        is_wildtype : numpy.ndarray
+            Boolean sites x amino-acid array that is `True` for the wildtype.
+
+        """
+        codec = self.codec
+        flat = numpy.full(
+            ((codec.n_sites + 1) * codec.n_aas, len(self.cells)), numpy.nan, dtype=numpy.float64
+        )
+        flat[self.codes] = self.effects
+        tensor = flat.reshape(codec.n_sites + 1, codec.n_aas, len(self.cells))
+        sites = numpy.unique(self.muts["sequential_site"].to_numpy())
+        is_wildtype = numpy.zeros((codec.n_sites + 1, codec.n_aas), dtype=bool)
+        wildtype_indices = codec.aa_indices(codec.wildtype_array)
+        has_wildtype = wildtype_indices >= 0
+        is_wildtype[numpy.flatnonzero(has_wildtype), wildtype_indices[has_wildtype]] = True
+        return sites, tensor[sites], is_wildtype[sites]
+
+    def site_info(self, sites):
+        """Site identifiers.
+
+        Parameters
+        ----------
+        sites : numpy.ndarray
+            Sequential sites, as returned by :meth:`EntryDiffs.site_tensor`.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns "site", "sequential_site", and "region" for each of `sites`.
+
+        """
+        return (
+            self.muts[["site", "sequential_site", "region"]]
+            .drop_duplicates("sequential_site")
+            .set_index("sequential_site")
+            .loc[sites]
+            .reset_index()
+            [["site", "sequential_site", "region"]]
+        )
+
+    def pair_frame(self, sites, values):
+        """Long data frame of site-level values for each pair of cells.
+
+        Parameters
+        ----------
+        sites : numpy.ndarray
+            Sequential sites.
+        values : dict
+            Keyed by column name, values are pairs x sites arrays.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns "site", "sequential_site", "region", the keys of `values`,
+            "cell_1", and "cell_2". Rows are grouped by cell pair, then sorted by site.
+
+        """
+        site_info = self.site_info(sites)
+        return pd.concat(
+            [
+                site_info.assign(
+                    **{col: vals[k] for col, vals in values.items()},
+                    cell_1=c1,
+                    cell_2=c2,
+                )
+                for k, (c1, c2) in enumerate(self.pairs)
+            ],
+            ignore_index=True,
+        )
+
+    def site_diffs(self):
+        """Site-level differences between all pairs of cells.
+
+        See :func:`site_metrics` for the definitions of the metrics.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns "site", "sequential_site", "region", the metrics, "cell_1", and
+            "cell_2". Rows are grouped by cell pair, then sorted by site.
+
+        """
+        sites, tensor, is_wildtype = self.site_tensor()
+        i, j = self._pair_indices()
+        # pairs x sites x amino acids
+        x = numpy.moveaxis(tensor[:, :, i], -1, 0)
+        y = numpy.moveaxis(tensor[:, :, j], -1, 0)
+        return self.pair_frame(sites, site_metrics(x, y, is_wildtype, self.floor))
+
+
+def site_metrics(x, y, is_wildtype, floor, weights=None):
+    """Site-level differences between effects in two cells.
+
+    The metrics are:
+
+      - "mean difference": mean over non-wildtype mutations of the difference in
+        floored effects of the first minus second cell.
+      - "Jensen-Shannon divergence": each amino acid with effects in both cells is
+        assigned a probability proportional to the exponential of its (unfloored)
+        effect, and this is the squared Jensen-Shannon distance (natural log)
+        between the probabilities in the two cells.
+      - "difference in constraint": the effective number of amino acids (the
+        exponential of the entropy of the probabilities above) in the first
+        minus second cell.
+
+    Only amino acids with effects in both cells are used. Sites with none have
+    zero divergence and difference in constraint.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Effects in first cell, shape ``(..., n_sites, n_aas)`` with `nan` for
+        missing. Any leading dimensions (eg, pairs of cells or resamples) are
+        broadcast.
+    y : numpy.ndarray
+        Effects in second cell, same shape as `x`.
+    is_wildtype : numpy.ndarray
+        Boolean ``(n_sites, n_aas)`` array that is `True` for the wildtype.
+    floor : float
+        Floor effects here for the mean difference.
+    weights : None or numpy.ndarray
+        Number of times each amino acid is counted, broadcastable to `x`; used to
+        resample amino acids at each site. `None` means each is counted once.
+
+    Returns
+    -------
+    dict
+        Keyed by the names in :data:`SITE_DIFF_METRICS`, values are arrays of
+        shape ``(..., n_sites)``.
+
+    """
+    both = ~numpy.isnan(x) & ~numpy.isnan(y)
+    w_both = both if weights is None else numpy.where(both, weights, 0)
+    n_both = w_both.sum(axis=-1)
+
+    w_keep = numpy.where(is_wildtype, 0, w_both)
+    with numpy.errstate(invalid="ignore"):
+        diff = numpy.maximum(x, floor) - numpy.maximum(y, floor)
+    diff = numpy.where(w_keep > 0, diff, 0)
+    if weights is not None:
+        diff = diff * w_keep
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        mean_diff = diff.sum(axis=-1) / w_keep.sum(axis=-1)
+
+    def probs(effects):
+        """Probabilities and log probabilities (per copy) from softmax of effects."""
+        logits = numpy.where(both, effects, -numpy.inf)
+        logits = logits - numpy.where(n_both > 0, numpy.max(logits, axis=-1), 0)[..., None]
+        p = numpy.exp(logits)
+        if weights is not None:
+            p = p * w_both
+        z = numpy.maximum(p.sum(axis=-1), numpy.finfo(float).tiny)[..., None]
+        return p / z, logits - numpy.log(z)
+
+    # with weights, these are the total probabilities of all copies of an amino acid
+    p, log_p = probs(x)
+    q, log_q = probs(y)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        log_m = numpy.log((p + q) / 2)
+        if weights is not None:
+            # relative entropies use total probabilities of all copies
+            log_w = numpy.log(w_both)
+            log_m = log_m - log_w
+        rel_entr = numpy.where(p > 0, p * (log_p - log_m), 0) + numpy.where(
+            q > 0, q * (log_q - log_m), 0
+        )
+        entropy_p = -numpy.where(p > 0, p * log_p, 0).sum(axis=-1)
+        entropy_q = -numpy.where(q > 0, q * log_q, 0).sum(axis=-1)
+    jsd = numpy.where(n_both > 0, rel_entr.sum(axis=-1) / 2, 0)
+    n_eff_diff = numpy.where(n_both > 0, numpy.exp(entropy_p) - numpy.exp(entropy_q), 0)
+
+    return {
+        "mean difference": mean_diff,
+        "Jensen-Shannon divergence": jsd,
+        "difference in constraint": n_eff_diff,
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Differences in mutation effects on entry between pairs of cells."
+    )
+    parser.add_argument("--mut-effects-csv", required=True, help="Mutation effects CSV.")
+    parser.add_argument("--cells", nargs="+", required=True, help="Cell names in CSV.")
+    parser.add_argument("--floor", type=float, required=True, help="Floor effects here.")
+    parser.add_argument("--mut-diffs-csv", help="Output CSV of mutation differences.")
+    parser.add_argument("--site-diffs-csv", help="Output CSV of site differences.")
+    parser.add_argument(
+        "--dtype", default="float32", help="Type of effects matrix, eg float64."
+    )
+    parser.add_argument(
+        "--incremental-dir",
+        help="Snapshot for incremental updates, only recompute changed sites.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    if args.incremental_dir:
+        outputs = {
+            name: {"csv": csv, "float_format": "%.3f", "group_cols": group_cols}
+            for name, csv, group_cols in [
+                ("mut_diffs", args.mut_diffs_csv, []),
+                ("site_diffs", args.site_diffs_csv, ["cell_1", "cell_2"]),
+            ]
+            if csv
+        }
+
+        def compute(dfs):
+            diffs = EntryDiffs(dfs["mut_effects"], args.cells, args.floor, dtype=args.dtype)
+            return {name: getattr(diffs, name)() for name in outputs}
+
+        mode = incremental_tables.IncrementalTables(
+            args.incremental_dir,
+            {"mut_effects": {"csv": args.mut_effects_csv, "keys": ["site", "mutant"]}},
+            outputs,
+            compute,
+            # recompute everything if the code changes (`incremental_tables` adds its
+            # own code and that of `fast_csv`)
+            static_inputs=[__file__, mut_codec.__file__],
+            params={"cells": args.cells, "floor": args.floor, "dtype": args.dtype},
+        ).update()
+        print(f"Updated {list(outputs)} ({mode})")
+        return
+
+    print(f"Reading mutation effects in {args.cells=} from {args.mut_effects_csv}")
+    diffs = EntryDiffs(args.mut_effects_csv, args.cells, args.floor, dtype=args.dtype)
+    if args.mut_diffs_csv:
+        print(f"Writing mutation differences to {args.mut_diffs_csv}")
+        fast_csv.write_csv(diffs.mut_diffs(), args.mut_diffs_csv, float_format="%.3f")
+    if args.site_diffs_csv:
+        print(f"Writing site differences to {args.site_diffs_csv}")
+        fast_csv.write_csv(diffs.site_diffs(), args.site_diffs_csv, float_format="%.3f")
+
+
+if __name__ == "__main__":
+    main()
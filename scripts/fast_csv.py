@@ -0,0 +1,65 @@
+"""Write data frames to CSV with fast float formatting.
+
+``pandas.DataFrame.to_csv`` with a ``float_format`` formats every value through a
+generic per-cell path. Here each column is formatted once with a specialized
+formatter and rows are written out in chunks, which is several-fold faster for large
+tables and gives the same output as ``to_csv(index=False, float_format=...)``.
+
+"""
+
+import pandas as pd
+
+
+def _quote(s):
+    """Quote a string field the way the ``csv`` module does for ``QUOTE_MINIMAL``."""
+    if any(c in s for c in ',"\n\r'):
+        return '"' + s.replace('"', '""') + '"'
+    return s
+
+
+def format_column(series, float_format, quote=True):
+    """Format a column as a list of CSV fields.
+
+    Parameters
+    ----------
+    series : pandas.Series
+    float_format : str
+        Format string (eg, "%.4g") for float columns.
+    quote : bool
+        Quote strings as needed for CSV. If `False`, the strings are the values
+        as read back from the CSV.
+
+    Returns
+    -------
+    list
+        Strings, with empty strings for null values.
+
+    """
+    if pd.api.types.is_float_dtype(series.dtype):
+        return [
+            float_format % x if x == x else "" for x in series.to_numpy(dtype=float).tolist()
+        ]
+    if pd.api.types.is_integer_dtype(series.dtype) and not series.hasnans:
+        return [str(x) for x in series.to_numpy().tolist()]
+    q = _quote if quote else str
+    return ["" if pd.isna(x) else q(str(x)) for x in series.astype(object).tolist()]
+
+
+def write_csv(df, path, float_format="%.4g", chunksize=100000):
+    """Write data frame to CSV without the index.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    path : str
+    float_format : str
+    chunksize : int
+        Write this many rows at a time to bound memory.
+
+    """
+    with open(path, "w") as f:
+        f.write(",".join(_quote(str(c)) for c in df.columns) + "\n")
+        for start in range(0, len(df), chunksize):
+            chunk = df.iloc[start: start + chunksize]
+            cols = [format_column(chunk[c], float_format) for c in chunk.columns]
+            f.write("".join(",".join(row) + "\n" for row in zip(*cols)))
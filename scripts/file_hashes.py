@@ -0,0 +1,13 @@
+"""Hashes of file contents, used to tell whether inputs changed between runs."""
+
+
+import hashlib
+
+
+def file_hash(path, chunksize=2**20):
+    """SHA-256 hex digest of the contents of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunksize):
+            h.update(chunk)
+    return h.hexdigest()
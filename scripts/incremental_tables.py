@@ -0,0 +1,244 @@
+"""Incrementally update tables derived site by site from input tables.
+
+Tables like the mutation and site differences between cells or the annotated
+summaries are computed independently for each site from the mutation-level summary.
+When the averages for one cell change, most sites are unchanged, yet the tables are
+regenerated from scratch. An :class:`IncrementalTables` keeps a snapshot of the
+inputs and outputs of its last update. On the next update it diffs each input against
+its snapshot by the input's key columns, recomputes the outputs only for the
+sequential sites with changed rows, and patches those rows into the previous outputs,
+leaving the rows of other sites byte-for-byte unchanged.
+
+Everything is recomputed from scratch if there is no snapshot, the columns of an input
+or output change, or the parameters or static inputs (such as site annotations, which
+are not diffed) change. The code of this module and of :mod:`fast_csv` are always
+static inputs, so rows patched by new code are never mixed with rows written by old
+code; callers add the code that computes their tables.
+
+The snapshot includes the outputs because ``snakemake`` removes the outputs of a rule
+before running it, so they are patched from the snapshot and then written.
+
+"""
+
+
+import json
+import os
+import shutil
+
+import pandas as pd
+
+import fast_csv
+import file_hashes
+
+
+def read_strings(csv):
+    """Read a CSV with all values as strings, and nulls as empty strings."""
+    return pd.read_csv(csv, dtype=str, keep_default_na=False)
+
+
+def changed_sites(old, new, keys, site_col="sequential_site"):
+    """Sites with rows that differ between two versions of a table.
+
+    Parameters
+    ----------
+    old : pandas.DataFrame
+    new : pandas.DataFrame
+        Compared exactly, so read both with :func:`read_strings`.
+    keys : list
+        Columns that identify each row.
+    site_col : str
+        Column with sites.
+
+    Returns
+    -------
+    None or set
+        The sites of rows added, removed, or changed, or `None` if the columns
+        differ.
+
+    """
+    if list(old.columns) != list(new.columns):
+        return None
+    if site_col not in old.columns or not set(keys).issubset(old.columns):
+        raise ValueError(f"{site_col=} and {keys=} not all in {old.columns=}")
+    merged = old.merge(new, on=keys, how="outer", suffixes=("_old", "_new"), indicator=True)
+    value_cols = [c for c in old.columns if c not in keys]
+    differs = merged["_merge"] != "both"
+    for col in value_cols:
+        differs |= merged[f"{col}_old"] != merged[f"{col}_new"]
+    differs = merged[differs]
+    site_values = [differs[site_col]] if site_col in keys else [
+        differs[f"{site_col}_old"], differs[f"{site_col}_new"]
+    ]
+    return {int(s) for values in site_values for s in values.dropna() if s != ""}
+
+
+class IncrementalTables:
+    """Tables computed site by site from inputs, patched when inputs change.
+
+    Parameters
+    ----------
+    snapshot_dir : str
+        Directory with the snapshot of the last update.
+    inputs : dict
+        Keyed by name, values are dicts with keys "csv" and "keys" (columns that
+        identify each row). Each input has a "sequential_site" column.
+    outputs : dict
+        Keyed by name, values are dicts with keys "csv", "float_format" (as for
+        :func:`fast_csv.write_csv`), and optionally "group_cols". Each output has a
+        "sequential_site" column, and its rows are ordered by the "group_cols" (in
+        order of first appearance) and then by site.
+    compute : callable
+        Called with a dict of data frames keyed by input name, returns a dict of data
+        frames keyed by output name. Each output row for a site must only depend on
+        the input rows for that site.
+    static_inputs : list
+        Files that are not diffed, everything is recomputed if any change. Should
+        include the code of `compute`.
+    params : object
+        JSON-serializable parameters, everything is recomputed if they change.
+
+    """
+
+    def __init__(self, snapshot_dir, inputs, outputs, compute, static_inputs=(), params=None):
+        """See main class docstring."""
+        self.snapshot_dir = snapshot_dir
+        self.inputs = inputs
+        self.outputs = outputs
+        self.compute = compute
+        self.static_inputs = list(static_inputs)
+        self.params = params
+        self._meta_json = os.path.join(snapshot_dir, "snapshot.json")
+
+    def _snapshot_csv(self, kind, name):
+        return os.path.join(self.snapshot_dir, kind, f"{name}.csv")
+
+    def _meta(self):
+        return {
+            "params": self.params,
+            "static_inputs": {
+                f: file_hashes.file_hash(f)
+                for f in [__file__, fast_csv.__file__, *self.static_inputs]
+            },
+            "outputs": sorted(self.outputs),
+        }
+
+    def _changed_sites(self):
+        """Sites changed since the snapshot, or `None` to recompute everything."""
+        if not os.path.isfile(self._meta_json):
+            print("No snapshot of a previous update")
+            return None
+        with open(self._meta_json) as f:
+            if json.load(f) != json.loads(json.dumps(self._meta())):
+                print("Parameters or static inputs changed since the snapshot")
+                return None
+        sites = set()
+        for name, spec in self.inputs.items():
+            snapshot = self._snapshot_csv("inputs", name)
+            if file_hashes.file_hash(snapshot) == file_hashes.file_hash(spec["csv"]):
+                continue
+            input_sites = changed_sites(
+                read_strings(snapshot), read_strings(spec["csv"]), spec["keys"]
+            )
+            if input_sites is None:
+                print(f"Columns of input {name} changed since the snapshot")
+                return None
+            print(f"Input {name} changed at {len(input_sites)} sites")
+            sites |= input_sites
+        return sites
+
+    def _patch(self, name, sites, new_rows):
+        """Patch rows for `sites` into the snapshot of an output.
+
+        Returns `None` if the columns of the output changed.
+
+        """
+        spec = self.outputs[name]
+        old = read_strings(self._snapshot_csv("outputs", name))
+        if list(old.columns) != list(new_rows.columns):
+            return None
+        new_rows = pd.DataFrame(
+            {
+                col: fast_csv.format_column(new_rows[col], spec["float_format"], quote=False)
+                for col in new_rows.columns
+            },
+            columns=old.columns,
+            dtype=object,
+        )
+        patched = pd.concat(
+            [old[~old["sequential_site"].astype(int).isin(sites)], new_rows],
+            ignore_index=True,
+        )
+        order_cols = []
+        for col in spec.get("group_cols", []):
+            levels = pd.unique(pd.concat([old[col], new_rows[col]]))
+            order_cols.append(patched[col].map({val: i for i, val in enumerate(levels)}))
+        order_cols.append(patched["sequential_site"].astype(int))
+        order = pd.concat(order_cols, axis=1, keys=range(len(order_cols)))
+        print(f"Patching {len(new_rows)} rows into {len(old)} rows of {name}")
+        return patched.loc[order.sort_values(list(order.columns), kind="stable").index]
+
+    def _patch_all(self, sites):
+        """Patched outputs, or `None` if the columns of an output changed."""
+        subsets = {}
+        for name, spec in self.inputs.items():
+            df = pd.read_csv(spec["csv"])
+            subsets[name] = df[df["sequential_site"].isin(sites)].reset_index(drop=True)
+        print(f"Recomputing outputs at {len(sites)} changed sites")
+        if any(len(df) for df in subsets.values()):
+            # drop any rows for other sites, eg from outer merges with annotations
+            new_rows = {
+                name: df[df["sequential_site"].isin(sites)]
+                for name, df in self.compute(subsets).items()
+            }
+        else:
+            # the changed sites were removed
+            new_rows = {
+                name: read_strings(self._snapshot_csv("outputs", name)).iloc[:0]
+                for name in self.outputs
+            }
+        patched = {name: self._patch(name, sites, df) for name, df in new_rows.items()}
+        if any(df is None for df in patched.values()):
+            print("Columns of an output changed")
+            return None
+        return patched
+
+    def update(self):
+        """Update the outputs, incrementally if possible.
+
+        Returns
+        -------
+        str
+            "full", "incremental", or "unchanged".
+
+        """
+        sites = self._changed_sites()
+        if sites is not None and not sites:
+            print("No sites changed, so outputs are unchanged")
+            mode = "unchanged"
+            for name, spec in self.outputs.items():
+                shutil.copyfile(self._snapshot_csv("outputs", name), spec["csv"])
+        else:
+            patched = None if sites is None else self._patch_all(sites)
+            if patched is None:
+                print("Computing all outputs")
+                mode = "full"
+                dfs = {name: pd.read_csv(spec["csv"]) for name, spec in self.inputs.items()}
+                for name, df in self.compute(dfs).items():
+                    spec = self.outputs[name]
+                    fast_csv.write_csv(df, spec["csv"], float_format=spec["float_format"])
+            else:
+                mode = "incremental"
+                for name, df in patched.items():
+                    fast_csv.write_csv(df, self.outputs[name]["csv"])
+        self._snapshot()
+        return mode
+
+    def _snapshot(self):
+        """Save the inputs and outputs as the snapshot."""
+        for kind in ["inputs", "outputs"]:
+            os.makedirs(os.path.join(self.snapshot_dir, kind), exist_ok=True)
+        for kind, specs in [("inputs", self.inputs), ("outputs", self.outputs)]:
+            for name, spec in specs.items():
+                shutil.copyfile(spec["csv"], self._snapshot_csv(kind, name))
+        with open(self._meta_json, "w") as f:
+            json.dump(self._meta(), f, indent=2)
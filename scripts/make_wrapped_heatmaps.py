@@ -0,0 +1,14 @@
+"""Make all row-wrapped heatmaps in one process."""
+
+import sys
+
+import wrapped_heatmap
+
+
+sys.stderr = sys.stdout = open(snakemake.log[0], "w")
+
+wrapped_heatmap.make_all_heatmaps(
+    snakemake.params.heatmaps,
+    snakemake.params.chart_htmls,
+    max_workers=snakemake.threads,
+)
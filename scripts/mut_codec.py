@@ -0,0 +1,303 @@
+"""Encode mutations as dense integer codes.
+
+A mutation is identified by its sequential site, wildtype, and mutant amino acid.
+Since the wildtype is fixed by the site, each mutation gets the ``int32`` code
+``sequential_site * len(alphabet) + alphabet.index(mutant)``. Tables keyed this way
+can be joined or looked up by array indexing rather than hash merges on the
+``(site, wildtype, mutant)`` string triples.
+
+"""
+
+import numpy
+
+import pandas as pd
+
+
+# 20 amino acids plus stop codon
+AAS_WITHSTOP = "ACDEFGHIKLMNPQRSTVWY*"
+
+
+class MutationCodec:
+    """Map mutations to and from dense ``int32`` codes.
+
+    Parameters
+    ----------
+    wildtypes : dict
+        Keyed by sequential site (integers starting at 1), values are the wildtype
+        amino acid at that site.
+    alphabet : str
+        Allowed mutant (and wildtype) characters, in the order they are coded.
+    reference_sites : dict or None
+        Optionally keyed by sequential site with values the reference site (eg,
+        "1(E3)"), so tables keyed by reference site can also be encoded.
+
+    Attributes
+    ----------
+    alphabet : str
+    n_aas : int
+        Number of characters in `alphabet`.
+    n_sites : int
+        Largest sequential site. Codes run from ``n_aas`` to ``(n_sites + 1) * n_aas``.
+    wildtype_array : numpy.ndarray
+        Character array indexed by sequential site (index 0 unused).
+
+    """
+
+    def __init__(self, wildtypes, alphabet=AAS_WITHSTOP, reference_sites=None):
+        """See main class docstring."""
+        if len(set(alphabet)) != len(alphabet):
+            raise ValueError(f"duplicate characters in {alphabet=}")
+        self.alphabet = alphabet
+        self.n_aas = len(alphabet)
+        if not wildtypes:
+            raise ValueError("no `wildtypes` specified")
+        if min(wildtypes) < 1:
+            raise ValueError("sequential sites must be >= 1")
+        self.n_sites = int(max(wildtypes))
+        invalid_wts = set(wildtypes.values()) - set(alphabet)
+        if invalid_wts:
+            raise ValueError(f"wildtypes {invalid_wts} not in {alphabet=}")
+        self.wildtype_array = numpy.full(self.n_sites + 1, "", dtype="<U1")
+        for site, wt in wildtypes.items():
+            self.wildtype_array[site] = wt
+        self._aa_index = numpy.full(256, -1, dtype=numpy.int32)
+        for i, aa in enumerate(alphabet):
+            self._aa_index[ord(aa)] = i
+        if reference_sites is None:
+            self._ref_to_seq = None
+        else:
+            self._ref_to_seq = {r: s for (s, r) in reference_sites.items()}
+            if len(self._ref_to_seq) != len(reference_sites):
+                raise ValueError("`reference_sites` not unique")
+
+    @classmethod
+    def from_site_numbering_map(cls, site_numbering_map, alphabet=AAS_WITHSTOP):
+        """Create from a site numbering map.
+
+        Parameters
+        ----------
+        site_numbering_map : str or pandas.DataFrame
+            CSV (or data frame) with columns "sequential_site", "reference_site",
+            and "wildtype", like ``data/site_numbering_map.csv``.
+        alphabet : str
+
+        Returns
+        -------
+        MutationCodec
+
+        """
+        if isinstance(site_numbering_map, str):
+            site_numbering_map = pd.read_csv(site_numbering_map)
+        # the site numbering map CSV is written with a byte-order mark
+        site_numbering_map = site_numbering_map.rename(columns=lambda c: c.lstrip("\ufeff"))
+        return cls(
+            wildtypes=site_numbering_map.set_index("sequential_site")["wildtype"].to_dict(),
+            alphabet=alphabet,
+            reference_sites=(
+                site_numbering_map.set_index("sequential_site")["reference_site"].to_dict()
+            ),
+        )
+
+    @classmethod
+    def from_data(cls, df, alphabet=AAS_WITHSTOP):
+        """Create from a mutation-level table.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Must have columns "sequential_site" and "wildtype"; if it also has "site"
+            those are used as the reference sites.
+        alphabet : str
+
+        Returns
+        -------
+        MutationCodec
+
+        """
+        cols = ["sequential_site", "wildtype"] + (["site"] if "site" in df.columns else [])
+        sites = df[cols].drop_duplicates()
+        if len(sites) != sites["sequential_site"].nunique():
+            raise ValueError("inconsistent wildtype or site for some sequential sites")
+        return cls(
+            wildtypes=sites.set_index("sequential_site")["wildtype"].to_dict(),
+            alphabet=alphabet,
+            reference_sites=(
+                sites.set_index("sequential_site")["site"].to_dict()
+                if "site" in sites.columns
+                else None
+            ),
+        )
+
+    def aa_indices(self, aas):
+        """Get indices in `alphabet` of characters, -1 if not in alphabet.
+
+        Parameters
+        ----------
+        aas : array-like of str
+            Single characters.
+
+        Returns
+        -------
+        numpy.ndarray
+            ``int32`` indices.
+
+        """
+        chars = numpy.asarray(aas, dtype="<U1")
+        return self._aa_index[
+            numpy.minimum(chars.view(numpy.uint32).reshape(chars.shape), 255)
+        ]
+
+    def sequential_sites(self, reference_sites):
+        """Convert reference sites to sequential sites.
+
+        Parameters
+        ----------
+        reference_sites : array-like
+
+        Returns
+        -------
+        numpy.ndarray
+
+        """
+        if self._ref_to_seq is None:
+            raise ValueError("codec was not created with `reference_sites`")
+        seq_sites = pd.Series(numpy.asarray(reference_sites)).map(self._ref_to_seq)
+        if seq_sites.isnull().any():
+            raise ValueError(
+                f"unknown reference sites: {set(pd.Series(reference_sites)[seq_sites.isnull().values])}"
+            )
+        return seq_sites.to_numpy(dtype=numpy.int64)
+
+    def encode(self, sequential_sites, wildtypes, mutants):
+        """Encode mutations.
+
+        Parameters
+        ----------
+        sequential_sites : array-like of int
+        wildtypes : array-like of str or None
+            If not `None`, checked against the codec's wildtypes.
+        mutants : array-like of str
+
+        Returns
+        -------
+        numpy.ndarray
+            ``int32`` codes.
+
+        """
+        sites = numpy.asarray(sequential_sites, dtype=numpy.int64)
+        if len(sites) and ((sites < 1).any() or (sites > self.n_sites).any()):
+            raise ValueError(f"sites outside 1 to {self.n_sites}")
+        aa_indices = self.aa_indices(mutants)
+        if (aa_indices < 0).any():
+            invalid = set(numpy.asarray(mutants)[aa_indices < 0])
+            raise ValueError(f"mutants {invalid} not in {self.alphabet=}")
+        if wildtypes is not None:
+            mismatch = self.wildtype_array[sites] != numpy.asarray(wildtypes, dtype="<U1")
+            if mismatch.any():
+                raise ValueError(
+                    f"wildtype mismatch at sequential sites {sorted(set(sites[mismatch]))}"
+                )
+        return (sites * self.n_aas + aa_indices).astype(numpy.int32)
+
+    def encode_df(self, df, site_col="sequential_site"):
+        """Encode mutations in a data frame.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Has columns `site_col`, "wildtype", and "mutant".
+        site_col : {"sequential_site", "site"}
+            If "site", the column holds reference sites.
+
+        Returns
+        -------
+        numpy.ndarray
+            ``int32`` codes aligned with rows of `df`.
+
+        """
+        if site_col == "sequential_site":
+            sites = df["sequential_site"].to_numpy()
+        elif site_col == "site":
+            sites = self.sequential_sites(df["site"])
+        else:
+            raise ValueError(f"invalid {site_col=}")
+        return self.encode(sites, df["wildtype"].to_numpy(), df["mutant"].to_numpy())
+
+    def decode(self, codes):
+        """Decode mutations.
+
+        Parameters
+        ----------
+        codes : array-like of int
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns "sequential_site", "wildtype", "mutant", and "site" if the codec
+            has reference sites.
+
+        """
+        codes = numpy.asarray(codes, dtype=numpy.int64)
+        sites, aa_indices = numpy.divmod(codes, self.n_aas)
+        if len(sites) and ((sites < 1).any() or (sites > self.n_sites).any()):
+            raise ValueError(f"codes outside range for sites 1 to {self.n_sites}")
+        alphabet = numpy.array(list(self.alphabet))
+        df = pd.DataFrame(
+            {
+                "sequential_site": sites,
+                "wildtype": self.wildtype_array[sites],
+                "mutant": alphabet[aa_indices],
+            }
+        )
+        if self._ref_to_seq is not None:
+            seq_to_ref = {s: r for (r, s) in self._ref_to_seq.items()}
+            df.insert(0, "site", df["sequential_site"].map(seq_to_ref))
+        return df
+
+    def effect_tensor(self, df, value_cols, site_col="sequential_site", dtype=numpy.float32):
+        """Get dense site x amino-acid view of values in a mutation-level table.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Mutation-level table with columns `site_col`, "wildtype", "mutant".
+        value_cols : str or list
+            Column(s) with values to place in the tensor.
+        site_col : {"sequential_site", "site"}
+        dtype : numpy.dtype
+
+        Returns
+        -------
+        numpy.ndarray
+            If `value_cols` is a str, shape ``(n_sites + 1, n_aas)``, otherwise shape
+            ``(n_sites + 1, n_aas, len(value_cols))``. Missing mutations are `nan`. The
+            first index is sequential site, so ``tensor.reshape(-1, ...)[codes]`` looks
+            up values by code.
+
+        """
+        codes = self.encode_df(df, site_col=site_col)
+        if len(numpy.unique(codes)) != len(codes):
+            raise ValueError("duplicated mutations in `df`")
+        single = isinstance(value_cols, str)
+        cols = [value_cols] if single else list(value_cols)
+        tensor = numpy.full(((self.n_sites + 1) * self.n_aas, len(cols)), numpy.nan, dtype=dtype)
+        tensor[codes] = df[cols].to_numpy(dtype=dtype)
+        tensor = tensor.reshape(self.n_sites + 1, self.n_aas, len(cols))
+        return tensor[..., 0] if single else tensor
+
+    def lookup(self, tensor, codes):
+        """Look up values in an effect tensor by code.
+
+        Parameters
+        ----------
+        tensor : numpy.ndarray
+            As returned by :meth:`MutationCodec.effect_tensor`.
+        codes : array-like of int
+
+        Returns
+        -------
+        numpy.ndarray
+
+        """
+        flat = tensor.reshape((self.n_sites + 1) * self.n_aas, *tensor.shape[2:])
+        return flat[numpy.asarray(codes)]
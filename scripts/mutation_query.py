@@ -0,0 +1,458 @@
+"""Query the effects of mutations across all the mutation-level result tables.
+
+Answering a question like "what does E2 K189Y do in each cell and in Mxra8 binding,
+and how many variants saw it" means finding the mutation in many CSVs under
+``results/summaries``, ``results/func_effects``, ``results/receptor_affinity``, and
+``results/func_effect_diffs``. A :class:`MutationIndex` indexes every CSV there with
+"site" and "mutant" columns by sequential site and mutant, and saves the index so it
+is only rebuilt for tables that changed. Queries look up the matching rows in the
+index and read just those tables, which are held in a least-recently-used cache, so
+repeated queries take milliseconds.
+
+Queries are by mutation (eg, ``E2 K189Y`` or ``K189(E2)Y``), by range of sites (eg,
+``E2:180-190``), and by thresholds on columns (eg, ``"times_seen >= 3"``), which can
+be combined. They can be made from Python, the command line, or a local HTTP server::
+
+    python scripts/mutation_query.py mutation "E2 K189Y"
+    python scripts/mutation_query.py sites E2:180-190 --where "effect < -2" --tables averages
+    python scripts/mutation_query.py serve --port 8765
+
+The server answers ``GET /query`` with the same parameters as :meth:`MutationIndex.query`
+(``mutation``, ``sites``, ``where``, and ``tables``, each of which can be repeated), and
+returns JSON keyed by table with a list of rows for each.
+
+"""
+
+
+import argparse
+import collections
+import glob
+import http.server
+import json
+import math
+import operator
+import os
+import pickle
+import re
+import time
+import urllib.parse
+
+import numpy
+
+import pandas as pd
+
+
+RESULTS_DIRS = [
+    "results/summaries",
+    "results/func_effects",
+    "results/receptor_affinity",
+    "results/func_effect_diffs",
+]
+
+OPERATORS = {
+    "<=": operator.le,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+}
+
+
+def parse_mutation(mutation):
+    """Parse a mutation into its reference site, wildtype, and mutant.
+
+    Parameters
+    ----------
+    mutation : str
+        Either with the region before the mutation (eg, "E2 K189Y" or "E2:K189Y") or
+        with the reference site (eg, "K189(E2)Y").
+
+    Returns
+    -------
+    tuple
+        The site (eg, "189(E2)"), wildtype, and mutant.
+
+    """
+    m = re.fullmatch(
+        r"\s*(?:(?P<region>[^\s:]+)[\s:]+)?(?P<wt>[A-Z\-*])(?P<site>-?\d+)"
+        r"(?:\((?P<site_region>[^)]+)\))?(?P<mut>[A-Z\-*])\s*",
+        mutation,
+    )
+    if not m or bool(m["region"]) == bool(m["site_region"]):
+        raise ValueError(f"cannot parse {mutation=}, give it as 'E2 K189Y' or 'K189(E2)Y'")
+    return f"{m['site']}({m['region'] or m['site_region']})", m["wt"], m["mut"]
+
+
+def parse_filter(where):
+    """Parse a threshold filter like "times_seen >= 3" into column, operator, value."""
+    m = re.fullmatch(r"\s*(?P<col>.+?)\s*(?P<op><=|>=|==|!=|<|>)\s*(?P<val>.+?)\s*", where)
+    if not m:
+        raise ValueError(f"cannot parse {where=}, give it as 'column <op> value'")
+    val = m["val"]
+    try:
+        val = float(val)
+    except ValueError:
+        val = val.strip("'\"")
+    return m["col"], m["op"], val
+
+
+class _LRUCache:
+    """Least-recently-used cache of loaded tables."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = collections.OrderedDict()
+
+    def get(self, key, load):
+        if key in self._data:
+            self._data.move_to_end(key)
+        else:
+            self._data[key] = load()
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return self._data[key]
+
+
+class MutationIndex:
+    """Index of mutation-level result tables by sequential site and mutant.
+
+    Parameters
+    ----------
+    site_numbering_map : str
+        CSV with "reference_site", "sequential_site", and "region".
+    results_dirs : list
+        Index all CSVs in these directories (recursively) with "site" and "mutant"
+        columns.
+    index_file : None or str
+        Save the index here, and reuse it for tables that are unchanged.
+    max_tables : int
+        Keep this many of the most recently used tables loaded.
+
+    Attributes
+    ----------
+    tables : list
+        Paths of the indexed tables.
+
+    """
+
+    def __init__(
+        self,
+        site_numbering_map="data/site_numbering_map.csv",
+        results_dirs=RESULTS_DIRS,
+        index_file="results/mutation_index.pickle",
+        max_tables=64,
+    ):
+        """See main class docstring."""
+        sites = pd.read_csv(site_numbering_map, dtype={"reference_site": str})
+        self._sequential_sites = sites.set_index("reference_site")["sequential_site"].to_dict()
+        self._region_sites = (
+            sites.groupby("region")["sequential_site"].aggregate(["min", "max"]).to_dict("index")
+        )
+        self._table_cache = _LRUCache(max_tables)
+        start = time.time()
+        self._build(results_dirs, index_file)
+        print(
+            f"Indexed {len(self._site)} rows of {len(self.tables)} tables "
+            f"in {time.time() - start:.2f} sec"
+        )
+
+    def _build(self, results_dirs, index_file):
+        saved = {}
+        if index_file and os.path.isfile(index_file):
+            with open(index_file, "rb") as f:
+                saved = pickle.load(f)
+        csvs = sorted(
+            csv
+            for results_dir in results_dirs
+            for csv in glob.glob(os.path.join(results_dir, "**", "*.csv"), recursive=True)
+        )
+        entries = {}
+        for csv in csvs:
+            stat = os.stat(csv)
+            version = (stat.st_mtime_ns, stat.st_size)
+            if csv in saved and saved[csv]["version"] == version:
+                entries[csv] = saved[csv]
+                continue
+            columns = list(pd.read_csv(csv, nrows=0).columns)
+            if not {"site", "mutant"}.issubset(columns):
+                entries[csv] = {"version": version, "columns": columns, "sequential_site": None}
+                continue
+            df = pd.read_csv(csv, usecols=["site", "mutant"], dtype=str)
+            entries[csv] = {
+                "version": version,
+                "columns": columns,
+                "sequential_site": df["site"].map(self._sequential_sites).fillna(-1).to_numpy(int),
+                "mutant": df["mutant"].fillna("").to_numpy(str),
+            }
+        if index_file and entries != saved:
+            if os.path.dirname(index_file):
+                os.makedirs(os.path.dirname(index_file), exist_ok=True)
+            with open(index_file, "wb") as f:
+                pickle.dump(entries, f)
+
+        self.tables = [
+            csv for csv, entry in entries.items() if entry["sequential_site"] is not None
+        ]
+        self._columns = [set(entries[csv]["columns"]) for csv in self.tables]
+        sequential_site = [entries[csv]["sequential_site"] for csv in self.tables]
+        site = numpy.concatenate([numpy.zeros(0, dtype=int), *sequential_site])
+        mutant = numpy.concatenate(
+            [numpy.zeros(0, dtype=str), *(entries[csv]["mutant"] for csv in self.tables)]
+        )
+        table = numpy.repeat(numpy.arange(len(self.tables)), [len(s) for s in sequential_site])
+        row = numpy.concatenate(
+            [numpy.zeros(0, dtype=int), *(numpy.arange(len(s)) for s in sequential_site)]
+        )
+        # sorted by site so ranges of sites are found by binary search
+        order = numpy.lexsort((row, table, site))
+        self._site, self._mutant, self._table, self._row = (
+            site[order], mutant[order], table[order], row[order]
+        )
+
+    def table(self, csv):
+        """A table, loaded or from the cache. Do not modify it."""
+        return self._table_cache.get(csv, lambda: pd.read_csv(csv, dtype={"site": str}))
+
+    def _select_tables(self, tables):
+        """Indices of tables with paths containing any of `tables`."""
+        if not tables:
+            return numpy.arange(len(self.tables))
+        selected = [i for i, csv in enumerate(self.tables) if any(t in csv for t in tables)]
+        if not selected:
+            raise ValueError(f"no tables match {tables=}")
+        return numpy.array(selected)
+
+    def site_range(self, sites):
+        """Sequential sites for a site or range of sites.
+
+        Parameters
+        ----------
+        sites : str
+            A reference site (eg, "189(E2)"), a region (eg, "E2"), or a range of
+            sites in a region (eg, "E2:180-190").
+
+        Returns
+        -------
+        tuple
+            The first and last sequential sites.
+
+        """
+        if sites in self._sequential_sites:
+            return (self._sequential_sites[sites],) * 2
+        if sites in self._region_sites:
+            return self._region_sites[sites]["min"], self._region_sites[sites]["max"]
+        m = re.fullmatch(r"\s*([^:]+):(-?\d+)(?:-(-?\d+))?\s*", sites)
+        if not m:
+            raise ValueError(f"cannot parse {sites=}, give it as '189(E2)', 'E2', or 'E2:180-190'")
+        region, first, last = m[1], m[2], m[3] or m[2]
+        endpoints = [f"{first}({region})", f"{last}({region})"]
+        missing = [site for site in endpoints if site not in self._sequential_sites]
+        if missing:
+            raise ValueError(f"sites {missing} not in the site numbering map")
+        return tuple(self._sequential_sites[site] for site in endpoints)
+
+    def query(self, mutation=(), sites=(), where=(), tables=()):
+        """Rows of the tables matching a query.
+
+        Parameters
+        ----------
+        mutation : str or list
+            Mutations as parsed by :func:`parse_mutation`.
+        sites : str or list
+            Sites or ranges of sites as parsed by :meth:`MutationIndex.site_range`.
+        where : str or list
+            Threshold filters (eg, "times_seen >= 3") as parsed by :func:`parse_filter`,
+            all of which must hold. Only tables with all the filtered columns are
+            searched. Ordering comparisons (eg, "<") of a number with a non-numeric
+            column, or of a string with a numeric one, raise a `ValueError`.
+        tables : str or list
+            Only search tables with paths containing any of these.
+
+        Returns
+        -------
+        dict
+            Keyed by path of table, values are data frames with the matching rows.
+            Tables without matches are left out.
+
+        """
+        mutation, sites, where, tables = (
+            [x] if isinstance(x, str) else list(x) for x in (mutation, sites, where, tables)
+        )
+        filters = [parse_filter(w) for w in where]
+        filter_cols = {col for col, _, _ in filters}
+        table_i = [
+            i for i in self._select_tables(tables) if filter_cols.issubset(self._columns[i])
+        ]
+
+        if mutation or sites:
+            matches = []
+            for mut in mutation:
+                site, _, mutant = parse_mutation(mut)
+                if site not in self._sequential_sites:
+                    raise ValueError(f"{site=} of {mut=} not in the site numbering map")
+                start, end = self._site_slice(*(self._sequential_sites[site],) * 2)
+                matches.append(start + numpy.flatnonzero(self._mutant[start:end] == mutant))
+            for site_range in sites:
+                matches.append(numpy.arange(*self._site_slice(*self.site_range(site_range))))
+            matches = numpy.unique(numpy.concatenate(matches))
+            matches = matches[numpy.isin(self._table[matches], table_i)]
+            table, row = self._table[matches], self._row[matches]
+            order = numpy.argsort(table, kind="stable")
+            table, row = table[order], row[order]
+            bounds = numpy.searchsorted(table, table_i, side="left"), numpy.searchsorted(
+                table, table_i, side="right"
+            )
+            table_rows = {
+                i: row[start:end] for i, start, end in zip(table_i, *bounds) if end > start
+            }
+        else:
+            table_rows = {i: None for i in table_i}
+
+        results = {}
+        for i, rows in table_rows.items():
+            csv = self.tables[i]
+            df = self.table(csv)
+            if rows is not None:
+                df = df.iloc[numpy.sort(rows)]
+            for col, op, val in filters:
+                is_numeric = pd.api.types.is_numeric_dtype(df[col])
+                if op not in {"==", "!="} and isinstance(val, float) != is_numeric:
+                    raise ValueError(
+                        f"cannot compare {col=} ({df[col].dtype}) in {csv} with {val=}"
+                    )
+                df = df[OPERATORS[op](df[col], val)]
+            if len(df):
+                results[csv] = df
+        return results
+
+    def _site_slice(self, first, last):
+        """Start and end of the rows for a range of sequential sites."""
+        return (
+            numpy.searchsorted(self._site, first, side="left"),
+            numpy.searchsorted(self._site, last, side="right"),
+        )
+
+
+def results_json(results):
+    """JSON-serializable form of the results of :meth:`MutationIndex.query`."""
+    return {
+        csv: [
+            {
+                col: None if isinstance(val, float) and math.isnan(val) else val
+                for col, val in row.items()
+            }
+            for row in df.to_dict("records")
+        ]
+        for csv, df in results.items()
+    }
+
+
+def serve(index, host="127.0.0.1", port=8765):
+    """Serve queries over HTTP at ``/query`` until interrupted."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path != "/query":
+                self.send_error(404, "use /query")
+                return
+            params = urllib.parse.parse_qs(url.query)
+            unknown = set(params) - {"mutation", "sites", "where", "tables"}
+            try:
+                if unknown:
+                    raise ValueError(f"unknown parameters {sorted(unknown)}")
+                start = time.time()
+                results = index.query(**params)
+                body = {"results": results_json(results), "ms": 1000 * (time.time() - start)}
+                status = 200
+            except ValueError as e:
+                body, status = {"error": str(e)}, 400
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving queries at http://{host}:{port}/query")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Query effects of mutations across the mutation-level result tables."
+    )
+    parser.add_argument(
+        "command",
+        choices=["mutation", "sites", "filter", "index", "serve"],
+        help="Look up mutations, sites, or filter tables; rebuild index; or serve.",
+    )
+    parser.add_argument("queries", nargs="*", help="Mutations or sites to look up.")
+    parser.add_argument(
+        "--where", nargs="*", default=[], help="Filters like 'times_seen >= 3'."
+    )
+    parser.add_argument(
+        "--tables", nargs="*", default=[], help="Only tables with paths containing these."
+    )
+    parser.add_argument(
+        "--columns", nargs="*", help="Only show these columns (and the mutation)."
+    )
+    parser.add_argument("--output-json", help="Write results to this JSON.")
+    parser.add_argument(
+        "--site-numbering-map", default="data/site_numbering_map.csv"
+    )
+    parser.add_argument("--index-file", default="results/mutation_index.pickle")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    if args.command == "index" and os.path.isfile(args.index_file):
+        os.remove(args.index_file)
+    index = MutationIndex(
+        site_numbering_map=args.site_numbering_map, index_file=args.index_file
+    )
+    if args.command == "index":
+        return
+    if args.command == "serve":
+        serve(index, host=args.host, port=args.port)
+        return
+
+    if args.command == "filter" and not args.where:
+        raise ValueError("`filter` needs --where")
+    if args.command != "filter" and not args.queries:
+        raise ValueError(f"`{args.command}` needs mutations or sites to look up")
+    start = time.time()
+    results = index.query(
+        mutation=args.queries if args.command == "mutation" else [],
+        sites=args.queries if args.command == "sites" else [],
+        where=args.where,
+        tables=args.tables,
+    )
+    elapsed = time.time() - start
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        for csv, df in results.items():
+            if args.columns:
+                keep_cols = {"site", "wildtype", "mutant", *args.columns}
+                df = df[[c for c in df.columns if c in keep_cols]]
+            print(f"\n{csv} ({len(df)} rows)")
+            print(df.to_string(index=False, max_rows=50))
+    n_rows = sum(map(len, results.values()))
+    print(f"\n{n_rows} rows in {len(results)} tables in {1000 * elapsed:.1f} ms")
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(results_json(results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,544 @@
+"""Fit Hill neutralization curves for many variants and replicates at once.
+
+``neutcurve.CurveFits`` fits each curve separately with ``scipy``, which is fine for the
+15 mutants of the Mxra8 validation panel but slow for hundreds of mutants with
+bootstrapped confidence intervals. Here all curves are put on a shared grid of
+concentrations (missing points get zero weight) and fit together by a vectorized
+Levenberg-Marquardt solver, so one batch of array operations updates every curve.
+
+The model and its parameterization follow ``neutcurve.HillCurve``: the fraction
+infectivity at concentration :math:`c` is :math:`b + (t - b) / (1 + (c / m)^s)` with
+the top :math:`t` and bottom :math:`b` fixed, the slope :math:`s` fixed or bounded, and
+the fit minimizing the unweighted squared error. As in ``neutcurve.CurveFits``, each
+variant also gets an "average" curve fit to the mean of its replicates at each
+concentration, and IC50s outside the range of concentrations are reported as bounds
+at the lowest or highest concentration.
+
+Confidence intervals come from a bootstrap in which the samples for all curves are
+refit in the same batches. Average curves are refit to averages of resampled
+replicates, so the intervals reflect variation between replicates, and single
+replicates are refit to their fitted values plus resampled residuals. With only a few
+replicates, the intervals are narrower than their nominal coverage (about 80% rather
+than 95% for three replicates in simulations).
+
+"""
+
+
+import argparse
+import time
+
+import numpy
+
+import pandas as pd
+
+
+def read_wide_curves(csv, conc_col="Concentration (ug/mL)"):
+    """Read curves with a column per replicate, the first of each named by variant.
+
+    This is the format of the RVP validation data, where each variant's name heads the
+    first of its replicate columns and the next columns are unnamed.
+
+    Parameters
+    ----------
+    csv : str
+        CSV with concentrations in `conc_col`.
+    conc_col : str
+        Column with concentrations.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Tidy data frame with columns "concentration", "virus", "replicate" (eg,
+        "replicate 1"), and "fraction_infectivity", with zero concentrations dropped
+        and viruses ordered as in the CSV.
+
+    """
+    wide = pd.read_csv(csv).rename(columns={conc_col: "concentration"})
+    value_cols = wide.columns.drop("concentration")
+    viruses = (
+        pd.Series(value_cols).where(~value_cols.str.startswith("Unnamed:")).ffill()
+    )
+    if viruses.isnull().any():
+        raise ValueError(f"first value column of {csv=} is unnamed")
+    replicates = "replicate " + (viruses.groupby(viruses).cumcount() + 1).astype(str)
+    return (
+        wide.melt(
+            id_vars="concentration", var_name="column", value_name="fraction_infectivity"
+        )
+        .assign(
+            virus=lambda x: x["column"].map(dict(zip(value_cols, viruses))),
+            replicate=lambda x: x["column"].map(dict(zip(value_cols, replicates))),
+        )
+        [["concentration", "virus", "replicate", "fraction_infectivity"]]
+        .query("concentration != 0")
+        .assign(
+            virus=lambda x: pd.Categorical(x["virus"], viruses.unique(), ordered=True)
+        )
+        .sort_values(["virus", "replicate", "concentration"])
+        .reset_index(drop=True)
+    )
+
+
+def validation_variant_order(viruses):
+    """Order "unmutated" and then mutations like "E2-K189Y" by region, site, mutant."""
+    mutants = [v for v in viruses if v != "unmutated"]
+    order = ["unmutated"] if "unmutated" in viruses else []
+    return order + sorted(
+        mutants, key=lambda v: (v.split("-")[0], int(v.split("-")[1][1:-1]), v[-1])
+    )
+
+
+def _hill(log_c, log_m, slope, top, bottom):
+    """Fraction infectivity, broadcasting parameters of shape (n, 1)."""
+    z = numpy.clip(slope * (log_c - log_m), -500, 500)
+    return bottom + (top - bottom) / (1 + numpy.exp(z))
+
+
+def _sse(log_c, fs, weights, log_m, slope, top, bottom):
+    resid = fs - _hill(log_c, log_m, slope[:, None], top, bottom)
+    return (weights * resid**2).sum(axis=1)
+
+
+def fit_batch(
+    log_c,
+    fs,
+    weights,
+    *,
+    slope_bounds,
+    top,
+    bottom,
+    init=None,
+    max_iter=200,
+    tol=1e-10,
+):
+    """Fit Hill curves for a batch on a shared grid of concentrations.
+
+    Parameters
+    ----------
+    log_c : numpy.ndarray
+        Log concentrations of the grid, shape (n_concentrations,).
+    fs : numpy.ndarray
+        Fraction infectivity, shape (n_curves, n_concentrations). Values with zero
+        weight are ignored.
+    weights : numpy.ndarray
+        Weight of each point, same shape as `fs`.
+    slope_bounds : tuple
+        Lower and upper bound on slope, which are equal to fix it.
+    top : float
+    bottom : float
+    init : None or tuple
+        Initial log midpoints and slopes, each shape (n_curves,). If `None`, start
+        from the best point of a grid search.
+    max_iter : int
+        Maximum number of iterations.
+    tol : float
+        Stop when no curve's squared error decreases by more than this fraction.
+
+    Returns
+    -------
+    tuple
+        Log midpoints, slopes, and squared errors, each shape (n_curves,).
+
+    """
+    fs = numpy.where(weights > 0, fs, 0.0)
+    lo, hi = slope_bounds
+    # keep midpoints for curves that never cross 0.5 from running off to infinity
+    log_m_bounds = (log_c.min() - 10, log_c.max() + 10)
+
+    if init is None:
+        log_m = numpy.full(len(fs), numpy.nan)
+        slope = numpy.full(len(fs), numpy.nan)
+        sse = numpy.full(len(fs), numpy.inf)
+        for grid_slope in numpy.unique(numpy.linspace(lo, hi, 5)):
+            for grid_log_m in numpy.linspace(log_c.min() - 3, log_c.max() + 3, 61):
+                grid_fs = _hill(log_c, grid_log_m, grid_slope, top, bottom)
+                grid_sse = (weights * (fs - grid_fs) ** 2).sum(axis=1)
+                better = grid_sse < sse
+                log_m[better], slope[better] = grid_log_m, grid_slope
+                sse[better] = grid_sse[better]
+    else:
+        log_m, slope = (numpy.array(x, dtype=float) for x in init)
+        sse = _sse(log_c, fs, weights, log_m[:, None], slope, top, bottom)
+
+    damping = numpy.full(len(fs), 1e-3)
+    # only keep iterating on curves that have not converged
+    active = numpy.arange(len(fs))
+    for _ in range(max_iter):
+        a_fs, a_weights = fs[active], weights[active]
+        a_log_m, a_slope, a_sse = log_m[active], slope[active], sse[active]
+        x = log_c - a_log_m[:, None]
+        g = 1 / (1 + numpy.exp(numpy.clip(a_slope[:, None] * x, -500, 500)))
+        dg = (top - bottom) * g * (1 - g)
+        resid = a_fs - (bottom + (top - bottom) * g)
+        # Jacobian of fitted values with respect to log midpoint and slope
+        j_m = a_weights * dg * a_slope[:, None]
+        j_s = -a_weights * dg * x if hi > lo else numpy.zeros_like(x)
+        a11, a12 = (j_m * j_m).sum(axis=1), (j_m * j_s).sum(axis=1)
+        a22 = (j_s * j_s).sum(axis=1)
+        b1, b2 = (j_m * resid).sum(axis=1), (j_s * resid).sum(axis=1)
+        d11 = a11 * (1 + damping[active]) + 1e-12
+        d22 = a22 * (1 + damping[active]) + 1e-12
+        det = d11 * d22 - a12 * a12
+        step_m = (d22 * b1 - a12 * b2) / det
+        step_s = (d11 * b2 - a12 * b1) / det
+        # if the slope is at a bound it is pushing against, just step the midpoint
+        pinned = ((a_slope <= lo) & (step_s < 0)) | ((a_slope >= hi) & (step_s > 0))
+        step_m = numpy.where(pinned, b1 / d11, step_m)
+        step_s = numpy.where(pinned, 0, step_s)
+        new_log_m = numpy.clip(a_log_m + step_m, *log_m_bounds)
+        new_slope = numpy.clip(a_slope + step_s, lo, hi)
+        new_sse = _sse(log_c, a_fs, a_weights, new_log_m[:, None], new_slope, top, bottom)
+        improved = new_sse < a_sse
+        converged = numpy.where(
+            improved, a_sse - new_sse <= tol * a_sse, damping[active] >= 1e8
+        )
+        log_m[active] = numpy.where(improved, new_log_m, a_log_m)
+        slope[active] = numpy.where(improved, new_slope, a_slope)
+        sse[active] = numpy.where(improved, new_sse, a_sse)
+        damping[active] *= numpy.where(improved, 0.1, 10)
+        active = active[~converged]
+        if not len(active):
+            break
+    return log_m, slope, sse
+
+
+def _ic50(log_m, slope, top, bottom, cmin, cmax):
+    """IC50 bounded to range of concentrations, and whether it is a bound."""
+    with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        ic50 = numpy.exp(log_m) * ((top - 0.5) / (0.5 - bottom)) ** (1 / slope)
+    above, below = ic50 > cmax, ic50 < cmin
+    if not (bottom < 0.5 <= top):
+        above = numpy.full(len(ic50), bottom < 0.5)
+        below = numpy.full(len(ic50), bottom >= 0.5)
+    bound = numpy.select([above, below], ["lower", "upper"], "interpolated")
+    return numpy.select([above, below], [cmax, cmin], ic50), bound
+
+
+def _resample_residuals(fitted, values, weights, n_params, n_bootstrap, rng):
+    r"""Curves of shape (n, n_bootstrap, n_concentrations) from resampled residuals.
+
+    Each curve's residuals are resampled among its observed concentrations, which sort
+    first in `observed_first`. Residuals are scaled up by :math:`\sqrt{n / (n - p)}`
+    for :math:`n` points and :math:`p` fit parameters, as they underestimate the noise.
+
+    """
+    observed_first = numpy.argsort(weights == 0, axis=1, kind="stable")
+    n_observed = weights.astype(bool).sum(axis=1)
+    scale = numpy.sqrt(n_observed / numpy.maximum(n_observed - n_params, 1))
+    resid = numpy.where(weights > 0, values - fitted, 0) * scale[:, None]
+    n, n_concs = values.shape
+    draw = rng.random((n, n_bootstrap, n_concs)) * n_observed[:, None, None]
+    draws = numpy.take_along_axis(
+        resid[:, None, :],
+        numpy.take_along_axis(observed_first[:, None, :], draw.astype(int), axis=2),
+        axis=2,
+    )
+    boot_weights = numpy.repeat(weights[:, None, :], n_bootstrap, axis=1)
+    return fitted[:, None, :] + draws, boot_weights
+
+
+def _resample_replicates(replicate_values, replicate_weights, n_bootstrap, rng):
+    r"""Averages of shape (n, n_bootstrap, n_concentrations) of resampled replicates.
+
+    `replicate_values` and `replicate_weights` have shape (n, max_replicates,
+    n_concentrations), with all weights zero for padding replicates. Deviations of the
+    replicates from their mean are scaled up by :math:`\sqrt{k / (k - 1)}` for
+    :math:`k` replicates, as they underestimate the variance between replicates.
+
+    """
+    n_replicates = replicate_weights.any(axis=2).sum(axis=1)
+    n, max_replicates, _ = replicate_values.shape
+    n_at_conc = replicate_weights.sum(axis=1, keepdims=True)
+    total = (replicate_weights * replicate_values).sum(axis=1, keepdims=True)
+    mean = total / numpy.maximum(n_at_conc, 1)
+    scale = numpy.sqrt(n_at_conc / numpy.maximum(n_at_conc - 1, 1))
+    replicate_values = mean + (replicate_values - mean) * scale
+    draw = rng.random((n, n_bootstrap, max_replicates)) * n_replicates[:, None, None]
+    draw = draw.astype(int)[..., None]
+    # replicates are padded at the end, so draw as many as each curve has
+    drawn = numpy.arange(max_replicates) < n_replicates[:, None]
+    w = numpy.take_along_axis(replicate_weights[:, None], draw, axis=2)
+    w = w * drawn[:, None, :, None]
+    v = numpy.take_along_axis(replicate_values[:, None], draw, axis=2)
+    w_sum = w.sum(axis=2)
+    return (w * v).sum(axis=2) / numpy.maximum(w_sum, 1), (w_sum > 0).astype(float)
+
+
+def fit_curves(
+    data,
+    *,
+    conc_col="concentration",
+    fracinf_col="fraction_infectivity",
+    virus_col="virus",
+    replicate_col="replicate",
+    fixslope=(0.5, 2),
+    fixtop=1,
+    fixbottom=0,
+    n_bootstrap=1000,
+    ci=0.95,
+    seed=0,
+    average_only=True,
+    batch_size=100000,
+):
+    """Fit Hill curves to all viruses and replicates.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Tidy data with a row per virus, replicate, and concentration.
+    conc_col : str
+    fracinf_col : str
+    virus_col : str
+    replicate_col : str
+        Columns in `data`. Replicates cannot be named "average".
+    fixslope : float or tuple
+        Fix slope to this value, or bound it within this range.
+    fixtop : float
+    fixbottom : float
+        Fix the top and bottom of the curves to these values.
+    n_bootstrap : int
+        Number of bootstrap samples for confidence intervals, no intervals if 0.
+    ci : float
+        Coverage of the confidence intervals.
+    seed : int
+        Random number seed for the bootstrap.
+    average_only : bool
+        Only return the fits to the average of the replicates.
+    batch_size : int
+        Fit at most this many curves at once, to bound memory.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns like those of ``neutcurve.CurveFits.fitParams``: `virus_col`,
+        `replicate_col` ("average" for the replicate average), "nreplicates" (for
+        averages), "ic50", "ic50_bound", "ic50_str", "midpoint", "slope", "top",
+        "bottom", "r2", and "rmsd", plus "ic50_lower", "ic50_upper", "slope_lower", and
+        "slope_upper" for the confidence intervals if `n_bootstrap` > 0.
+
+    """
+    if isinstance(fixslope, (int, float)):
+        slope_bounds = (float(fixslope), float(fixslope))
+    else:
+        slope_bounds = tuple(map(float, fixslope))
+        if len(slope_bounds) != 2 or slope_bounds[0] >= slope_bounds[1]:
+            raise ValueError(f"invalid {fixslope=}")
+    if (data[replicate_col] == "average").any():
+        raise ValueError(f'{replicate_col=} has a replicate named "average"')
+    if (data[conc_col] <= 0).any():
+        raise ValueError(f"{conc_col=} has concentrations <= 0")
+    data = data[[virus_col, replicate_col, conc_col, fracinf_col]].dropna()
+    if data.duplicated([virus_col, replicate_col, conc_col]).any():
+        raise ValueError("duplicated concentrations for a virus and replicate")
+
+    # replicates and their averages as rows of a matrix over shared concentrations
+    averages = (
+        data.groupby([virus_col, conc_col], observed=True, as_index=False)[fracinf_col]
+        .mean()
+        .assign(**{replicate_col: "average"})
+    )
+    fs = pd.concat([data, averages]).pivot_table(
+        index=[virus_col, replicate_col],
+        columns=conc_col,
+        values=fracinf_col,
+        observed=True,
+        sort=False,
+    ).sort_index(level=virus_col, sort_remaining=False, kind="stable")
+    concs = fs.columns.to_numpy(float)
+    fs = fs[numpy.sort(concs)]
+    concs = numpy.sort(concs)
+    log_c = numpy.log(concs)
+    weights = fs.notnull().to_numpy(float)
+    values = fs.fillna(0).to_numpy()
+    curves = fs.index.to_frame(index=False)
+    # replicates of each curve, padded to the most replicates; none for replicate curves
+    is_average = (curves[replicate_col] == "average").to_numpy()
+    replicate_rows = curves[~is_average].reset_index()
+    slot = replicate_rows.groupby(virus_col, observed=True).cumcount().to_numpy()
+    replicate_index = pd.DataFrame(
+        {"row": replicate_rows["index"], "virus": replicate_rows[virus_col], "slot": slot}
+    ).pivot_table(
+        index="virus", columns="slot", values="row", fill_value=-1, observed=True
+    )
+    replicate_index = numpy.where(
+        is_average[:, None],
+        replicate_index.loc[curves[virus_col]].to_numpy(int),
+        -1,
+    )
+    has_replicate = (replicate_index >= 0)[..., None]
+    replicate_values = numpy.where(has_replicate, values[replicate_index], 0)
+    replicate_weights = numpy.where(has_replicate, weights[replicate_index], 0)
+    if average_only:
+        keep = is_average
+    else:
+        keep = numpy.ones(len(curves), dtype=bool)
+    curves, values, weights, is_average, replicate_values, replicate_weights = (
+        curves[keep].reset_index(drop=True),
+        values[keep],
+        weights[keep],
+        is_average[keep],
+        replicate_values[keep],
+        replicate_weights[keep],
+    )
+    # each curve's own range of concentrations, for bounding IC50s
+    observed = numpy.where(weights > 0, concs, numpy.nan)
+    cmin, cmax = numpy.nanmin(observed, axis=1), numpy.nanmax(observed, axis=1)
+
+    fit_kwargs = {"slope_bounds": slope_bounds, "top": fixtop, "bottom": fixbottom}
+    log_m, slope, sse = map(
+        numpy.concatenate,
+        zip(
+            *(
+                fit_batch(
+                    log_c,
+                    values[i: i + batch_size],
+                    weights[i: i + batch_size],
+                    **fit_kwargs,
+                )
+                for i in range(0, len(values), batch_size)
+            )
+        ),
+    )
+    ic50, ic50_bound = _ic50(log_m, slope, fixtop, fixbottom, cmin, cmax)
+    n_points = weights.sum(axis=1)
+    mean_fs = (weights * values).sum(axis=1) / n_points
+    sstot = (weights * (values - mean_fs[:, None]) ** 2).sum(axis=1)
+    nreplicates = data.groupby(virus_col, observed=True)[replicate_col].nunique()
+    fits = curves.assign(
+        nreplicates=lambda x: x[virus_col]
+        .map(nreplicates)
+        .where(x[replicate_col] == "average")
+        .astype("Int64"),
+        ic50=ic50,
+        ic50_bound=ic50_bound,
+        ic50_str=[
+            {"interpolated": "", "upper": "<", "lower": ">"}[b] + f"{x:.3g}"
+            for x, b in zip(ic50, ic50_bound)
+        ],
+        midpoint=numpy.exp(log_m),
+        slope=slope,
+        top=float(fixtop),
+        bottom=float(fixbottom),
+        r2=numpy.where(
+            sstot > 0, 1 - sse / numpy.where(sstot > 0, sstot, 1), (sse == 0) * 1.0
+        ),
+        rmsd=numpy.sqrt(sse / n_points),
+    )
+
+    if n_bootstrap > 0:
+        rng = numpy.random.default_rng(seed)
+        fitted = _hill(log_c, log_m[:, None], slope[:, None], fixtop, fixbottom)
+        n_params = 1 if slope_bounds[0] == slope_bounds[1] else 2
+        resample_replicates = is_average & (replicate_weights.any(axis=2).sum(axis=1) > 1)
+        boot_ic50 = numpy.empty((len(values), n_bootstrap))
+        boot_slope = numpy.empty((len(values), n_bootstrap))
+        curves_per_batch = max(1, batch_size // n_bootstrap)
+        for start in range(0, len(values), curves_per_batch):
+            idx = numpy.arange(start, min(start + curves_per_batch, len(values)))
+            # resample replicates for averages of several, otherwise resample residuals
+            boot_fs, boot_weights = _resample_residuals(
+                fitted[idx], values[idx], weights[idx], n_params, n_bootstrap, rng
+            )
+            average_fs, average_weights = _resample_replicates(
+                replicate_values[idx], replicate_weights[idx], n_bootstrap, rng
+            )
+            boot_fs = numpy.where(
+                resample_replicates[idx, None, None], average_fs, boot_fs
+            ).reshape(-1, len(log_c))
+            boot_weights = numpy.where(
+                resample_replicates[idx, None, None], average_weights, boot_weights
+            ).reshape(-1, len(log_c))
+            b_log_m, b_slope, _ = fit_batch(
+                log_c,
+                boot_fs,
+                boot_weights,
+                init=(
+                    numpy.repeat(log_m[idx], n_bootstrap),
+                    numpy.repeat(slope[idx], n_bootstrap),
+                ),
+                **fit_kwargs,
+            )
+            b_ic50, _ = _ic50(
+                b_log_m,
+                b_slope,
+                fixtop,
+                fixbottom,
+                numpy.repeat(cmin[idx], n_bootstrap),
+                numpy.repeat(cmax[idx], n_bootstrap),
+            )
+            boot_ic50[idx] = b_ic50.reshape(len(idx), n_bootstrap)
+            boot_slope[idx] = b_slope.reshape(len(idx), n_bootstrap)
+        q = [(1 - ci) / 2, (1 + ci) / 2]
+        # IC50s are log-normal-ish, so take the quantiles on a log scale
+        ic50_ci = numpy.exp(numpy.quantile(numpy.log(boot_ic50), q, axis=1))
+        slope_ci = numpy.quantile(boot_slope, q, axis=1)
+        fits = fits.assign(
+            ic50_lower=ic50_ci[0],
+            ic50_upper=ic50_ci[1],
+            slope_lower=slope_ci[0],
+            slope_upper=slope_ci[1],
+        )
+    return fits
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Fit Hill curves to validation neutralization data in batches."
+    )
+    parser.add_argument(
+        "--curves-csv",
+        required=True,
+        help="Wide CSV of curves with a column per replicate, see `read_wide_curves`.",
+    )
+    parser.add_argument("--conc-col", default="Concentration (ug/mL)")
+    parser.add_argument(
+        "--fixslope",
+        type=float,
+        nargs="+",
+        default=[0.5, 2],
+        help="Fix slope to one value, or bound it between two values.",
+    )
+    parser.add_argument("--n-bootstrap", type=int, default=1000)
+    parser.add_argument("--ci", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--all-replicates",
+        action="store_true",
+        help="Also report fits to individual replicates, not just averages.",
+    )
+    parser.add_argument("--output-csv", required=True)
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    if len(args.fixslope) not in {1, 2}:
+        raise ValueError(f"--fixslope takes one or two values, not {args.fixslope}")
+    data = read_wide_curves(args.curves_csv, conc_col=args.conc_col)
+    data["virus"] = pd.Categorical(
+        data["virus"], validation_variant_order(data["virus"].unique()), ordered=True
+    )
+    print(
+        f"Read {data['virus'].nunique()} variants with "
+        f"{data.groupby('virus', observed=True)['replicate'].nunique().sum()} replicates"
+    )
+    start = time.time()
+    fits = fit_curves(
+        data,
+        fixslope=args.fixslope[0] if len(args.fixslope) == 1 else args.fixslope,
+        n_bootstrap=args.n_bootstrap,
+        ci=args.ci,
+        seed=args.seed,
+        average_only=not args.all_replicates,
+    )
+    print(
+        f"Fit {len(fits)} curves with {args.n_bootstrap} bootstraps "
+        f"in {time.time() - start:.2f} sec"
+    )
+    print(f"Writing to {args.output_csv}")
+    fits.to_csv(args.output_csv, index=False, float_format="%.6g")
+
+
+if __name__ == "__main__":
+    main()
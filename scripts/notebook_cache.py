@@ -0,0 +1,306 @@
+"""Content-addressed cache of the outputs of notebook rules.
+
+``snakemake`` reruns a rule whenever an input is newer than its outputs, even if the
+bytes of the inputs are unchanged (eg, after a fresh clone, or when an upstream rule
+rewrites the same CSV). A :class:`NotebookCache` keys the outputs of a notebook on a
+hash of the contents of its input files, its parameters, and the source of its code
+cells (see :func:`cache_key`), so a rerun with an unchanged key restores the outputs
+from the cache rather than executing the notebook.
+
+The cache is a directory with one subdirectory of outputs per key. When it exceeds a
+maximum size, the least recently used entries are evicted. Each lookup is logged as
+a hit or miss in ``stats.tsv`` in the cache directory, which is summarized per rule
+by the ``stats`` command::
+
+    python scripts/notebook_cache.py stats --cache-dir .notebook_cache
+
+The ``run`` command wraps a command (eg, ``papermill``) that is only executed on a
+miss, and the :mod:`notebook_runner` uses the cache for each notebook it runs.
+
+"""
+
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+import file_hashes
+
+
+STATS_FILE = "stats.tsv"
+
+
+def notebook_source_hash(nb):
+    """SHA-256 hex digest of the source of the code cells of a Jupyter notebook.
+
+    Outputs, execution counts, and metadata do not change the hash.
+
+    """
+    with open(nb) as f:
+        cells = json.load(f)["cells"]
+    source = [
+        "".join(cell["source"]) for cell in cells if cell["cell_type"] == "code"
+    ]
+    return hashlib.sha256(json.dumps(source).encode()).hexdigest()
+
+
+def cache_key(input_files, params, nb=None):
+    """Key for notebook outputs given the inputs.
+
+    Parameters
+    ----------
+    input_files : list
+        Input files, hashed by path and contents. They are sorted by path so the key
+        does not depend on their order, and swapping the contents of two inputs
+        changes the key.
+    params : object
+        JSON-serializable parameters (eg, the ``params_yaml`` string or a dict).
+    nb : None or str
+        Notebook hashed by :func:`notebook_source_hash`.
+
+    Returns
+    -------
+    str
+
+    """
+    key = {
+        "input_files": sorted(
+            (path, file_hashes.file_hash(path)) for path in {os.path.normpath(f) for f in input_files}
+        ),
+        "params": params,
+        "nb": notebook_source_hash(nb) if nb else None,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class NotebookCache:
+    """Directory of notebook outputs keyed by :func:`cache_key`.
+
+    Parameters
+    ----------
+    cache_dir : str
+    max_bytes : None or int
+        After adding an entry, evict least recently used entries until the cache is
+        at most this size.
+
+    """
+
+    def __init__(self, cache_dir, *, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _log(self, rule, key, result):
+        with open(os.path.join(self.cache_dir, STATS_FILE), "a") as f:
+            f.write(f"{time.time():.0f}\t{rule}\t{key}\t{result}\n")
+
+    def restore(self, rule, key, output_files):
+        """Copy cached outputs into place if `key` is in the cache.
+
+        Parameters
+        ----------
+        rule : str
+            Name of the rule, for the statistics.
+        key : str
+        output_files : list
+
+        Returns
+        -------
+        bool
+            Whether the outputs were restored (a hit).
+
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, "outputs.json")) as f:
+                cached = json.load(f)
+            if sorted(cached) != sorted(output_files):
+                raise ValueError(f"cached outputs {cached} differ from {output_files}")
+            for i, output_file in enumerate(cached):
+                if os.path.dirname(output_file):
+                    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                shutil.copyfile(os.path.join(entry_dir, str(i)), output_file)
+            # mark as recently used for LRU eviction
+            os.utime(entry_dir)
+        except (OSError, ValueError):
+            self._log(rule, key, "miss")
+            return False
+        self._log(rule, key, "hit")
+        return True
+
+    def store(self, key, output_files):
+        """Add outputs to the cache, then evict entries if it is too large.
+
+        Parameters
+        ----------
+        key : str
+        output_files : list
+
+        """
+        if os.path.isdir(self._entry_dir(key)):
+            return
+        # copy to a temporary directory and rename, so partial entries are never seen
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp_")
+        for i, output_file in enumerate(output_files):
+            shutil.copyfile(output_file, os.path.join(tmp_dir, str(i)))
+        with open(os.path.join(tmp_dir, "outputs.json"), "w") as f:
+            json.dump(list(output_files), f)
+        try:
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError:
+            # another job stored the same key
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def entries(self):
+        """Entries in the cache.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns are "key", "bytes", and "last_used" (seconds since the epoch),
+            sorted from least to most recently used.
+
+        """
+        records = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if key.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            try:
+                records.append(
+                    {
+                        "key": key,
+                        "bytes": sum(
+                            os.path.getsize(os.path.join(entry_dir, f))
+                            for f in os.listdir(entry_dir)
+                        ),
+                        "last_used": os.path.getmtime(entry_dir),
+                    }
+                )
+            except OSError:
+                # evicted by another job
+                continue
+        return (
+            pd.DataFrame(records, columns=["key", "bytes", "last_used"])
+            .sort_values("last_used")
+            .reset_index(drop=True)
+        )
+
+    def evict(self, max_bytes):
+        """Remove least recently used entries until the cache is at most `max_bytes`.
+
+        Returns
+        -------
+        int
+            Number of entries removed.
+
+        """
+        entries = self.entries()
+        excess = entries["bytes"].sum() - max_bytes
+        n_evicted = 0
+        for key, nbytes in entries[["key", "bytes"]].itertuples(index=False):
+            if excess <= 0:
+                break
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            excess -= nbytes
+            n_evicted += 1
+        return n_evicted
+
+    def stats(self):
+        """Number of hits and misses for each rule.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns are "rule", "hits", "misses", and "hit_rate".
+
+        """
+        stats_file = os.path.join(self.cache_dir, STATS_FILE)
+        if os.path.isfile(stats_file):
+            log = pd.read_csv(
+                stats_file, sep="\t", names=["time", "rule", "key", "result"]
+            )
+        else:
+            log = pd.DataFrame(columns=["time", "rule", "key", "result"])
+        return (
+            log.assign(
+                hits=lambda x: (x["result"] == "hit").astype(int),
+                misses=lambda x: (x["result"] == "miss").astype(int),
+            )
+            .groupby("rule", as_index=False)
+            .aggregate({"hits": "sum", "misses": "sum"})
+            .assign(hit_rate=lambda x: (x["hits"] / (x["hits"] + x["misses"])).round(3))
+        )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Content-addressed cache of the outputs of notebook rules."
+    )
+    parser.add_argument("--cache-dir", required=True, help="Cache directory.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser(
+        "run", help="Restore outputs from the cache, or run a command and cache them."
+    )
+    run.add_argument("--rule", required=True, help="Name of rule, for statistics.")
+    run.add_argument("--inputs", nargs="+", required=True, help="Input files.")
+    run.add_argument("--outputs", nargs="+", required=True, help="Output files.")
+    run.add_argument("--params", default="", help="Parameters (eg, YAML string).")
+    run.add_argument("--nb", help="Notebook whose code cells are part of the key.")
+    run.add_argument("--max-mb", type=float, help="Maximum size of the cache in MB.")
+    run.add_argument("cmd", nargs=argparse.REMAINDER, help="Command after `--`.")
+
+    subparsers.add_parser("stats", help="Print cache hits and misses for each rule.")
+
+    evict = subparsers.add_parser("evict", help="Evict least recently used entries.")
+    evict.add_argument("--max-mb", type=float, required=True)
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    if args.command == "run":
+        max_bytes = None if args.max_mb is None else int(args.max_mb * 1e6)
+        cache = NotebookCache(args.cache_dir, max_bytes=max_bytes)
+        key = cache_key(args.inputs, args.params, args.nb)
+        if cache.restore(args.rule, key, args.outputs):
+            print(f"Restored outputs of {args.rule} from cache entry {key}")
+            return
+        cmd = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+        if not cmd:
+            raise ValueError("no command to run after `--`")
+        print(f"No cache entry {key} for {args.rule}, running: {' '.join(cmd)}")
+        sys.stdout.flush()
+        subprocess.run(cmd, check=True)
+        cache.store(key, args.outputs)
+        print(f"Stored outputs of {args.rule} in cache entry {key}")
+    elif args.command == "stats":
+        cache = NotebookCache(args.cache_dir)
+        entries = cache.entries()
+        print(f"{len(entries)} entries of {entries['bytes'].sum() / 1e6:.1f} MB in {args.cache_dir}")
+        print(cache.stats().to_string(index=False))
+    elif args.command == "evict":
+        cache = NotebookCache(args.cache_dir)
+        n_evicted = cache.evict(int(args.max_mb * 1e6))
+        print(f"Evicted {n_evicted} entries from {args.cache_dir}")
+    else:
+        raise ValueError(f"invalid {args.command=}")
+
+
+if __name__ == "__main__":
+    main()
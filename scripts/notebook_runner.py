@@ -0,0 +1,189 @@
+"""Run several papermill notebooks in one long-lived Jupyter kernel.
+
+Running each notebook with the ``papermill`` command starts a new kernel that
+re-imports altair, pandas, polyclonal, etc, which for small analyses takes longer than
+the analysis itself. A :class:`NotebookRunner` starts one kernel, imports
+:data:`PRELOAD_MODULES` into it once, and then executes each notebook in it with
+``papermill.execute_notebook``, so the output notebooks are the same as from the
+command line. The namespace is reset between notebooks, but imported modules stay
+loaded, as do the CSVs cached by :func:`analyses.read_csv`. Notebooks whose outputs
+are in a :class:`notebook_cache.NotebookCache` are restored rather than run, and the
+kernel is only started if some notebook must be run.
+
+Used by the ``analysis_notebooks`` rule via ``run_analysis_notebooks.py``.
+
+"""
+
+
+import contextlib
+import os
+import time
+
+import jupyter_client
+
+import papermill
+
+import notebook_cache
+
+
+# imported into the kernel when it starts, skipping any that are not installed
+PRELOAD_MODULES = [
+    "altair",
+    "dms_variants",
+    "neutcurve",
+    "numpy",
+    "pandas",
+    "polyclonal",
+    "scipy",
+]
+
+
+class NotebookRunner:
+    """Jupyter kernel that executes several notebooks with papermill.
+
+    Use as a context manager, which starts the kernel on entry and shuts it down on
+    exit.
+
+    Parameters
+    ----------
+    scripts_dir : None or str
+        Add this directory to the kernel's ``sys.path``, and preload
+        :mod:`analyses` from it.
+    preload : list
+        Modules to import when the kernel starts.
+    kernel_name : str
+        Name of Jupyter kernel.
+
+    """
+
+    def __init__(self, *, scripts_dir=None, preload=PRELOAD_MODULES, kernel_name="python3"):
+        self.scripts_dir = scripts_dir
+        self.preload = list(preload)
+        self.kernel_name = kernel_name
+        self.km = None
+
+    def __enter__(self):
+        start = time.time()
+        self.km = jupyter_client.KernelManager(kernel_name=self.kernel_name)
+        self.km.start_kernel(cwd=os.getcwd())
+        code = [
+            "import importlib",
+            "import sys",
+            f"for _module in {self.preload!r}:",
+            "    try:",
+            "        importlib.import_module(_module)",
+            "    except ImportError:",
+            "        pass",
+        ]
+        if self.scripts_dir:
+            code += [
+                f"sys.path.insert(0, {os.path.abspath(self.scripts_dir)!r})",
+                "import analyses",
+            ]
+        self._execute("\n".join(code))
+        print(f"Started kernel and preloaded modules in {time.time() - start:.1f} sec")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.km.shutdown_kernel(now=True)
+        self.km = None
+
+    def _execute(self, code):
+        """Execute code in the kernel, raising an error if it fails."""
+        kc = self.km.client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=60)
+            reply = kc.execute_interactive(
+                code, store_history=False, output_hook=lambda msg: None
+            )
+        finally:
+            kc.stop_channels()
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(
+                f"failed to execute in kernel:\n{code}\n{reply['content'].get('evalue')}"
+            )
+
+    def run(self, input_nb, output_nb, parameters, stdout_file=None):
+        """Execute a notebook in the kernel.
+
+        Parameters
+        ----------
+        input_nb : str
+        output_nb : str
+        parameters : dict
+            Injected as papermill parameters.
+        stdout_file : None or file-like
+            Write output of the notebook cells here.
+
+        """
+        if self.km is None:
+            raise ValueError("use `NotebookRunner` as a context manager")
+        # start each notebook with an empty namespace but keep imported modules
+        self._execute("get_ipython().run_line_magic('reset', '-f')")
+        start = time.time()
+        papermill.execute_notebook(
+            input_nb,
+            output_nb,
+            parameters=parameters,
+            progress_bar=False,
+            stdout_file=stdout_file,
+            stderr_file=stdout_file,
+            km=self.km,
+        )
+        print(f"Ran {input_nb} to {output_nb} in {time.time() - start:.1f} sec")
+
+
+def run_notebooks(
+    notebooks,
+    *,
+    scripts_dir=None,
+    preload=PRELOAD_MODULES,
+    stdout_file=None,
+    cache=None,
+):
+    """Execute notebooks in order in one kernel.
+
+    Parameters
+    ----------
+    notebooks : dict
+        Keyed by name, values are dicts with keys "input_nb", "output_nb", and
+        "parameters" passed to :meth:`NotebookRunner.run`, and "input_files" and
+        "output_files" (including "output_nb") used with `cache`.
+    scripts_dir : None or str
+        Passed to :class:`NotebookRunner`.
+    preload : list
+        Passed to :class:`NotebookRunner`.
+    stdout_file : None or file-like
+        Passed to :meth:`NotebookRunner.run`.
+    cache : None or notebook_cache.NotebookCache
+        Restore outputs of notebooks from this cache when possible, and store
+        outputs of the ones that are run.
+
+    """
+    with contextlib.ExitStack() as stack:
+        runner = None
+        for name, notebook in notebooks.items():
+            if cache is not None:
+                # key after earlier notebooks have run, as they may make inputs
+                key = notebook_cache.cache_key(
+                    notebook["input_files"],
+                    notebook["parameters"],
+                    notebook["input_nb"],
+                )
+                if cache.restore(name, key, notebook["output_files"]):
+                    print(f"\nRestored outputs of {name} from cache entry {key}")
+                    continue
+            if runner is None:
+                runner = stack.enter_context(
+                    NotebookRunner(scripts_dir=scripts_dir, preload=preload)
+                )
+            print(f"\nRunning {name}")
+            runner.run(
+                notebook["input_nb"],
+                notebook["output_nb"],
+                notebook["parameters"],
+                stdout_file=stdout_file,
+            )
+            if cache is not None:
+                cache.store(key, notebook["output_files"])
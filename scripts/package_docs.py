@@ -0,0 +1,378 @@
+"""Package the Altair chart HTMLs of the built documentation site for serving.
+
+The chart HTMLs written by Altair each load Vega, Vega-Lite, and Vega-Embed from a CDN
+and inline all of their data in the spec. :func:`package_site` rewrites them in a
+built site directory (eg, ``homepage/.vitepress/dist``) so that:
+
+ - they all reference one vendored, content-hashed Vega bundle (made from the
+   ``vega``, ``vega-lite``, and ``vega-embed`` builds in ``node_modules``, so the
+   versions are those pinned in ``package-lock.json``), which browsers cache once
+   for all charts;
+ - their data (named ``datasets`` and large inline ``values``) is moved to sidecar
+   files in a ``data`` subdirectory next to the HTML, named by a hash of their
+   content so data shared by several charts is stored once. The spec stays inline
+   in the HTML so it can still be parsed by the homepage's ``Altair.vue``, which
+   resolves the sidecar URLs relative to the HTML.
+
+Text files in the site are then pre-compressed to ``.gz`` and (if the optional
+``brotli`` package is installed) ``.br`` variants, and the total payload of the
+charts before and after packaging is reported.
+
+Run as a script by ``npm run docs:package`` after ``npm run docs:build``.
+
+"""
+
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+VEGA_JS = [
+    "vega/build/vega.min.js",
+    "vega-lite/build/vega-lite.min.js",
+    "vega-embed/build/vega-embed.min.js",
+]
+
+COMPRESS_SUFFIXES = (".html", ".js", ".css", ".json", ".csv", ".svg", ".txt")
+
+_CDN_SCRIPT = re.compile(
+    r'[ \t]*<script type="text/javascript" '
+    r'src="https://cdn\.jsdelivr\.net/npm/vega(?:-lite|-embed)?@[^"]*"></script>\n?'
+)
+
+_SPEC_START = "var spec = "
+
+
+def _content_hash(content, length=16):
+    """Hex digest of the first `length` characters of SHA-256 of bytes `content`."""
+    return hashlib.sha256(content).hexdigest()[:length]
+
+
+def make_vega_bundle(node_modules, bundle_dir):
+    """Concatenate the vendored Vega builds into one content-hashed bundle.
+
+    Parameters
+    ----------
+    node_modules : str
+        The ``node_modules`` directory with ``vega``, ``vega-lite``, and ``vega-embed``.
+    bundle_dir : str
+        Write the bundle to this directory.
+
+    Returns
+    -------
+    str
+        Path to the bundle, named ``vega-bundle.<hash>.js``.
+
+    """
+    parts = []
+    for js in VEGA_JS:
+        path = os.path.join(node_modules, js)
+        if not os.path.isfile(path):
+            raise ValueError(f"cannot find {path}, run `npm ci` first")
+        with open(path, "rb") as f:
+            parts.append(f.read())
+    bundle = b"\n;\n".join(parts)
+    os.makedirs(bundle_dir, exist_ok=True)
+    bundle_path = os.path.join(bundle_dir, f"vega-bundle.{_content_hash(bundle)}.js")
+    with open(bundle_path, "wb") as f:
+        f.write(bundle)
+    return bundle_path
+
+
+def _write_sidecar(values, data_dir):
+    """Write data values to a content-named sidecar file, return its name."""
+    if isinstance(values, str):
+        content, suffix = values.encode(), ".csv"
+    else:
+        content = json.dumps(values, separators=(",", ":")).encode()
+        suffix = ".json"
+    name = _content_hash(content) + suffix
+    path = os.path.join(data_dir, name)
+    if not os.path.isfile(path):
+        os.makedirs(data_dir, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+    return name
+
+
+def split_spec_data(spec, data_dir, data_url, min_inline_bytes=1000):
+    """Move the data in a Vega-Lite spec to sidecar files.
+
+    Parameters
+    ----------
+    spec : dict
+        Vega-Lite spec, modified in place.
+    data_dir : str
+        Directory to write the sidecar files.
+    data_url : str
+        URL of `data_dir` relative to the HTML with the spec.
+    min_inline_bytes : int
+        Inline ``values`` smaller than this (as JSON) stay in the spec.
+
+    Returns
+    -------
+    list
+        Names of the sidecar files referenced by the spec.
+
+    """
+    datasets = {
+        name: _write_sidecar(values, data_dir)
+        for name, values in spec.pop("datasets", {}).items()
+    }
+    sidecars = set()
+
+    def url_data(data):
+        """Data referencing a sidecar file rather than a dataset or inline values."""
+        if set(data) - {"name", "format"}:
+            # values to keep inline, or data that is already from a URL
+            if not (
+                "values" in data
+                and len(json.dumps(data["values"])) >= min_inline_bytes
+            ):
+                return data
+            sidecar = _write_sidecar(data["values"], data_dir)
+        elif data.get("name") in datasets:
+            sidecar = datasets[data["name"]]
+        else:
+            return data
+        sidecars.add(sidecar)
+        new_data = {"url": f"{data_url}/{sidecar}"}
+        fmt = data.get("format", {})
+        if sidecar.endswith(".csv") and "type" not in fmt:
+            fmt = {**fmt, "type": "csv"}
+        if fmt:
+            new_data["format"] = fmt
+        return new_data
+
+    def walk(obj):
+        if isinstance(obj, dict):
+            for key, val in obj.items():
+                if key == "data" and isinstance(val, dict):
+                    obj[key] = url_data(val)
+                else:
+                    walk(val)
+        elif isinstance(obj, list):
+            for val in obj:
+                walk(val)
+
+    walk(spec)
+    return sorted(sidecars)
+
+
+def package_chart_html(html_file, bundle_path, *, min_inline_bytes=1000):
+    """Rewrite an Altair chart HTML to use the Vega bundle and sidecar data.
+
+    Parameters
+    ----------
+    html_file : str
+    bundle_path : str
+        Path to bundle from :func:`make_vega_bundle`.
+    min_inline_bytes : int
+        Passed to :func:`split_spec_data`.
+
+    Returns
+    -------
+    None or list
+        `None` if `html_file` is not an Altair chart HTML loading Vega from the CDN
+        (eg, it is already packaged), otherwise paths of its sidecar files.
+
+    """
+    with open(html_file) as f:
+        html = f.read()
+    if _SPEC_START not in html or not _CDN_SCRIPT.search(html):
+        return None
+
+    html_dir = os.path.dirname(html_file)
+    data_dir = os.path.join(html_dir, "data")
+    spec_start = html.index(_SPEC_START) + len(_SPEC_START)
+    spec, spec_end = json.JSONDecoder().raw_decode(html, spec_start)
+    sidecars = split_spec_data(spec, data_dir, "data", min_inline_bytes)
+    if "};" in json.dumps(spec):
+        # the homepage parses the spec as ending at the first "};"
+        raise ValueError(f"spec in {html_file} cannot be parsed by the homepage")
+
+    bundle_src = os.path.relpath(bundle_path, html_dir).replace(os.sep, "/")
+    bundle_tag = f'  <script type="text/javascript" src="{bundle_src}"></script>\n'
+    html = html[:spec_start] + json.dumps(spec) + html[spec_end:]
+    first = _CDN_SCRIPT.search(html).start()
+    html = html[:first] + bundle_tag + _CDN_SCRIPT.sub("", html[first:])
+    with open(html_file, "w") as f:
+        f.write(html)
+    return [os.path.join(data_dir, sidecar) for sidecar in sidecars]
+
+
+def compress_file(path, min_bytes=1000):
+    """Write ``.gz`` and (if ``brotli`` is installed) ``.br`` variants of a file.
+
+    Parameters
+    ----------
+    path : str
+    min_bytes : int
+        Do not compress files smaller than this.
+
+    Returns
+    -------
+    dict
+        Sizes in bytes of the file keyed by "raw", "gz", and "br" (the last two are
+        the raw size for files too small to compress, and "br" is `None` if
+        ``brotli`` is not installed).
+
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    sizes = {
+        "raw": len(content),
+        "gz": len(content),
+        "br": len(content) if brotli is not None else None,
+    }
+    if len(content) < min_bytes:
+        return sizes
+    gz = gzip.compress(content, compresslevel=9, mtime=0)
+    with open(path + ".gz", "wb") as f:
+        f.write(gz)
+    sizes["gz"] = len(gz)
+    if brotli is not None:
+        br = brotli.compress(content, quality=11)
+        with open(path + ".br", "wb") as f:
+            f.write(br)
+        sizes["br"] = len(br)
+    return sizes
+
+
+def package_site(site_dir, node_modules, *, bundle_subdir="vendor", min_inline_bytes=1000):
+    """Package all the Altair chart HTMLs in a built site and pre-compress it.
+
+    Parameters
+    ----------
+    site_dir : str
+        Built site directory.
+    node_modules : str
+        Passed to :func:`make_vega_bundle`.
+    bundle_subdir : str
+        Subdirectory of `site_dir` for the Vega bundle.
+    min_inline_bytes : int
+        Passed to :func:`split_spec_data`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Payload of each packaged chart, with columns "chart", "bytes_before" (size of
+        the original HTML), and "bytes_after", "gz_bytes_after", and "br_bytes_after"
+        (sizes of the packaged HTML plus its sidecar files, raw and compressed, with
+        "br_bytes_after" missing if ``brotli`` is not installed). Sidecar files
+        shared among charts are counted for each of them.
+
+    """
+    if not os.path.isdir(site_dir):
+        raise ValueError(f"{site_dir=} is not a directory")
+    html_files = sorted(
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(site_dir)
+        for filename in filenames
+        if filename.endswith(".html")
+    )
+    bundle_path = make_vega_bundle(node_modules, os.path.join(site_dir, bundle_subdir))
+    print(f"Wrote Vega bundle {bundle_path}")
+
+    charts = {}
+    for html_file in html_files:
+        bytes_before = os.path.getsize(html_file)
+        sidecars = package_chart_html(
+            html_file, bundle_path, min_inline_bytes=min_inline_bytes
+        )
+        if sidecars is not None:
+            charts[html_file] = (bytes_before, sidecars)
+    print(f"Packaged {len(charts)} of {len(html_files)} HTMLs as charts")
+
+    sizes = {}
+    for dirpath, _, filenames in os.walk(site_dir):
+        for filename in filenames:
+            if filename.endswith(COMPRESS_SUFFIXES):
+                path = os.path.join(dirpath, filename)
+                sizes[path] = compress_file(path)
+    if brotli is None:
+        print("The brotli package is not installed, so only wrote .gz variants")
+
+    keys = {"raw": "bytes_after", "gz": "gz_bytes_after", "br": "br_bytes_after"}
+    if brotli is None:
+        del keys["br"]
+    records = []
+    for html_file, (bytes_before, sidecars) in charts.items():
+        files = [html_file, *sidecars]
+        records.append(
+            {
+                "chart": os.path.relpath(html_file, site_dir),
+                "bytes_before": bytes_before,
+                **{col: sum(sizes[f][key] for f in files) for key, col in keys.items()},
+            }
+        )
+    report = pd.DataFrame(
+        records,
+        columns=["chart", "bytes_before", "bytes_after", "gz_bytes_after", "br_bytes_after"],
+    )
+
+    unique_sidecars = {f for _, sidecars in charts.values() for f in sidecars}
+    mb = lambda n: f"{n / 1e6:.2f} MB"  # noqa: E731
+
+    def describe(files):
+        total = {
+            key: sum(sizes[f][key] for f in files) for key in keys if key != "raw"
+        }
+        compressed = ", ".join(
+            f"{mb(n)} {'gzipped' if key == 'gz' else 'brotli'}"
+            for key, n in total.items()
+        )
+        return f"{mb(sum(sizes[f]['raw'] for f in files))} ({compressed})"
+
+    print(
+        f"Total chart payload before: {mb(report['bytes_before'].sum())} of HTML, "
+        "plus Vega from the CDN\n"
+        f"Total chart payload after: {describe([*charts, *unique_sidecars])} of HTML "
+        f"and data, plus the {describe([bundle_path])} Vega bundle shared by all charts"
+    )
+    return report
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Package the Altair chart HTMLs of a built site for serving."
+    )
+    parser.add_argument("--site-dir", required=True, help="Built site directory.")
+    parser.add_argument(
+        "--node-modules", default="node_modules", help="Directory with vendored Vega."
+    )
+    parser.add_argument(
+        "--min-inline-bytes",
+        type=int,
+        default=1000,
+        help="Keep inline data smaller than this in the spec.",
+    )
+    parser.add_argument("--report-csv", help="Write payload of each chart to this CSV.")
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    print(f"Packaging charts in {args.site_dir}")
+    report = package_site(
+        args.site_dir, args.node_modules, min_inline_bytes=args.min_inline_bytes
+    )
+    if args.report_csv:
+        print(f"Writing payload of each chart to {args.report_csv}")
+        report.to_csv(args.report_csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,685 @@
+"""Check that a new implementation of a step gives the same outputs as an old one.
+
+Performance work on the scripts can silently change numbers in ``results/``. For each
+step in :data:`STEPS`, this runs the step with the scripts of an old version of the
+repo (a git revision, extracted with ``git archive``, or a directory) and with those
+of the working tree, on the same inputs, and compares the outputs:
+
+ - CSVs are matched on their key columns, so the order of rows does not matter unless
+   the output is marked as ordered. Key columns and other non-numeric columns must be
+   exactly equal, while numeric columns are compared with relative and absolute
+   tolerances (nulls equal nulls). The absolute tolerance of each value is at least
+   one unit in the last digit printed by the output's float format (eg, 1e-4 for
+   ``%.4f``), so values that differ only by rounding of their last digit match.
+ - JSONs are flattened to one row per leaf (keyed by its path) and compared the same
+   way, so node scores in node data JSONs are compared with the tolerances.
+
+Steps run by ``snakemake`` as ``script:`` are run outside of ``snakemake`` with a
+``snakemake`` object holding the inputs, outputs, params, and log.
+
+Each side is run ``--repeats`` times and the fastest wall time is used for the
+speedup. A CSV reports, for each output, the speedup and any missing, extra, or
+mismatched rows (or that the old code did not write the output), and examples of mismatches are written to a second CSV. The exit
+status is 1 if any output differs::
+
+    python scripts/parity_check.py --old-rev HEAD~1 --steps cell_entry_mut_diffs
+
+Inputs default to those of the pipeline, and can be set with ``--input``, for instance
+to run the Nextstrain steps on the synthetic data of
+``nextstrain/workflow/scripts/benchmark-scripts.py``.
+
+"""
+
+
+import argparse
+import json
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+import pandas as pd
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# parts of the repo with the code of steps, extracted for old revisions
+CODE_PATHS = ["scripts", "notebooks", "nextstrain/workflow/scripts"]
+
+
+def _cell_entry_mut_diffs_command(root, inputs, params, outdir):
+    if not os.path.isfile(os.path.join(root, "scripts/entry_diffs.py")):
+        # before `entry_diffs.py`, the step was a notebook that only wrote `mut_diffs`
+        return [
+            "papermill",
+            os.path.join(root, "notebooks/cell_entry_mut_diffs.ipynb"),
+            os.path.join(outdir, "cell_entry_mut_diffs.ipynb"),
+            "-p", "mut_effects_csv", inputs["mut_effects_csv"],
+            "-p", "mut_diffs_csv", os.path.join(outdir, "mut_diffs.csv"),
+            "-y", json.dumps(
+                {"cells": params["cells"], "floor_mut_effects": params["floor"]}
+            ),
+        ]
+    return [
+        sys.executable,
+        os.path.join(root, "scripts/entry_diffs.py"),
+        "--mut-effects-csv", inputs["mut_effects_csv"],
+        "--cells", *params["cells"],
+        "--floor", str(params["floor"]),
+        "--mut-diffs-csv", os.path.join(outdir, "mut_diffs.csv"),
+        "--site-diffs-csv", os.path.join(outdir, "site_diffs.csv"),
+        "--dtype", "float64",
+    ]
+
+
+def _annotated_summary_csvs_command(root, inputs, params, outdir):
+    script = os.path.join(root, "scripts/annotated_summary_csvs.py")
+    return snakemake_script_command(
+        script,
+        input={**inputs, "annotated_summary_csvs": script},
+        output={
+            "mut": os.path.join(outdir, "annotated.csv"),
+            "site_mean": os.path.join(outdir, "annotated_site_means.csv"),
+            "site_diffs": os.path.join(outdir, "site_diffs_annotated.csv"),
+        },
+        params={**params, "incremental_dir": os.path.join(outdir, "incremental")},
+        log=[os.path.join(outdir, "snakemake_log.txt")],
+        outdir=outdir,
+    )
+
+
+def _parse_feature_command(root, inputs, params, outdir):
+    return [
+        sys.executable,
+        os.path.join(root, "nextstrain/workflow/scripts/parse-feature.py"),
+        "--input", inputs["records"],
+        "--feature", params["feature"],
+        "--reference", params["reference"],
+        "--output", os.path.join(outdir, "parsed_features.csv"),
+    ]
+
+
+def _color_by_dms_command(root, inputs, params, outdir):
+    dms_config = {
+        params["metric"]: {
+            "file": inputs["dms"],
+            "offset": params["offset"],
+            "title": params["metric"],
+            "scale": ["#eb4034", "#a1a1a1", "#1e1bcc"],
+        }
+    }
+    return [
+        sys.executable,
+        os.path.join(root, "nextstrain/workflow/scripts/color-by-dms.py"),
+        "--alignment", inputs["alignment"],
+        "--template-auspice", inputs["auspice"],
+        "--reference", params["reference"],
+        "--dms-config", json.dumps(dms_config),
+        "--auspice-config", os.path.join(outdir, "auspice-config.json"),
+        "--dms-scores", os.path.join(outdir, f"{params['metric']}.json"),
+    ]
+
+
+# Each step has a function giving its command for a given repo root, inputs, params,
+# and output directory, default inputs (relative to the repo) and params, and the
+# outputs to compare with keyword arguments to :func:`compare_tables`.
+STEPS = {
+    "cell_entry_mut_diffs": {
+        "command": _cell_entry_mut_diffs_command,
+        "inputs": {
+            "mut_effects_csv": "results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
+        },
+        "params": {"cells": ["293T_Mxra8", "C636", "293T_TIM1"], "floor": -5},
+        "outputs": {
+            "mut_diffs.csv": {"keys": ["site", "mutant"]},
+            "site_diffs.csv": {"keys": ["site", "cell_1", "cell_2"]},
+        },
+    },
+    "annotated_summary_csvs": {
+        "command": _annotated_summary_csvs_command,
+        "inputs": {
+            "data": "results/summaries/entry_293T-Mxra8_C636_293T-TIM1_Mxra8-binding.csv",
+            "addtl_annotations": "data/addtl_site_annotations.csv",
+            "site_diffs": "results/compare_cell_entry/site_diffs.csv",
+        },
+        "params": {"site_stats": "mean"},
+        "outputs": {
+            "annotated.csv": {"keys": ["site", "mutant"]},
+            "annotated_site_means.csv": {"keys": ["site"]},
+            "site_diffs_annotated.csv": {"keys": ["site", "cell_1", "cell_2"]},
+        },
+    },
+    "parse-feature": {
+        "command": _parse_feature_command,
+        "inputs": {"records": "nextstrain/results/sequences/records.pickle"},
+        "params": {"feature": "structural polyprotein", "reference": "MW473668.1"},
+        "outputs": {"parsed_features.csv": {"keys": ["accession"]}},
+    },
+    "color-by-dms": {
+        "command": _color_by_dms_command,
+        "inputs": {
+            "alignment": "nextstrain/results/alignments/protein_no_outgroup.fa",
+            "auspice": "nextstrain/configuration/auspice-config.json",
+            "dms": "results/compare_cell_entry/mut_diffs.csv",
+        },
+        "params": {
+            "metric": "293T_Mxra8_minus_C636",
+            "offset": 1,
+            "reference": "181-25_MW473668",
+        },
+        "outputs": {
+            "{metric}.json": {"keys": ["path"]},
+            "auspice-config.json": {"keys": ["path"]},
+        },
+    },
+}
+
+
+class _NamedList(list):
+    """List whose items are also attributes, like ``snakemake.io.Namedlist``."""
+
+    def __init__(self, items):
+        if isinstance(items, dict):
+            super().__init__(items.values())
+            self.__dict__.update(items)
+        else:
+            super().__init__(items)
+
+
+def snakemake_script_command(script, *, input, output, params, log, outdir):
+    """Command to run a ``snakemake`` script outside of ``snakemake``.
+
+    The `input`, `output`, `params`, and `log` of the ``snakemake`` object are
+    written to a JSON in `outdir` that is read by :func:`run_snakemake_script`.
+
+    """
+    snakemake_json = os.path.join(outdir, "snakemake.json")
+    with open(snakemake_json, "w") as f:
+        json.dump(
+            {"input": input, "output": output, "params": params, "log": log}, f, indent=2
+        )
+    return [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--run-snakemake-script",
+        script,
+        "--snakemake-json",
+        snakemake_json,
+    ]
+
+
+def run_snakemake_script(script, snakemake_json):
+    """Run a ``snakemake`` script with the ``snakemake`` object from a JSON."""
+    with open(snakemake_json) as f:
+        spec = json.load(f)
+    snakemake = argparse.Namespace(
+        **{key: _NamedList(val) for key, val in spec.items()},
+        threads=1,
+        wildcards=_NamedList({}),
+    )
+    # import modules next to the script, as ``snakemake`` does
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, init_globals={"snakemake": snakemake}, run_name="__main__")
+
+
+def extract_revision(rev, dest):
+    """Extract the code of a git revision of the repo into `dest`."""
+    os.makedirs(dest, exist_ok=True)
+    archive = subprocess.run(
+        ["git", "-C", REPO_DIR, "archive", rev, *CODE_PATHS],
+        check=True,
+        capture_output=True,
+    ).stdout
+    subprocess.run(["tar", "-x", "-C", dest], input=archive, check=True)
+
+
+def run_step(command, log, repeats=1):
+    """Run a step's command `repeats` times.
+
+    Returns
+    -------
+    tuple
+        Whether it succeeded, and the fastest wall time in seconds (NaN if the
+        command could not be started).
+
+    """
+    times = []
+    with open(log, "w") as f:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            try:
+                returncode = subprocess.run(
+                    command, stdout=f, stderr=subprocess.STDOUT, cwd=REPO_DIR
+                ).returncode
+            except FileNotFoundError as e:
+                # eg, papermill is not installed
+                print(e, file=f)
+                return False, numpy.nan
+            times.append(time.perf_counter() - start)
+            if returncode != 0:
+                return False, min(times)
+    return True, min(times)
+
+
+def flatten_json(obj, path=""):
+    """Flatten a JSON to a data frame with columns "path" and "value" for its leaves."""
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, list):
+        items = enumerate(obj)
+    else:
+        return [(path, obj)]
+    rows = []
+    for key, val in items:
+        rows += flatten_json(val, f"{path}/{key}")
+    if path:
+        return rows
+    return pd.DataFrame(rows, columns=["path", "value"])
+
+
+def read_output(path):
+    """Read an output as a data frame, flattening it if it is a JSON."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            df = flatten_json(json.load(f))
+        # compare numbers with tolerances, and everything else exactly
+        numeric = pd.to_numeric(df["value"], errors="coerce")
+        is_numeric = df["value"].map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool))
+        return df.assign(
+            value=numeric.where(is_numeric),
+            exact_value=df["value"].where(~is_numeric).astype(str),
+        )
+    return pd.read_csv(path)
+
+
+def _column_resolution(values):
+    """One unit in the last printed digit of each value in a column of strings."""
+    match = values.str.strip().str.extract(r"^[-+]?\d*(?:\.(\d*))?(?:[eE]([-+]?\d+))?$")
+    decimals = match[0].str.len().fillna(0)
+    exponent = pd.to_numeric(match[1]).fillna(0)
+    is_decimal = match[0].notnull() | match[1].notnull()
+    return (10.0 ** (exponent - decimals)).where(is_decimal, 0.0)
+
+
+def printed_resolution(path):
+    """Resolution of the numbers in a CSV as printed.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Same shape as the CSV, with one unit in the last printed digit of each value
+        written as a decimal (eg, 1e-4 for "-0.0015" or 10 for "1.234e+04"), and zero
+        for values written as integers or that are not numbers.
+
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False).apply(_column_resolution)
+
+
+def compare_tables(
+    old,
+    new,
+    keys,
+    *,
+    rtol=1e-4,
+    atol=1e-6,
+    exact_cols=(),
+    ordered=False,
+    resolution=None,
+):
+    """Compare two tables matching rows on keys.
+
+    Parameters
+    ----------
+    old : pandas.DataFrame
+    new : pandas.DataFrame
+    keys : list
+        Columns that identify each row, which must be unique.
+    rtol : float
+        Relative tolerance for numeric columns.
+    atol : float
+        Absolute tolerance for numeric columns.
+    exact_cols : list
+        Numeric columns to compare exactly.
+    ordered : bool
+        Also require the rows to be in the same order.
+    resolution : None or tuple
+        From :func:`printed_resolution` for `old` and `new`. The absolute tolerance of
+        each numeric value is raised to one unit in its last printed digit in either.
+
+    Returns
+    -------
+    summary : dict
+        Has keys "n_rows", "missing_rows" (in `old` but not `new`), "extra_rows" (in
+        `new` but not `old`), "mismatched_rows", "mismatched_cols" (with the number of
+        mismatched rows in each), "max_abs_diff", "max_rel_diff", "column_diffs" (a
+        description of any differences in the columns), and "order_differs".
+    mismatches : pandas.DataFrame
+        Rows with mismatches, as keys, "column", "old", and "new".
+
+    """
+    keys = list(keys)
+    for name, df in [("old", old), ("new", new)]:
+        if not set(keys).issubset(df.columns):
+            raise ValueError(f"{keys=} not all in {name} {df.columns=}")
+        if df.duplicated(keys).any():
+            raise ValueError(f"{keys=} are not unique in {name}")
+
+    column_diffs = []
+    if set(old.columns) != set(new.columns):
+        column_diffs.append(
+            f"only in old: {sorted(set(old.columns) - set(new.columns))}, "
+            f"only in new: {sorted(set(new.columns) - set(old.columns))}"
+        )
+    elif list(old.columns) != list(new.columns):
+        column_diffs.append("column order differs")
+    value_cols = [c for c in old.columns if c in set(new.columns) - set(keys)]
+    if resolution is not None:
+        # resolutions are merged with the values, as "_resolution_{col}_old" or "_new"
+        old, new = (
+            df.assign(**{f"_resolution_{c}": res[c].to_numpy() for c in value_cols})
+            for df, res in zip([old, new], resolution)
+        )
+
+    merged = old.merge(new, on=keys, how="outer", suffixes=("_old", "_new"), indicator=True)
+    both = merged.query("_merge == 'both'")
+    order_differs = ordered and (
+        old[keys].to_numpy().tolist() != new[keys].to_numpy().tolist()
+    )
+
+    mismatched_cols = {}
+    mismatches = []
+    max_abs_diff = max_rel_diff = 0.0
+    is_mismatched = numpy.zeros(len(both), dtype=bool)
+    for col in value_cols:
+        x, y = both[f"{col}_old"], both[f"{col}_new"]
+        if (
+            col not in exact_cols
+            and pd.api.types.is_numeric_dtype(x)
+            and pd.api.types.is_numeric_dtype(y)
+            and not pd.api.types.is_bool_dtype(x)
+        ):
+            x, y = x.to_numpy(dtype=float), y.to_numpy(dtype=float)
+            both_null = numpy.isnan(x) & numpy.isnan(y)
+            value_atol = atol
+            if resolution is not None:
+                # slightly over one unit, so a flip of the last digit is not a mismatch
+                last_digit = numpy.maximum(
+                    both[f"_resolution_{col}_old"].to_numpy(dtype=float),
+                    both[f"_resolution_{col}_new"].to_numpy(dtype=float),
+                )
+                value_atol = numpy.maximum(atol, last_digit * (1 + 1e-6))
+            with numpy.errstate(invalid="ignore"):
+                abs_diff = numpy.abs(x - y)
+                differs = ~both_null & ~(abs_diff <= value_atol + rtol * numpy.abs(x))
+                finite = numpy.isfinite(abs_diff)
+                if finite.any():
+                    max_abs_diff = max(max_abs_diff, float(abs_diff[finite].max()))
+                    scale = numpy.maximum(numpy.abs(x[finite]), numpy.abs(y[finite]))
+                    rel_diff = abs_diff[finite] / numpy.where(scale > 0, scale, 1)
+                    max_rel_diff = max(max_rel_diff, float(rel_diff.max()))
+        else:
+            both_null = (x.isnull() & y.isnull()).to_numpy()
+            differs = ~both_null & (x.astype(str) != y.astype(str)).to_numpy()
+        if differs.any():
+            mismatched_cols[col] = int(differs.sum())
+            is_mismatched |= differs
+            mismatches.append(
+                both.loc[differs, keys].assign(
+                    column=col,
+                    old=both.loc[differs, f"{col}_old"].to_numpy(),
+                    new=both.loc[differs, f"{col}_new"].to_numpy(),
+                )
+            )
+
+    summary = {
+        "n_rows": len(old),
+        "missing_rows": int((merged["_merge"] == "left_only").sum()),
+        "extra_rows": int((merged["_merge"] == "right_only").sum()),
+        "mismatched_rows": int(is_mismatched.sum()),
+        "mismatched_cols": mismatched_cols,
+        "max_abs_diff": max_abs_diff,
+        "max_rel_diff": max_rel_diff,
+        "column_diffs": "; ".join(column_diffs),
+        "order_differs": bool(order_differs),
+    }
+    mismatches = (
+        pd.concat(mismatches, ignore_index=True)
+        if mismatches
+        else pd.DataFrame(columns=[*keys, "column", "old", "new"])
+    )
+    return summary, mismatches
+
+
+def check_step(step, old_root, new_root, outdir, *, inputs=None, params=None, repeats=1, rtol=None, atol=None):
+    """Run a step with old and new code and compare its outputs.
+
+    Parameters
+    ----------
+    step : str
+        Key in :data:`STEPS`.
+    old_root : str
+        Root of the old version of the repo.
+    new_root : str
+        Root of the new version of the repo.
+    outdir : str
+        Outputs and logs of each version are written in subdirectories.
+    inputs : None or dict
+        Override the step's default inputs.
+    params : None or dict
+        Override the step's default params.
+    repeats : int
+    rtol : None or float
+        Override the relative tolerance for all outputs.
+    atol : None or float
+        Override the absolute tolerance for all outputs.
+
+    Returns
+    -------
+    report : pandas.DataFrame
+        One row per output.
+    mismatches : pandas.DataFrame
+        Examples of mismatches, with columns "step", "output", "key", "column",
+        "old", and "new".
+
+    """
+    spec = STEPS[step]
+    step_inputs = {
+        name: os.path.abspath(os.path.join(REPO_DIR, path))
+        for name, path in {**spec["inputs"], **(inputs or {})}.items()
+    }
+    step_params = {**spec["params"], **(params or {})}
+    missing = [path for path in step_inputs.values() if not os.path.exists(path)]
+    if missing:
+        raise ValueError(f"inputs for {step} do not exist: {missing}")
+
+    runs = {}
+    for side, root in [("old", old_root), ("new", new_root)]:
+        side_dir = os.path.join(outdir, step, side)
+        os.makedirs(side_dir, exist_ok=True)
+        command = spec["command"](root, step_inputs, step_params, side_dir)
+        ok, wall_s = run_step(command, os.path.join(side_dir, "log.txt"), repeats)
+        print(f"Ran {step} with {side} code in {wall_s:.2f} sec" + ("" if ok else ", FAILED"))
+        runs[side] = {"ok": ok, "wall_s": wall_s, "dir": side_dir}
+
+    records = []
+    all_mismatches = []
+    for output, compare_kwargs in spec["outputs"].items():
+        output = output.format(**step_params)
+        compare_kwargs = {
+            **compare_kwargs,
+            **({"rtol": rtol} if rtol is not None else {}),
+            **({"atol": atol} if atol is not None else {}),
+        }
+        record = {
+            "step": step,
+            "output": output,
+            "old_wall_s": runs["old"]["wall_s"],
+            "new_wall_s": runs["new"]["wall_s"],
+            "speedup": runs["old"]["wall_s"] / runs["new"]["wall_s"],
+        }
+        if not (runs["old"]["ok"] and runs["new"]["ok"]):
+            failed = [side for side, run in runs.items() if not run["ok"]]
+            records.append({**record, "status": f"failed ({', '.join(failed)})"})
+            continue
+        paths = [os.path.join(runs[side]["dir"], output) for side in ["old", "new"]]
+        if not os.path.isfile(paths[0]):
+            # eg, an output added by the new code
+            records.append({**record, "status": "not written by old code"})
+            continue
+        if not os.path.isfile(paths[1]):
+            records.append({**record, "status": "not written by new code"})
+            continue
+        if not output.endswith(".json"):
+            compare_kwargs["resolution"] = tuple(printed_resolution(p) for p in paths)
+        summary, mismatches = compare_tables(
+            *[read_output(path) for path in paths], **compare_kwargs
+        )
+        differs = (
+            summary["missing_rows"]
+            or summary["extra_rows"]
+            or summary["mismatched_rows"]
+            or summary["column_diffs"]
+            or summary["order_differs"]
+        )
+        summary["mismatched_cols"] = "; ".join(
+            f"{col} ({n})" for col, n in summary["mismatched_cols"].items()
+        )
+        records.append({**record, "status": "differs" if differs else "matches", **summary})
+        if len(mismatches):
+            keys = compare_kwargs["keys"]
+            all_mismatches.append(
+                mismatches.assign(
+                    step=step,
+                    output=output,
+                    key=mismatches[keys].astype(str).agg(" ".join, axis=1),
+                )[["step", "output", "key", "column", "old", "new"]]
+            )
+    return (
+        pd.DataFrame(records),
+        pd.concat(all_mismatches, ignore_index=True)
+        if all_mismatches
+        else pd.DataFrame(columns=["step", "output", "key", "column", "old", "new"]),
+    )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Check that new code for steps gives the same outputs as old code."
+    )
+    old = parser.add_mutually_exclusive_group()
+    old.add_argument("--old-rev", help="Git revision with the old code.")
+    old.add_argument("--old-dir", help="Root of a copy of the repo with the old code.")
+    parser.add_argument("--new-dir", default=REPO_DIR, help="Root with the new code.")
+    parser.add_argument("--steps", nargs="+", choices=list(STEPS), default=list(STEPS))
+    parser.add_argument(
+        "--input", nargs="*", default=[], help="Override inputs, as step:name=path."
+    )
+    parser.add_argument(
+        "--param",
+        nargs="*",
+        default=[],
+        help="Override params, as step:name=value with JSON values for non-strings.",
+    )
+    parser.add_argument("--repeats", type=int, default=1, help="Runs of each side.")
+    parser.add_argument("--rtol", type=float, help="Override relative tolerances.")
+    parser.add_argument("--atol", type=float, help="Override absolute tolerances.")
+    parser.add_argument(
+        "--outdir", default="results/parity_check", help="Outputs and report."
+    )
+    parser.add_argument("--max-examples", type=int, default=20, help="Per output.")
+    # used to run a snakemake script in a child process
+    parser.add_argument("--run-snakemake-script", help=argparse.SUPPRESS)
+    parser.add_argument("--snakemake-json", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _parse_overrides(overrides, parse_value):
+    """Parse step:name=value overrides into a dict keyed by step."""
+    parsed = {}
+    for override in overrides:
+        step_name, sep, value = override.partition("=")
+        step, colon, name = step_name.partition(":")
+        if not (sep and colon) or step not in STEPS:
+            raise ValueError(f"{override=} not step:name=value with step in {list(STEPS)}")
+        parsed.setdefault(step, {})[name] = parse_value(value)
+    return parsed
+
+
+def _json_or_str(value):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    if args.run_snakemake_script:
+        run_snakemake_script(args.run_snakemake_script, args.snakemake_json)
+        return
+    if not (args.old_rev or args.old_dir):
+        raise ValueError("specify the old code with --old-rev or --old-dir")
+    inputs = _parse_overrides(args.input, str)
+    params = _parse_overrides(args.param, _json_or_str)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.old_rev:
+            print(f"Extracting code of {args.old_rev} to {tmpdir}")
+            extract_revision(args.old_rev, tmpdir)
+            old_root = tmpdir
+        else:
+            old_root = os.path.abspath(args.old_dir)
+        outdir = os.path.abspath(args.outdir)
+        if os.path.isdir(outdir):
+            shutil.rmtree(outdir)
+        os.makedirs(outdir)
+        reports, mismatches = [], []
+        for step in args.steps:
+            report, step_mismatches = check_step(
+                step,
+                old_root,
+                os.path.abspath(args.new_dir),
+                outdir,
+                inputs=inputs.get(step),
+                params=params.get(step),
+                repeats=args.repeats,
+                rtol=args.rtol,
+                atol=args.atol,
+            )
+            reports.append(report)
+            mismatches.append(
+                step_mismatches.groupby("output").head(args.max_examples)
+            )
+
+    report = pd.concat(reports, ignore_index=True)
+    mismatches = pd.concat(mismatches, ignore_index=True)
+    print("\nParity of outputs of old and new code:")
+    print(
+        report[["step", "output", "status", "speedup", "old_wall_s", "new_wall_s"]]
+        .to_string(index=False, float_format=lambda x: f"{x:.3g}")
+    )
+    for row in report.query("status == 'differs'").itertuples():
+        print(
+            f"\n{row.step} {row.output}: {row.missing_rows} missing rows, "
+            f"{row.extra_rows} extra rows, {row.mismatched_rows} mismatched rows "
+            f"[{row.mismatched_cols}], max relative difference {row.max_rel_diff:.3g}"
+            + (f", {row.column_diffs}" if row.column_diffs else "")
+            + (", rows in different order" if row.order_differs else "")
+        )
+    report_csv = os.path.join(args.outdir, "parity_report.csv")
+    mismatches_csv = os.path.join(args.outdir, "parity_mismatches.csv")
+    print(f"\nWriting report to {report_csv} and mismatches to {mismatches_csv}")
+    report.to_csv(report_csv, index=False, float_format="%.4g")
+    mismatches.to_csv(mismatches_csv, index=False)
+    if (~report["status"].isin(["matches", "not written by old code"])).any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Get PDB files once and parse them into memory-mappable NumPy archives.
+
+A structure is identified by its PDB ID and type ("asymmetric_unit" or
+"biological_assembly"). :func:`get_pdb` takes it from a local mirror directory (eg,
+``data/PDBs``) if it is there, and otherwise downloads it from the RCSB. The atoms
+are then parsed once into a structured array saved as ``.npy`` (see
+:data:`ATOM_DTYPE`), which :class:`Structure` loads memory-mapped so notebooks do
+not re-parse the text PDB file.
+
+Run as a script by the ``structure_cache`` rule.
+
+"""
+
+
+import argparse
+import gzip
+import os
+
+import numpy
+
+import pandas as pd
+
+
+PDB_TYPES = ["asymmetric_unit", "biological_assembly"]
+
+# how files are named at the RCSB and may be named in a local mirror
+_RCSB_URL = "https://files.rcsb.org/download/{filename}"
+_FILENAMES = {
+    "asymmetric_unit": ["{pdb_id}.pdb", "{pdb_id}.pdb.gz"],
+    "biological_assembly": ["{pdb_id}.pdb1", "{pdb_id}.pdb1.gz"],
+}
+
+# one entry per atom record, with strings as ASCII bytes to keep it compact
+ATOM_DTYPE = numpy.dtype(
+    [
+        ("coord", numpy.float32, (3,)),
+        ("model", numpy.int16),
+        ("chain", "S4"),
+        ("resnum", numpy.int32),
+        ("icode", "S1"),
+        ("resname", "S3"),
+        ("atom", "S4"),
+        ("altloc", "S1"),
+        ("element", "S2"),
+        ("hetero", bool),
+    ]
+)
+
+AA_3TO1 = {
+    "ALA": "A",
+    "ARG": "R",
+    "ASN": "N",
+    "ASP": "D",
+    "CYS": "C",
+    "GLN": "Q",
+    "GLU": "E",
+    "GLY": "G",
+    "HIS": "H",
+    "ILE": "I",
+    "LEU": "L",
+    "LYS": "K",
+    "MET": "M",
+    "PHE": "F",
+    "PRO": "P",
+    "SER": "S",
+    "THR": "T",
+    "TRP": "W",
+    "TYR": "Y",
+    "VAL": "V",
+}
+
+
+def get_pdb(pdb_id, pdb_type, mirror_dirs=()):
+    """Get text of a PDB file, from a local mirror if possible.
+
+    Parameters
+    ----------
+    pdb_id : str
+        Protein Data Bank ID, eg "6nk6".
+    pdb_type : {"asymmetric_unit", "biological_assembly"}
+    mirror_dirs : list
+        Directories searched (in order) for the file named as at the RCSB, eg
+        ``6nk6.pdb`` or ``6nk6.pdb1.gz``, with ID in lower or upper case.
+
+    Returns
+    -------
+    text : str
+    source : str
+        The local file or URL it came from.
+
+    """
+    if pdb_type not in PDB_TYPES:
+        raise ValueError(f"invalid {pdb_type=}")
+    filenames = [
+        f.format(pdb_id=i) for f in _FILENAMES[pdb_type] for i in [pdb_id.lower(), pdb_id.upper()]
+    ]
+    for mirror_dir in mirror_dirs:
+        for filename in filenames:
+            path = os.path.join(mirror_dir, filename)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    content = f.read()
+                return _decode(content, filename), path
+
+    import requests
+
+    filename = _FILENAMES[pdb_type][-1].format(pdb_id=pdb_id)
+    url = _RCSB_URL.format(filename=filename)
+    r = requests.get(url)
+    if r.status_code != 200:
+        raise ValueError(f"failed to get {url}: {r.status_code=}")
+    return _decode(r.content, filename), url
+
+
+def _decode(content, filename):
+    if filename.endswith(".gz"):
+        content = gzip.decompress(content)
+    return content.decode("utf-8")
+
+
+def parse_pdb(text):
+    """Parse atom records of a PDB file.
+
+    Parameters
+    ----------
+    text : str
+        Contents of PDB file.
+
+    Returns
+    -------
+    numpy.ndarray
+        Structured array with :data:`ATOM_DTYPE`. Models are numbered from 0 in the
+        order they appear, so each copy in a biological assembly is a model.
+
+    """
+    records = []
+    model = 0
+    seen_model = False
+    for line in text.splitlines():
+        record = line[:6]
+        if record == "MODEL ":
+            if seen_model:
+                model += 1
+            seen_model = True
+        elif record == "ATOM  " or record == "HETATM":
+            records.append(
+                (
+                    (float(line[30:38]), float(line[38:46]), float(line[46:54])),
+                    model,
+                    line[21].strip(),
+                    int(line[22:26]),
+                    line[26].strip(),
+                    line[17:20].strip(),
+                    line[12:16].strip(),
+                    line[16].strip(),
+                    line[76:78].strip(),
+                    record == "HETATM",
+                )
+            )
+    if not records:
+        raise ValueError("no atom records in PDB")
+    return numpy.array(records, dtype=ATOM_DTYPE)
+
+
+class Structure:
+    """Parsed atoms of a structure.
+
+    Parameters
+    ----------
+    atoms : numpy.ndarray
+        Structured array with :data:`ATOM_DTYPE`.
+
+    Attributes
+    ----------
+    atoms : numpy.ndarray
+
+    """
+
+    def __init__(self, atoms):
+        """See main class docstring."""
+        if atoms.dtype != ATOM_DTYPE:
+            raise ValueError(f"{atoms.dtype=} is not {ATOM_DTYPE=}")
+        self.atoms = atoms
+
+    @classmethod
+    def load(cls, npy_file, mmap=True):
+        """Load from archive written by :meth:`Structure.save`.
+
+        Parameters
+        ----------
+        npy_file : str
+        mmap : bool
+            Memory-map the archive rather than reading it in.
+
+        Returns
+        -------
+        Structure
+
+        """
+        return cls(numpy.load(npy_file, mmap_mode="r" if mmap else None))
+
+    def save(self, npy_file):
+        """Save to ``.npy`` archive."""
+        numpy.save(npy_file, numpy.ascontiguousarray(self.atoms))
+
+    @property
+    def coords(self):
+        """numpy.ndarray: Atom coordinates, shape ``(n_atoms, 3)``."""
+        return self.atoms["coord"]
+
+    @property
+    def chains(self):
+        """list: Chain IDs in the first model, in order they appear."""
+        chains = self.atoms["chain"][self.atoms["model"] == 0]
+        return [c.decode() for c in dict.fromkeys(chains.tolist())]
+
+    def select(self, chains=None, models=(0,), hetero=False):
+        """Select atoms.
+
+        Parameters
+        ----------
+        chains : None or list
+            Only keep atoms in these chains.
+        models : None or list
+            Only keep atoms in these models (all if `None`).
+        hetero : bool
+            Keep hetero atoms (eg, glycans and water).
+
+        Returns
+        -------
+        Structure
+
+        """
+        keep = numpy.ones(len(self.atoms), dtype=bool)
+        if chains is not None:
+            keep &= numpy.isin(self.atoms["chain"], [c.encode() for c in chains])
+        if models is not None:
+            keep &= numpy.isin(self.atoms["model"], list(models))
+        if not hetero:
+            keep &= ~self.atoms["hetero"]
+        return Structure(self.atoms[keep])
+
+    def residues(self):
+        """Residues in the structure.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per residue in order, with columns "model", "chain", "resnum",
+            "icode", "resname", and "aa" (one-letter code, null if not a standard
+            amino acid).
+
+        """
+        cols = ["model", "chain", "resnum", "icode", "resname"]
+        return (
+            pd.DataFrame(
+                {
+                    col: (
+                        self.atoms[col].astype(str)
+                        if self.atoms[col].dtype.kind == "S"
+                        else self.atoms[col]
+                    )
+                    for col in cols
+                }
+            )
+            .drop_duplicates(["model", "chain", "resnum", "icode"])
+            .assign(aa=lambda x: x["resname"].map(AA_3TO1))
+            .reset_index(drop=True)
+        )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Get a PDB file and parse it to a NumPy archive."
+    )
+    parser.add_argument("--pdb-id", required=True, help="Protein Data Bank ID.")
+    parser.add_argument("--pdb-type", required=True, choices=PDB_TYPES)
+    parser.add_argument(
+        "--mirror-dirs", nargs="*", default=[], help="Local directories with PDB files."
+    )
+    parser.add_argument("--pdb-file", required=True, help="Output text PDB file.")
+    parser.add_argument("--npy-file", required=True, help="Output parsed atoms.")
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    text, source = get_pdb(args.pdb_id, args.pdb_type, args.mirror_dirs)
+    print(f"Got {args.pdb_id} {args.pdb_type} from {source}, writing to {args.pdb_file}")
+    with open(args.pdb_file, "w") as f:
+        f.write(text)
+    structure = Structure(parse_pdb(text))
+    print(
+        f"Parsed {len(structure.atoms)} atoms in chains {structure.chains}, writing "
+        f"to {args.npy_file}"
+    )
+    structure.save(args.npy_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+"""Re-average mutation effects across replicate selections.
+
+The pipeline's ``avg_func_effects`` and ``avg_receptor_affinity`` averages are made
+for one fixed choice of selections and filters. Here the effects in all selections
+for a condition are loaded once into an aligned mutations x selections matrix (rows
+keyed by integer mutation code), so averages, standard deviations, and
+``times_seen`` can be recomputed for any subset of selections, averaging method, or
+filter with a few vectorized reductions, and written in the same format as the
+pipeline's averages.
+
+Functional effects are read from the per-selection CSVs in
+``results/func_effects/by_selection``. For receptor affinity the pipeline only
+writes per-selection effects as the per-model columns of
+``results/receptor_affinity/averages/*_mut_effect.csv``, so they are read from
+there; per-model ``times_seen`` is not available, so the output ``times_seen`` is
+the one in that file.
+
+"""
+
+
+import argparse
+import os
+import warnings
+
+import numpy
+
+import pandas as pd
+
+import fast_csv
+import mut_codec
+
+
+# amino acids, stop codon, and gap
+ALPHABET = mut_codec.AAS_WITHSTOP + "-"
+
+
+class ReplicateEffects:
+    """Effects of mutations in replicate selections.
+
+    Parameters
+    ----------
+    codec : mut_codec.MutationCodec
+    effects : dict
+        Keyed by selection name, values are data frames with columns "site" (reference
+        site), "wildtype", "mutant", "effect", and optionally "times_seen".
+    covered_sites : dict or None
+        Keyed by selection name, values are the sequential sites it covers (or
+        `None` for all sites). `None` means all selections cover all sites.
+
+    Attributes
+    ----------
+    selections : list
+    codes : numpy.ndarray
+        Sorted codes of mutations with effects in any selection.
+    effects : numpy.ndarray
+        Mutations x selections array, `nan` if no effect.
+    times_seen : numpy.ndarray or None
+        Mutations x selections array, or `None` if not given for all selections.
+    covered : numpy.ndarray
+        Boolean mutations x selections array, `True` if the selection covers the site.
+
+    """
+
+    def __init__(self, codec, effects, covered_sites=None):
+        """See main class docstring."""
+        self.codec = codec
+        self.selections = list(effects)
+        if not self.selections:
+            raise ValueError("no selections")
+        if covered_sites is None:
+            covered_sites = {s: None for s in self.selections}
+        if set(covered_sites) != set(self.selections):
+            raise ValueError(f"{covered_sites.keys()=} do not match {self.selections=}")
+
+        effects = dict(effects)
+        selection_codes = {}
+        for s, df in effects.items():
+            df = df[df["effect"].notnull()]
+            codes = codec.encode_df(df, site_col="site")
+            if covered_sites[s] is not None:
+                in_sites = numpy.isin(codes // codec.n_aas, list(covered_sites[s]))
+                df = df[in_sites]
+                codes = codes[in_sites]
+            if len(numpy.unique(codes)) != len(codes):
+                raise ValueError(f"duplicated mutations in {s=}")
+            effects[s] = df
+            selection_codes[s] = codes
+        self.codes = numpy.unique(numpy.concatenate(list(selection_codes.values())))
+
+        shape = (len(self.codes), len(self.selections))
+        self.effects = numpy.full(shape, numpy.nan)
+        has_times_seen = all("times_seen" in df.columns for df in effects.values())
+        self.times_seen = numpy.full(shape, numpy.nan) if has_times_seen else None
+        self.covered = numpy.ones(shape, dtype=bool)
+        sites = self.codes // codec.n_aas
+        for k, s in enumerate(self.selections):
+            rows = numpy.searchsorted(self.codes, selection_codes[s])
+            self.effects[rows, k] = effects[s]["effect"].to_numpy()
+            if has_times_seen:
+                self.times_seen[rows, k] = effects[s]["times_seen"].to_numpy()
+            if covered_sites[s] is not None:
+                self.covered[:, k] = numpy.isin(sites, list(covered_sites[s]))
+
+    def _selection_indices(self, selections):
+        if selections is None:
+            return numpy.arange(len(self.selections))
+        invalid = set(selections) - set(self.selections)
+        if invalid:
+            raise ValueError(f"{invalid=} selections not in {self.selections=}")
+        return numpy.array([self.selections.index(s) for s in selections])
+
+    def stats(self, selections=None, floor_for_std=None, min_times_seen_per_selection=None):
+        """Statistics across selections for each mutation.
+
+        Parameters
+        ----------
+        selections : None or list
+            Use these selections, or all if `None`.
+        floor_for_std : None or float
+            Floor effects at this value before computing the standard deviation.
+        min_times_seen_per_selection : None or float
+            Ignore the effect of a mutation in a selection if its ``times_seen`` in
+            that selection is less than this. Mutations without ``times_seen`` (eg,
+            wildtype) are kept.
+
+        Returns
+        -------
+        dict
+            Keyed by "mean", "median", "std" (population standard deviation),
+            "n_selections", "times_seen" (sum across selections divided by the number
+            of selections covering the site, `nan` if not known), and "effects" (the
+            mutations x selections effects used). Values are arrays for each of
+            :attr:`ReplicateEffects.codes`.
+
+        """
+        cols = self._selection_indices(selections)
+        effects = self.effects[:, cols]
+        if min_times_seen_per_selection is not None:
+            if self.times_seen is None:
+                raise ValueError("no `times_seen` to filter on")
+            effects = numpy.where(
+                self.times_seen[:, cols] < min_times_seen_per_selection, numpy.nan, effects
+            )
+        n = (~numpy.isnan(effects)).sum(axis=1)
+        floored = effects if floor_for_std is None else numpy.maximum(effects, floor_for_std)
+        with warnings.catch_warnings():
+            # all-nan rows for mutations not in the selections used
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = numpy.nanmean(effects, axis=1)
+            median = numpy.nanmedian(effects, axis=1)
+            std = numpy.nanstd(floored, axis=1)
+        if self.times_seen is None:
+            times_seen = numpy.full(len(self.codes), numpy.nan)
+        else:
+            seen = numpy.where(numpy.isnan(effects), numpy.nan, self.times_seen[:, cols])
+            n_covered = self.covered[:, cols].sum(axis=1)
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                times_seen = numpy.where(
+                    numpy.isnan(seen).all(axis=1),
+                    numpy.nan,
+                    numpy.nansum(seen, axis=1) / n_covered,
+                )
+        return {
+            "mean": mean,
+            "median": median,
+            "std": std,
+            "n_selections": n,
+            "times_seen": times_seen,
+            "effects": effects,
+        }
+
+    def mutations(self):
+        """Data frame of "site", "sequential_site", "wildtype", "mutant" for codes."""
+        return self.codec.decode(self.codes)
+
+
+class FuncEffects(ReplicateEffects):
+    """Functional effects of mutations in replicate selections.
+
+    Parameters
+    ----------
+    codec : mut_codec.MutationCodec
+    selection_csvs : dict
+        Keyed by selection name, values are CSVs like those in
+        ``results/func_effects/by_selection``.
+    covered_sites : dict or None
+        As for :class:`ReplicateEffects`.
+    effect_col : str
+        Column in the CSVs with the effects.
+    avg_method : {"median", "mean"}
+        Default method used by :meth:`FuncEffects.averages`.
+    floor_for_effect_std : None or float
+        Default floor used by :meth:`FuncEffects.averages`.
+
+    """
+
+    def __init__(
+        self,
+        codec,
+        selection_csvs,
+        covered_sites=None,
+        effect_col="functional_effect",
+        avg_method="median",
+        floor_for_effect_std=None,
+    ):
+        """See main class docstring."""
+        self.avg_method = avg_method
+        self.floor_for_effect_std = floor_for_effect_std
+        super().__init__(
+            codec,
+            {
+                s: pd.read_csv(csv).rename(columns={effect_col: "effect"})
+                for s, csv in selection_csvs.items()
+            },
+            covered_sites,
+        )
+
+    @classmethod
+    def from_config(cls, func_effects_config, condition, by_selection_dir, site_numbering_map):
+        """Create for a condition in ``avg_func_effects``.
+
+        Parameters
+        ----------
+        func_effects_config : dict
+            Configuration like ``data/func_effects_config.yml``.
+        condition : str
+            Key in ``avg_func_effects``.
+        by_selection_dir : str
+            Directory with ``{selection}_func_effects.csv`` files.
+        site_numbering_map : str or pandas.DataFrame
+
+        Returns
+        -------
+        FuncEffects
+
+        """
+        condition_config = func_effects_config["avg_func_effects"][condition]
+        selections = condition_config["selections"]
+        if not isinstance(selections, dict):
+            selections = {s: None for s in selections}
+        return cls(
+            mut_codec.MutationCodec.from_site_numbering_map(site_numbering_map, ALPHABET),
+            {s: os.path.join(by_selection_dir, f"{s}_func_effects.csv") for s in selections},
+            covered_sites={
+                s: None if sites is None else expand_sites(sites)
+                for s, sites in selections.items()
+            },
+            avg_method=condition_config["avg_method"],
+            floor_for_effect_std=condition_config["floor_for_effect_std"],
+        )
+
+    def averages(
+        self,
+        selections=None,
+        avg_method=None,
+        floor_for_effect_std="default",
+        min_times_seen_per_selection=None,
+        min_times_seen=None,
+        min_n_selections=1,
+    ):
+        """Average functional effects, like ``results/func_effects/averages``.
+
+        Parameters
+        ----------
+        selections : None or list
+            Average these selections, or all if `None`.
+        avg_method : None or {"median", "mean"}
+            If `None`, use the default for the object.
+        floor_for_effect_std : "default" or None or float
+        min_times_seen_per_selection : None or float
+            See :meth:`ReplicateEffects.stats`.
+        min_times_seen : None or float
+            Only keep mutations with an average ``times_seen`` at least this.
+        min_n_selections : int
+            Only keep mutations with effects in at least this many selections.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns "site", "wildtype", "mutant", "effect", "effect_std",
+            "times_seen", and "n_selections", sorted by site and mutant.
+
+        """
+        avg_method = self.avg_method if avg_method is None else avg_method
+        if avg_method not in {"median", "mean"}:
+            raise ValueError(f"invalid {avg_method=}")
+        if floor_for_effect_std == "default":
+            floor_for_effect_std = self.floor_for_effect_std
+        stats = self.stats(selections, floor_for_effect_std, min_times_seen_per_selection)
+        keep = stats["n_selections"] >= max(min_n_selections, 1)
+        if min_times_seen is not None:
+            keep &= stats["times_seen"] >= min_times_seen
+        muts = self.mutations()
+        return (
+            pd.DataFrame(
+                {
+                    "site": muts["site"].to_numpy(),
+                    "wildtype": muts["wildtype"].to_numpy(),
+                    "mutant": muts["mutant"].to_numpy(),
+                    "effect": stats[avg_method],
+                    "effect_std": stats["std"],
+                    "times_seen": stats["times_seen"],
+                    "n_selections": stats["n_selections"],
+                }
+            )[keep]
+            .sort_values(["site", "mutant"])
+            .reset_index(drop=True)
+        )
+
+
+class ReceptorAffinity(ReplicateEffects):
+    """Receptor-affinity effects of mutations in replicate selections.
+
+    Parameters
+    ----------
+    codec : mut_codec.MutationCodec
+    mut_effect_csv : str or pandas.DataFrame
+        Average from the pipeline, like
+        ``results/receptor_affinity/averages/mouse_Mxra8_mut_effect.csv``, with a
+        column of effects for each selection.
+    phenotype : str
+        Prefix of the "{phenotype}_mean" and similar columns.
+
+    """
+
+    id_cols = ["epitope", "site", "wildtype", "mutant", "mutation"]
+
+    def __init__(self, codec, mut_effect_csv, phenotype="Mxra8 binding"):
+        """See main class docstring."""
+        self.phenotype = phenotype
+        df = mut_effect_csv
+        if isinstance(df, str):
+            df = pd.read_csv(df)
+        stat_cols = [
+            *[f"{phenotype}_{stat}" for stat in ["mean", "median", "std"]],
+            "n_models",
+            "times_seen",
+            "frac_models",
+        ]
+        missing_cols = set(self.id_cols + stat_cols) - set(df.columns)
+        if missing_cols:
+            raise ValueError(f"{missing_cols=} in {df.columns=}")
+        if df["epitope"].nunique() != 1:
+            raise ValueError("can only handle one epitope")
+        self.epitope = df["epitope"].iloc[0]
+        selections = [c for c in df.columns if c not in self.id_cols + stat_cols]
+        super().__init__(
+            codec,
+            {
+                s: df[["site", "wildtype", "mutant", s]].rename(columns={s: "effect"})
+                for s in selections
+            },
+        )
+        # per-selection times_seen is not available, so carry the average
+        self._avg_times_seen = (
+            pd.Series(df["times_seen"].to_numpy(), index=codec.encode_df(df, site_col="site"))
+            .reindex(self.codes)
+            .to_numpy()
+        )
+
+    def averages(self, selections=None, min_times_seen=None, min_n_models=1):
+        """Average receptor-affinity effects, like the pipeline's ``*_mut_effect.csv``.
+
+        Parameters
+        ----------
+        selections : None or list
+            Average these selections, or all if `None`.
+        min_times_seen : None or float
+            Only keep mutations with ``times_seen`` at least this.
+        min_n_models : int
+            Only keep mutations with effects in at least this many selections.
+
+        Returns
+        -------
+        pandas.DataFrame
+
+        """
+        cols = self._selection_indices(selections)
+        stats = self.stats(selections)
+        keep = stats["n_selections"] >= max(min_n_models, 1)
+        if min_times_seen is not None:
+            keep &= self._avg_times_seen >= min_times_seen
+        muts = self.mutations()
+        df = pd.DataFrame(
+            {
+                "epitope": self.epitope,
+                "site": muts["site"].to_numpy(),
+                "wildtype": muts["wildtype"].to_numpy(),
+                "mutant": muts["mutant"].to_numpy(),
+                "mutation": (muts["wildtype"] + muts["site"] + muts["mutant"]).to_numpy(),
+                f"{self.phenotype}_mean": stats["mean"],
+                f"{self.phenotype}_median": stats["median"],
+                f"{self.phenotype}_std": stats["std"],
+                "n_models": stats["n_selections"],
+                "times_seen": self._avg_times_seen,
+                "frac_models": stats["n_selections"] / len(cols),
+                **{
+                    self.selections[col]: stats["effects"][:, k]
+                    for k, col in enumerate(cols)
+                },
+            }
+        )
+        return df[keep].reset_index(drop=True)
+
+
+def expand_sites(sites):
+    """Expand sites specified as in ``avg_func_effects`` to a set.
+
+    Parameters
+    ----------
+    sites : list
+        Sequential sites or lists of inclusive ranges, so ``[1, [3, 5]]`` is
+        ``{1, 3, 4, 5}``.
+
+    Returns
+    -------
+    set
+
+    """
+    expanded = set()
+    for s in sites:
+        if isinstance(s, int):
+            expanded.add(s)
+        elif len(s) == 2:
+            expanded.update(range(s[0], s[1] + 1))
+        else:
+            raise ValueError(f"invalid site specification {s}")
+    return expanded
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Re-average mutation effects across replicate selections."
+    )
+    parser.add_argument("assay", choices=["func_effects", "receptor_affinity"])
+    parser.add_argument(
+        "--site-numbering-map", default="data/site_numbering_map.csv", help="Site map CSV."
+    )
+    parser.add_argument("--condition", help="For func_effects, `avg_func_effects` key.")
+    parser.add_argument(
+        "--func-effects-config",
+        default="data/func_effects_config.yml",
+        help="For func_effects, config YAML.",
+    )
+    parser.add_argument(
+        "--by-selection-dir",
+        default="results/func_effects/by_selection",
+        help="For func_effects, directory with per-selection effects.",
+    )
+    parser.add_argument("--mut-effect-csv", help="For receptor_affinity, average CSV.")
+    parser.add_argument("--phenotype", default="Mxra8 binding")
+    parser.add_argument("--selections", nargs="+", help="Only average these selections.")
+    parser.add_argument("--avg-method", choices=["median", "mean"])
+    parser.add_argument("--min-times-seen", type=float)
+    parser.add_argument("--min-times-seen-per-selection", type=float)
+    parser.add_argument("--min-n-selections", type=int, default=1)
+    parser.add_argument("--output-csv", required=True, help="Output CSV.")
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    if args.assay == "func_effects":
+        if args.condition is None:
+            raise ValueError("specify `--condition`")
+        from ruamel import yaml
+
+        with open(args.func_effects_config) as f:
+            func_effects_config = yaml.YAML(typ="safe", pure=True).load(f)
+        replicates = FuncEffects.from_config(
+            func_effects_config, args.condition, args.by_selection_dir, args.site_numbering_map
+        )
+        print(f"Read {len(replicates.codes)} mutations in {replicates.selections=}")
+        avgs = replicates.averages(
+            selections=args.selections,
+            avg_method=args.avg_method,
+            min_times_seen_per_selection=args.min_times_seen_per_selection,
+            min_times_seen=args.min_times_seen,
+            min_n_selections=args.min_n_selections,
+        )
+    else:
+        if args.mut_effect_csv is None:
+            raise ValueError("specify `--mut-effect-csv`")
+        if args.avg_method is not None or args.min_times_seen_per_selection is not None:
+            raise ValueError("receptor_affinity gives both mean and median, per model")
+        replicates = ReceptorAffinity(
+            mut_codec.MutationCodec.from_site_numbering_map(args.site_numbering_map, ALPHABET),
+            args.mut_effect_csv,
+            phenotype=args.phenotype,
+        )
+        print(f"Read {len(replicates.codes)} mutations in {replicates.selections=}")
+        avgs = replicates.averages(
+            selections=args.selections,
+            min_times_seen=args.min_times_seen,
+            min_n_models=args.min_n_selections,
+        )
+    print(f"Writing {len(avgs)} averaged mutations to {args.output_csv}")
+    fast_csv.write_csv(avgs, args.output_csv, float_format="%.4g")
+
+
+if __name__ == "__main__":
+    main()
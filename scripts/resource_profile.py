@@ -0,0 +1,190 @@
+"""Generate a ``snakemake`` profile with per-rule resources derived from benchmarks.
+
+From the benchmark history aggregated by :mod:`benchmark_report`, each rule gets:
+
+ - ``mem_mb``: the peak RSS with some headroom;
+ - ``runtime`` (minutes): the wall time with some headroom;
+
+taking the largest value over the recent runs of all jobs of the rule. These are
+written as ``set-resources`` in the ``config.yaml`` of a profile along with the total
+cores and memory of the node, so ``snakemake`` packs jobs onto the node by both cores
+and memory. Rules keep their declared threads: busy cores measured from a benchmark
+are bounded by the threads the job ran with, so they could only lower them. Rules
+without benchmarks keep their default resources.
+
+Run by ``run_Hutch_cluster.bash`` before the pipeline.
+
+"""
+
+
+import argparse
+import math
+import os
+import re
+
+import pandas as pd
+
+import benchmark_report
+
+
+def rule_names(snakefiles):
+    """Names of the rules defined in Snakemake files."""
+    names = []
+    for snakefile in snakefiles:
+        with open(snakefile) as f:
+            names += re.findall(r"^rule (\w+):", f.read(), flags=re.MULTILINE)
+    return names
+
+
+def benchmark_rule(benchmark, rules):
+    """Rule of a benchmark named after the rule plus any wildcards.
+
+    Benchmark names can have hyphens in place of underscores (as in the Nextstrain
+    workflow). Returns `None` if no rule matches.
+
+    """
+    name = benchmark.replace("-", "_")
+    matches = [rule for rule in rules if name == rule or name.startswith(f"{rule}_")]
+    return max(matches, key=len) if matches else None
+
+
+def rule_resources(
+    history,
+    rules,
+    *,
+    workflow,
+    n_runs=3,
+    mem_headroom=1.25,
+    min_mem_mb=500,
+    runtime_headroom=1.5,
+):
+    """Resources for each rule from its recent benchmarks.
+
+    Parameters
+    ----------
+    history : pandas.DataFrame
+        Benchmark history from :func:`benchmark_report.update_history`.
+    rules : list
+        Names of the rules.
+    workflow : str
+        Only use benchmarks of this workflow in `history`.
+    n_runs : int
+        Use this many of the most recent runs of each benchmark.
+    mem_headroom : float
+        Memory is peak RSS times this, rounded up to 100 MB.
+    min_mem_mb : int
+        Least memory for a rule.
+    runtime_headroom : float
+        Runtime is wall time times this, rounded up to a minute.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "rule", "mem_mb", "runtime", and "n_benchmarks".
+
+    """
+    recent = (
+        history.query("workflow == @workflow")
+        .sort_values("mtime")
+        .groupby("benchmark")
+        .tail(n_runs)
+        .assign(rule=lambda x: x["benchmark"].map(lambda b: benchmark_rule(b, rules)))
+    )
+    unmatched = recent.loc[recent["rule"].isnull(), "benchmark"].unique().tolist()
+    if unmatched:
+        print(f"Ignoring benchmarks that do not match a rule: {unmatched}")
+    recent = recent[recent["rule"].notnull() & (recent["wall_s"] > 0)]
+    return (
+        recent.assign(
+            mem_mb=lambda x: (x["max_rss_mb"].fillna(0) * mem_headroom / 100)
+            .map(math.ceil)
+            .mul(100)
+            .clip(lower=min_mem_mb),
+            runtime=lambda x: (x["wall_s"] * runtime_headroom / 60).map(math.ceil),
+        )
+        .groupby("rule", as_index=False)
+        .aggregate(
+            mem_mb=pd.NamedAgg("mem_mb", "max"),
+            runtime=pd.NamedAgg("runtime", "max"),
+            n_benchmarks=pd.NamedAgg("benchmark", "nunique"),
+        )
+        .astype({"mem_mb": int, "runtime": int})
+    )
+
+
+def profile_yaml(resources, *, cores, mem_mb):
+    """Text of ``config.yaml`` for a ``snakemake`` profile.
+
+    Parameters
+    ----------
+    resources : pandas.DataFrame
+        From :func:`rule_resources`.
+    cores : int
+        Cores on the node.
+    mem_mb : int
+        Memory on the node in MB, which jobs are packed under.
+
+    Returns
+    -------
+    str
+
+    """
+    lines = [
+        "# generated by scripts/resource_profile.py from rule benchmarks, do not edit",
+        f"cores: {cores}",
+        "resources:",
+        f"  mem_mb: {mem_mb}",
+    ]
+    if len(resources):
+        lines.append("set-resources:")
+        for row in resources.itertuples():
+            lines += [
+                f"  {row.rule}:",
+                f"    mem_mb: {min(row.mem_mb, mem_mb)}",
+                f"    runtime: {row.runtime}",
+            ]
+    return "\n".join(lines) + "\n"
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Generate a snakemake profile with resources from benchmarks."
+    )
+    parser.add_argument("--history-csv", required=True, help="Benchmark history.")
+    parser.add_argument("--workflow", required=True, help="Workflow in history.")
+    parser.add_argument(
+        "--snakefiles", nargs="+", required=True, help="Files defining the rules."
+    )
+    parser.add_argument("--profile-dir", required=True, help="Write profile here.")
+    parser.add_argument("--cores", type=int, required=True, help="Cores on node.")
+    parser.add_argument("--mem-mb", type=int, required=True, help="Memory on node.")
+    parser.add_argument("--n-runs", type=int, default=3, help="Recent runs to use.")
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    rules = rule_names(args.snakefiles)
+    if os.path.isfile(args.history_csv):
+        history = pd.read_csv(args.history_csv)
+    else:
+        print(f"No benchmark history {args.history_csv}, so using default resources")
+        history = pd.DataFrame(columns=benchmark_report.HISTORY_COLS)
+    resources = rule_resources(
+        history,
+        rules,
+        workflow=args.workflow,
+        n_runs=args.n_runs,
+    )
+    print(f"Resources from benchmarks for {len(resources)} of {len(rules)} rules:")
+    print(resources.to_string(index=False))
+    os.makedirs(args.profile_dir, exist_ok=True)
+    profile_config = os.path.join(args.profile_dir, "config.yaml")
+    print(f"Writing profile to {profile_config}")
+    with open(profile_config, "w") as f:
+        f.write(profile_yaml(resources, cores=args.cores, mem_mb=args.mem_mb))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""Run the analysis notebooks in one kernel."""
+
+import sys
+
+import notebook_cache
+import notebook_runner
+
+
+sys.stderr = sys.stdout = open(snakemake.log[0], "w")
+
+notebook_runner.run_notebooks(
+    snakemake.params.notebooks,
+    scripts_dir=snakemake.params.scripts_dir,
+    stdout_file=sys.stdout,
+    cache=notebook_cache.NotebookCache(
+        snakemake.params.cache_dir,
+        max_bytes=int(snakemake.params.cache_max_mb * 1e6),
+    ),
+)
@@ -0,0 +1,195 @@
+"""Aggregate mutation-level values to sites and join site-level annotations."""
+
+import pandas as pd
+
+
+def aggregate_sites(
+    df,
+    value_cols,
+    stats="mean",
+    site_col="sequential_site",
+    site_cols=None,
+    exclude_mutants=("*", "-"),
+    exclude_wildtype=True,
+):
+    """Aggregate mutation-level values at each site.
+
+    All statistics for all value columns are computed in a single grouped reduction
+    keyed on the integer `site_col`, rather than grouping on every site-level column.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Mutation-level data with columns `site_col`, "wildtype", "mutant", `value_cols`,
+        and `site_cols`.
+    value_cols : list
+        Columns with values to aggregate.
+    stats : str or list
+        Statistics to compute, any of "mean", "median", "min", "max", "count", "std",
+        "sum". If a str, the output columns have the same names as `value_cols`.
+        Otherwise they are named ``f"{value_col}_{stat}"``.
+    site_col : str
+        Integer column identifying sites.
+    site_cols : None or list
+        Other columns that take a single value per site (eg, "site", "wildtype",
+        "region") and are retained in the output. If `None`, all columns that are
+        not "mutant", `site_col`, or in `value_cols`.
+    exclude_mutants : tuple
+        Mutant characters not included in the aggregation.
+    exclude_wildtype : bool
+        Do not include mutations where "mutant" is the same as "wildtype".
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by `site_col`, sorted by it, with columns `site_cols` and then the
+        aggregated values. Sites with no retained mutations are still included, with
+        null values (or zero counts).
+
+    """
+    if site_cols is None:
+        site_cols = [c for c in df.columns if c not in {"mutant", site_col, *value_cols}]
+    if not pd.api.types.is_integer_dtype(df[site_col]):
+        raise ValueError(f"{site_col=} is not integer: {df[site_col].dtype=}")
+
+    site_df = df[[site_col, *site_cols]].drop_duplicates()
+    if site_df[site_col].duplicated().any():
+        raise ValueError(f"{site_cols=} do not take a single value at each {site_col=}")
+    site_df = site_df.set_index(site_col).sort_index()
+
+    keep = ~df["mutant"].isin(exclude_mutants)
+    if exclude_wildtype:
+        keep = keep & (df["mutant"] != df["wildtype"])
+    values = df.loc[keep, value_cols]
+    keys = df.loc[keep, site_col].to_numpy()
+
+    agg = values.groupby(keys, sort=True).aggregate(
+        [stats] if isinstance(stats, str) else list(stats)
+    )
+    count_cols = [i for (i, (_, stat)) in enumerate(agg.columns) if stat == "count"]
+    if isinstance(stats, str):
+        agg.columns = agg.columns.get_level_values(0)
+    else:
+        agg.columns = [f"{col}_{stat}" for (col, stat) in agg.columns]
+    agg = agg.reindex(site_df.index)
+    for col in agg.columns[count_cols]:
+        agg[col] = agg[col].fillna(0).astype(int)
+
+    return pd.concat([site_df, agg], axis=1)
+
+
+def join_site_annotations(df, annotations, site_col="sequential_site"):
+    """Join site-level annotations onto a site- or mutation-level table.
+
+    This is equivalent to an outer merge on the columns shared by `df` and
+    `annotations`, but joins by index on `site_col` after checking that the other
+    shared columns agree.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Has column `site_col` (or is indexed by it).
+    annotations : pandas.DataFrame
+        Has one row per `site_col`.
+    site_col : str
+
+    Returns
+    -------
+    pandas.DataFrame
+        `df` with the annotation columns not already in it appended. Sites only in
+        `annotations` are added as rows at the end. The index is reset.
+
+    """
+    if df.index.name == site_col:
+        df = df.reset_index()
+    shared_cols = [c for c in annotations.columns if c in df.columns and c != site_col]
+    if site_col not in df.columns or site_col not in annotations.columns:
+        raise ValueError(f"{site_col=} not in {df.columns=} and {annotations.columns=}")
+    annotations = annotations.set_index(site_col)
+    if not annotations.index.is_unique:
+        raise ValueError(f"annotations not unique for {site_col=}")
+
+    aligned = annotations.reindex(df[site_col].to_numpy())
+    for col in shared_cols:
+        in_both = df[col].notnull().to_numpy() & aligned[col].notnull().to_numpy()
+        if (df[col].to_numpy()[in_both] != aligned[col].to_numpy()[in_both]).any():
+            raise ValueError(f"data and annotations disagree on {col=}")
+    joined = pd.concat(
+        [
+            df.reset_index(drop=True),
+            aligned.drop(columns=shared_cols).reset_index(drop=True),
+        ],
+        axis=1,
+    )
+
+    annotation_only = annotations.index.difference(df[site_col].unique())
+    if len(annotation_only):
+        joined = pd.concat(
+            [joined, annotations.loc[annotation_only].reset_index()],
+            ignore_index=True,
+        )
+    return joined
+
+
+def annotated_summaries(data, addtl_annotations, site_diffs, site_stats="mean"):
+    """Annotate mutation effects, their site means, and site differences.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Mutation-level summary with columns "site", "wildtype", "mutant",
+        "sequential_site", "region", and value columns.
+    addtl_annotations : pandas.DataFrame
+        Site-level annotations with a "sequential_site" column.
+    site_diffs : pandas.DataFrame
+        Site differences between pairs of cells with columns "sequential_site",
+        "cell_1", and "cell_2".
+    site_stats : str or list
+        Statistic(s) for site-level summaries, as for :func:`aggregate_sites`.
+
+    Returns
+    -------
+    tuple
+        The annotated mutations, site summaries, and site differences. Mutations are
+        ordered by sequential site and then in their order in `data`, rather than by
+        the unstable sort the summaries were first written with, so reruns do not
+        reorder rows.
+
+    """
+    shared_cols = sorted(set(data.columns).intersection(addtl_annotations.columns))
+    assert "sequential_site" in shared_cols, f"{data.columns=}, {addtl_annotations.columns=}"
+
+    value_cols = [
+        c
+        for c in data.columns
+        if c not in {"site", "wildtype", "mutant", "sequential_site", "region"}
+    ]
+
+    mut = (
+        join_site_annotations(data, addtl_annotations)
+        .sort_values("sequential_site", kind="stable")
+    )
+
+    # aggregate on the integer site key, then join the annotations by site
+    site_cols = [c for c in data.columns if c not in {"mutant", *value_cols}]
+    site_mean = aggregate_sites(
+        data,
+        value_cols,
+        stats=site_stats,
+        site_cols=[c for c in site_cols if c != "sequential_site"],
+    )
+    stat_cols = [c for c in site_mean.columns if c not in site_cols]
+    site_mean = join_site_annotations(site_mean, addtl_annotations).sort_values(
+        "sequential_site", kind="stable"
+    )
+    annotation_cols = [c for c in site_mean.columns if c not in site_cols + stat_cols]
+    site_mean = site_mean[site_cols + annotation_cols + stat_cols]
+    if "protein_site" in site_mean.columns:
+        site_mean["protein_site"] = site_mean["protein_site"].astype("Int64")
+
+    assert "sequential_site" in site_diffs.columns, f"{site_diffs.columns=}"
+    site_diffs = (
+        join_site_annotations(site_diffs, addtl_annotations)
+        .sort_values(["cell_1", "cell_2", "sequential_site"], kind="stable")
+    )
+    return mut, site_mean, site_diffs
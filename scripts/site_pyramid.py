@@ -0,0 +1,186 @@
+"""Multi-resolution pyramid of site-level values for zoomable site charts.
+
+Site values are aggregated at several levels of detail: each site, bins of 5 and 25
+consecutive sites, and contiguous domains. A zoomable chart filters to the one level
+that matches the width of the current zoom window (see :func:`zoom_level_expr`), so
+the number of points it draws stays about the same however far it is zoomed out.
+
+"""
+
+
+import pandas as pd
+
+
+LEVELS = ("site", "5", "25", "domain")
+
+
+def site_pyramid(
+    df,
+    value_cols,
+    *,
+    group_cols=(),
+    bin_sizes=(5, 25),
+    domain_col=None,
+):
+    """Aggregate site values at several levels of detail.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Has columns "site", "sequential_site", `value_cols`, `group_cols`, and
+        `domain_col` if not `None`. One row per site in each group.
+    value_cols : list
+        Columns with site values (metrics). Each is averaged over sites.
+    group_cols : list
+        Columns that define groups (eg, pairs of cells) aggregated separately.
+    bin_sizes : list
+        Aggregate bins of this many consecutive sequential sites.
+    domain_col : None or str
+        Aggregate contiguous runs of sites with the same value in this column.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "level" (either "site", a bin size, or "domain"), `group_cols`,
+        "metric", "start" and "end" (first and last sequential site aggregated), "x"
+        (midpoint of start and end), "label" (the site, range of sites, or domain),
+        "n_sites", "value" (mean over sites), and "site" and "sequential_site" for
+        the site with the largest absolute value.
+
+    """
+    group_cols = list(group_cols)
+    site_cols = ["site", "sequential_site"] + ([domain_col] if domain_col else [])
+    missing = set(site_cols + group_cols + list(value_cols)) - set(df.columns)
+    if missing:
+        raise ValueError(f"`df` lacks columns {missing}")
+    if df.duplicated(group_cols + ["sequential_site"]).any():
+        raise ValueError("multiple rows for same site in a group")
+
+    sites = (
+        df[site_cols]
+        .drop_duplicates()
+        .sort_values("sequential_site")
+        .reset_index(drop=True)
+    )
+    if not sites["sequential_site"].is_unique:
+        raise ValueError("sites with inconsistent site-level columns")
+
+    # bins of sites for each level, as integers along with their labels
+    level_bins = {"site": (sites.index.to_series(), sites["site"])}
+    offset = sites["sequential_site"] - sites["sequential_site"].min()
+    for bin_size in bin_sizes:
+        bins = offset // bin_size
+        first = sites.groupby(bins)["site"].transform("first").astype(str)
+        last = sites.groupby(bins)["site"].transform("last").astype(str)
+        labels = first.where(first == last, first + " to " + last)
+        level_bins[str(bin_size)] = (bins, labels)
+    if domain_col:
+        domains = sites[domain_col].astype(str)
+        level_bins["domain"] = ((domains != domains.shift()).cumsum(), domains)
+
+    long_df = (
+        df[["sequential_site"] + group_cols + list(value_cols)]
+        .melt(
+            id_vars=["sequential_site"] + group_cols,
+            value_vars=value_cols,
+            var_name="metric",
+        )
+        .merge(
+            sites[["site", "sequential_site"]],
+            on="sequential_site",
+            validate="many_to_one",
+        )
+        .assign(abs_value=lambda x: x["value"].abs())
+    )
+    seq_to_i = pd.Series(sites.index, index=sites["sequential_site"])
+
+    levels = []
+    for level, (bins, labels) in level_bins.items():
+        level_df = long_df.assign(
+            bin=bins.values[seq_to_i[long_df["sequential_site"]].values]
+        )
+        keys = group_cols + ["metric", "bin"]
+        grouped = level_df.groupby(keys, sort=False)
+        # groups with all values missing have no top site
+        valid = level_df.dropna(subset=["abs_value"])
+        top = valid.loc[
+            valid.groupby(keys, sort=False)["abs_value"].idxmax().values,
+            keys + ["site", "sequential_site"],
+        ]
+        agg = grouped.aggregate(
+            start=pd.NamedAgg("sequential_site", "min"),
+            end=pd.NamedAgg("sequential_site", "max"),
+            n_sites=pd.NamedAgg("value", "count"),
+            value=pd.NamedAgg("value", "mean"),
+        ).reset_index()
+        bin_labels = pd.Series(labels.values, index=bins.values).groupby(level=0).first()
+        levels.append(
+            agg.merge(top, on=keys, how="left", validate="one_to_one")
+            .assign(
+                level=level,
+                x=lambda x: (x["start"] + x["end"]) / 2,
+                label=lambda x: x["bin"].map(bin_labels),
+            )
+        )
+
+    return (
+        pd.concat(levels, ignore_index=True)
+        [
+            [
+                "level",
+                *group_cols,
+                "metric",
+                "start",
+                "end",
+                "x",
+                "label",
+                "n_sites",
+                "value",
+                "site",
+                "sequential_site",
+            ]
+        ]
+        .sort_values(["level", *group_cols, "metric", "start"], key=_level_key)
+        .reset_index(drop=True)
+    )
+
+
+def _level_key(col):
+    """Sort key putting levels in the order of :data:`LEVELS`."""
+    if col.name == "level":
+        order = {level: i for i, level in enumerate(LEVELS)}
+        return col.map(lambda level: order.get(level, len(order)))
+    return col
+
+
+def zoom_level_expr(resolution, zoom, field, n_sites, max_points=200, bin_sizes=(5, 25)):
+    """Vega expression for the pyramid level that matches the zoom window.
+
+    Parameters
+    ----------
+    resolution : str
+        Name of a param that is either "auto" or a level to always show.
+    zoom : str
+        Name of an interval selection param over `field`.
+    field : str
+        Field with sequential sites the zoom selection is over.
+    n_sites : int
+        Total number of sites, the width of the window when not zoomed.
+    max_points : int
+        In "auto" resolution, use the finest level with at most this many points in
+        the zoom window.
+    bin_sizes : list
+        Bin sizes in the pyramid.
+
+    Returns
+    -------
+    str
+
+    """
+    extent = f"{zoom}.{field}"
+    width = f"(isValid({extent}) ? {extent}[1] - {extent}[0] + 1 : {n_sites})"
+    auto = f"'{bin_sizes[-1]}'"
+    for bin_size in reversed([1, *bin_sizes[:-1]]):
+        level = "site" if bin_size == 1 else str(bin_size)
+        auto = f"{width} <= {max_points * bin_size} ? '{level}' : {auto}"
+    return f"({resolution} == 'auto' ? ({auto}) : {resolution})"
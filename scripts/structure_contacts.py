@@ -0,0 +1,150 @@
+"""Closest distances between residues of one set of chains and atoms of another.
+
+For each residue in the query chains (eg, E1 / E2 / E3), finds the closest atom in the
+target chains (eg, Mxra8) using a KD-tree built over the target atoms, so only the
+nearest target atom of each query atom is ever looked up rather than all residue
+pairs. Structures are the parsed archives written by :mod:`pdb_cache`, and all copies
+(models) in biological assemblies are searched together.
+
+"""
+
+
+import numpy
+
+import pandas as pd
+
+import scipy.spatial
+
+import pdb_cache
+
+
+def closest_residues(
+    structure,
+    query_chains,
+    target_chains,
+    *,
+    max_distance=None,
+    models=None,
+    hetero=True,
+):
+    """Closest target residue for each residue in query chains.
+
+    Parameters
+    ----------
+    structure : pdb_cache.Structure
+    query_chains : list
+        Chains for which we get distances of each residue.
+    target_chains : list
+        Chains to which we get distances.
+    max_distance : None or float
+        Only return residues with an atom within this many angstroms of a target atom.
+        If `None`, return the closest target residue of every query residue.
+    models : None or list
+        Models searched (all if `None`). In a biological assembly, the closest target
+        atom can be in a different copy (model) than the query residue.
+    hetero : bool
+        Include hetero atoms (eg, glycans), as they are part of the residue contacts.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per query residue with columns "model", "chain", "site", "distance",
+        "target_chain", and "target_site". Sites are residue numbers.
+
+    """
+    for chains in [query_chains, target_chains]:
+        missing = set(chains) - set(structure.chains)
+        if missing:
+            raise ValueError(f"chains {missing} not in structure")
+    if set(query_chains).intersection(target_chains):
+        raise ValueError(f"{query_chains=} and {target_chains=} overlap")
+    query = structure.select(chains=query_chains, models=models, hetero=hetero).atoms
+    target = structure.select(chains=target_chains, models=models, hetero=hetero).atoms
+
+    tree = scipy.spatial.cKDTree(target["coord"])
+    dists, nearest = tree.query(
+        query["coord"],
+        k=1,
+        distance_upper_bound=numpy.inf if max_distance is None else max_distance,
+    )
+
+    # atoms of a residue are contiguous, so sorting by residue then distance puts the
+    # closest atom of each residue at the start of its run of atoms
+    key = query[["model", "chain", "resnum", "icode"]]
+    new_residue = numpy.r_[True, key[1:] != key[:-1]]
+    starts = numpy.flatnonzero(new_residue)
+    closest_atom = numpy.lexsort((dists, numpy.cumsum(new_residue)))[starts]
+    residue_dists = dists[closest_atom]
+    found = numpy.isfinite(residue_dists)
+    starts = starts[found]
+    closest_target = target[nearest[closest_atom[found]]]
+    return pd.DataFrame(
+        {
+            "model": query["model"][starts],
+            "chain": query["chain"][starts].astype(str),
+            "site": query["resnum"][starts],
+            "distance": residue_dists[found],
+            "target_model": closest_target["model"],
+            "target_chain": closest_target["chain"].astype(str),
+            "target_site": closest_target["resnum"],
+        }
+    )
+
+
+def closest_sites(structures, chain_defs, target, *, max_distance=None):
+    """Closest distance of each site in each protein to a target protein.
+
+    Parameters
+    ----------
+    structures : dict
+        Keyed by structure name, values are :class:`pdb_cache.Structure` or the
+        ``.npy`` archives they are loaded from.
+    chain_defs : dict
+        Keyed by structure name, values are dicts keyed by protein name with values
+        the chains for that protein. Must include `target` for each structure.
+    target : str
+        Name of the target protein.
+    max_distance : None or float
+        Passed to :func:`closest_residues`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "structure", "protein", "site", "distance", "chain",
+        "target_chain", and "target_site". Each site has the minimum distance over
+        all chains (and models) of its protein.
+
+    """
+    dfs = []
+    for name, structure in structures.items():
+        if not isinstance(structure, pdb_cache.Structure):
+            structure = pdb_cache.Structure.load(structure)
+        proteins = chain_defs[name]
+        if target not in proteins:
+            raise ValueError(f"{target=} not in chain definitions for {name}")
+        for protein, chains in proteins.items():
+            if protein == target:
+                continue
+            dfs.append(
+                closest_residues(
+                    structure, chains, proteins[target], max_distance=max_distance
+                ).assign(structure=name, protein=protein)
+            )
+    return (
+        pd.concat(dfs, ignore_index=True)
+        .sort_values("distance", kind="stable")
+        .drop_duplicates(["structure", "protein", "site"])
+        .sort_values(["structure", "protein", "site"])
+        [
+            [
+                "structure",
+                "protein",
+                "site",
+                "distance",
+                "chain",
+                "target_chain",
+                "target_site",
+            ]
+        ]
+        .reset_index(drop=True)
+    )
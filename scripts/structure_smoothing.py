@@ -0,0 +1,198 @@
+"""Smooth site effects over their neighbors in a 3-D structure.
+
+Each site is mapped onto its residues in the structure using a ``dms-viz`` style
+sitemap (columns "reference_site", "protein_site", and "chains"). Sites are neighbors
+if any of their atoms (in any of their chains) are within a radius, and neighbors are
+weighted by a Gaussian kernel on that closest distance. The weights are built once as
+a sparse site-by-site matrix, so smoothing any number of metrics is one sparse
+matrix product.
+
+Run as a script by the ``structure_smoothing`` rule.
+
+"""
+
+
+import argparse
+
+import numpy
+
+import pandas as pd
+
+import scipy.sparse
+import scipy.spatial
+
+import pdb_cache
+
+
+class SiteNeighbors:
+    """Sparse distance-weighted neighbors of sites in a structure.
+
+    Parameters
+    ----------
+    structure : pdb_cache.Structure
+    sitemap : pandas.DataFrame
+        Has columns "reference_site", "protein_site", and "chains" (space-delimited
+        chains with that site, or null if the site is not in the structure).
+    radius : float
+        Sites are neighbors if they have atoms within this many angstroms.
+    bandwidth : float
+        Neighbor at distance :math:`d` has weight :math:`\\exp(-d^2 / 2b^2)` where
+        :math:`b` is the bandwidth. Each site has weight one for itself.
+
+    Attributes
+    ----------
+    sites : list
+        Reference sites in the structure, in the order of rows of `weights`.
+    weights : scipy.sparse.csr_matrix
+        Sites by sites neighbor weights.
+    n_neighbors : numpy.ndarray
+        Number of neighbors of each site, not counting itself.
+
+    """
+
+    def __init__(self, structure, sitemap, radius=8.0, bandwidth=4.0):
+        """See main class docstring."""
+        sitemap = sitemap[sitemap["protein_site"].notnull() & sitemap["chains"].notnull()]
+        residues = pd.DataFrame(
+            [
+                (chain, int(protein_site), site)
+                for site, protein_site, chains in sitemap[
+                    ["reference_site", "protein_site", "chains"]
+                ].itertuples(index=False)
+                for chain in chains.split()
+            ],
+            columns=["chain", "resnum", "reference_site"],
+        )
+        if residues.duplicated(["chain", "resnum"]).any():
+            raise ValueError("sitemap maps a chain and protein site to multiple sites")
+
+        atoms = structure.select(chains=sorted(set(residues["chain"]))).atoms
+        atom_sites = (
+            pd.DataFrame(
+                {"chain": atoms["chain"].astype(str), "resnum": atoms["resnum"]}
+            )
+            .merge(residues, how="left", on=["chain", "resnum"], validate="many_to_one")
+            ["reference_site"]
+        )
+        in_sitemap = atom_sites.notnull().values
+        self.sites = list(dict.fromkeys(atom_sites[in_sitemap]))
+        site_index = {site: i for i, site in enumerate(self.sites)}
+        atom_site_i = atom_sites[in_sitemap].map(site_index).values
+        coords = atoms["coord"][in_sitemap]
+
+        # closest distance between each pair of sites with atoms within the radius
+        pairs = scipy.spatial.cKDTree(coords).query_pairs(radius, output_type="ndarray")
+        site_1 = atom_site_i[pairs[:, 0]]
+        site_2 = atom_site_i[pairs[:, 1]]
+        different = site_1 != site_2
+        site_1, site_2, pairs = site_1[different], site_2[different], pairs[different]
+        dists = numpy.linalg.norm(coords[pairs[:, 0]] - coords[pairs[:, 1]], axis=1)
+        n = len(self.sites)
+        key = numpy.minimum(site_1, site_2) * n + numpy.maximum(site_1, site_2)
+        order = numpy.lexsort((dists, key))
+        first = numpy.r_[True, key[order][1:] != key[order][:-1]]
+        key, dists = key[order][first], dists[order][first]
+
+        # symmetric weights, with each site its own neighbor with weight one
+        w = numpy.exp(-(dists**2) / (2 * bandwidth**2))
+        i, j, diag = key // n, key % n, numpy.arange(n)
+        self.weights = scipy.sparse.csr_matrix(
+            (
+                numpy.concatenate([w, w, numpy.ones(n)]),
+                (numpy.concatenate([i, j, diag]), numpy.concatenate([j, i, diag])),
+            ),
+            shape=(n, n),
+        )
+        self.n_neighbors = numpy.diff(self.weights.indptr) - 1
+
+    def smooth(self, df, cols, site_col="site"):
+        """Neighbor-weighted average of site values.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            One row per site, with sites in `site_col`.
+        cols : list
+            Columns to smooth. Missing values are left out of the average.
+        site_col : str
+
+        Returns
+        -------
+        pandas.DataFrame
+            Has `site_col`, "n_neighbors", and `cols` with smoothed values, for sites
+            in the structure. Sites with no values among their neighbors are null.
+
+        """
+        if df[site_col].duplicated().any():
+            raise ValueError(f"duplicated sites in {site_col=}")
+        values = (
+            df.set_index(site_col)[cols]
+            .reindex(self.sites)
+            .to_numpy(dtype=float)
+        )
+        observed = numpy.isfinite(values)
+        sums = self.weights @ numpy.hstack([numpy.where(observed, values, 0), observed])
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            smoothed = sums[:, : len(cols)] / sums[:, len(cols):]
+        return pd.concat(
+            [
+                pd.DataFrame({site_col: self.sites, "n_neighbors": self.n_neighbors}),
+                pd.DataFrame(smoothed, columns=cols),
+            ],
+            axis=1,
+        )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Smooth site effects over neighbors in a structure."
+    )
+    parser.add_argument(
+        "--structure-npy", required=True, help="Parsed atoms from `pdb_cache`."
+    )
+    parser.add_argument(
+        "--sitemap-csv",
+        required=True,
+        help="Has columns 'reference_site', 'protein_site', and 'chains'.",
+    )
+    parser.add_argument(
+        "--site-effects-csv", required=True, help="Site effects with column 'site'."
+    )
+    parser.add_argument("--cols", nargs="+", required=True, help="Columns to smooth.")
+    parser.add_argument("--radius", type=float, default=8.0, help="In angstroms.")
+    parser.add_argument("--bandwidth", type=float, default=4.0, help="In angstroms.")
+    parser.add_argument(
+        "--prefix", default="smoothed ", help="Prefix for smoothed column names."
+    )
+    parser.add_argument("--output-csv", required=True)
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    structure = pdb_cache.Structure.load(args.structure_npy)
+    sitemap = pd.read_csv(args.sitemap_csv, dtype={"reference_site": str})
+    neighbors = SiteNeighbors(structure, sitemap, args.radius, args.bandwidth)
+    print(
+        f"{len(neighbors.sites)} sites in structure have a median of "
+        f"{numpy.median(neighbors.n_neighbors)} neighbors within {args.radius} angstroms"
+    )
+    site_effects = pd.read_csv(args.site_effects_csv, dtype={"site": str})
+    smoothed = (
+        neighbors.smooth(site_effects, args.cols)
+        .rename(columns={c: args.prefix + c for c in args.cols})
+        .merge(
+            site_effects[["site", "sequential_site"]],
+            on="site",
+            validate="one_to_one",
+        )
+        .sort_values("sequential_site")
+        [["site", "sequential_site", "n_neighbors", *[args.prefix + c for c in args.cols]]]
+    )
+    print(f"Writing {len(smoothed)} smoothed sites to {args.output_csv}")
+    smoothed.to_csv(args.output_csv, index=False, float_format="%.4g")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""Generate synthetic deep mutational scanning data in the pipeline's formats.
+
+The custom rules are only run on the one real data set, so there is no way to see how
+they scale to larger proteins, more cells, or more replicates. :func:`make_dataset`
+writes a seeded synthetic data set with any number of sites, mutants per site, cells,
+and replicate selections, with files laid out and formatted like the pipeline's:
+
+ - ``data/site_numbering_map.csv``, ``data/addtl_site_annotations.csv``, and
+   ``data/func_effects_config.yml`` (just ``avg_func_effects``);
+ - ``results/barcode_counts/{sample}_counts.csv`` for the pre- (VSVG) and
+   post-selection samples of each selection;
+ - ``results/func_scores/{selection}_func_scores.csv`` of the variants in each library;
+ - ``results/func_effects/by_selection/{selection}_func_effects.csv``;
+ - ``results/func_effects/averages/{cell}_entry_func_effects.csv``, averaged by
+   :class:`replicate_averages.FuncEffects`;
+ - ``results/summaries/entry_binding.csv``, with entry in each cell and Mxra8 binding.
+
+Effects of mutations are drawn around a site-level tolerance, with cell-specific and
+replicate noise, so they have realistic structure for the site-level statistics.
+
+Used by :mod:`benchmark_custom_steps`, or run directly::
+
+    python scripts/synthetic_dms.py --outdir synthetic --n-sites 5000 --n-cells 6
+
+"""
+
+
+import argparse
+import os
+
+import numpy
+
+import pandas as pd
+
+import fast_csv
+import mut_codec
+import replicate_averages
+
+
+AAS = "ACDEFGHIKLMNPQRSTVWY"
+
+# names of the cells in the real data, used for the first cells
+CELLS = ["293T_Mxra8", "C636", "293T_TIM1"]
+
+# regions and their lengths in the real data, scaled to the number of sites
+REGIONS = {"E3": 64, "E2": 423, "6K": 61, "E1": 439}
+
+LIBRARIES = ["A", "B"]
+
+
+def cell_names(n_cells):
+    """Names of `n_cells` cells, the real ones first."""
+    return [*CELLS, *[f"cell{i}" for i in range(len(CELLS) + 1, n_cells + 1)]][:n_cells]
+
+
+def site_numbering_map(n_sites, rng, regions=REGIONS):
+    """Site numbering map with regions scaled to `n_sites`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "wildtype", "sequential_site", "reference_site", and "region",
+        with reference sites numbered within each region like "5(E2)".
+
+    """
+    lengths = numpy.array(list(regions.values()), dtype=float)
+    bounds = numpy.round(numpy.cumsum(lengths) / lengths.sum() * n_sites).astype(int)
+    region = numpy.array(list(regions))[numpy.searchsorted(bounds, numpy.arange(n_sites), side="right")]
+    starts = numpy.concatenate([[0], bounds[:-1]])
+    region_start = dict(zip(regions, starts))
+    return pd.DataFrame(
+        {
+            "wildtype": rng.choice(list(AAS), n_sites),
+            "sequential_site": numpy.arange(1, n_sites + 1),
+            "reference_site": [
+                f"{i - region_start[r] + 1}({r})" for i, r in enumerate(region)
+            ],
+            "region": region,
+        }
+    )
+
+
+def addtl_site_annotations(sitemap, rng, domain_length=150):
+    """Additional site annotations like ``data/addtl_site_annotations.csv``."""
+    protein_site = sitemap.groupby("region", sort=False).cumcount() + 1
+    domain = [
+        f"{region} domain {(site - 1) // domain_length + 1}"
+        for region, site in zip(sitemap["region"], protein_site)
+    ]
+    return pd.DataFrame(
+        {
+            "sequential_site": sitemap["sequential_site"],
+            "protein_site": protein_site,
+            "region": sitemap["region"],
+            "domain": domain,
+            "contacts": numpy.where(rng.random(len(sitemap)) < 0.05, "yes", "no"),
+        }
+    )
+
+
+def mutation_effects(sitemap, n_mutants, cells, rng):
+    """True effects of mutations on entry in each cell and on Mxra8 binding.
+
+    Parameters
+    ----------
+    sitemap : pandas.DataFrame
+        From :func:`site_numbering_map`.
+    n_mutants : int
+        Number of mutant amino acids (other than the wildtype) at each site.
+    cells : list
+    rng : numpy.random.Generator
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "site" (reference site), "sequential_site", "wildtype",
+        "mutant", "region", each cell, and "binding", with a row for each mutation
+        and the wildtype (all effects zero) at each site.
+
+    """
+    n_mutants = min(n_mutants, len(AAS) - 1)
+    n_sites = len(sitemap)
+    # random mutants at each site, excluding the wildtype
+    wildtype_index = numpy.array([AAS.index(aa) for aa in sitemap["wildtype"]])
+    order = numpy.argsort(rng.random((n_sites, len(AAS) - 1)), axis=1)[:, :n_mutants]
+    mutant_index = (wildtype_index[:, None] + 1 + order) % len(AAS)
+    mutant_index = numpy.sort(
+        numpy.concatenate([wildtype_index[:, None], mutant_index], axis=1), axis=1
+    )
+    site_rows = numpy.repeat(numpy.arange(n_sites), n_mutants + 1)
+    is_wildtype = mutant_index.ravel() == wildtype_index[site_rows]
+
+    # sites have a tolerance, mutations at intolerant sites are more deleterious
+    tolerance = rng.beta(2, 2, n_sites)[site_rows]
+    shared = numpy.clip(rng.normal(-6 * (1 - tolerance), 1.2), -8, 1.5)
+    effects = {
+        "site": sitemap["reference_site"].to_numpy()[site_rows],
+        "sequential_site": sitemap["sequential_site"].to_numpy()[site_rows],
+        "wildtype": sitemap["wildtype"].to_numpy()[site_rows],
+        "mutant": numpy.array(list(AAS))[mutant_index.ravel()],
+        "region": sitemap["region"].to_numpy()[site_rows],
+    }
+    for cell in cells:
+        # a few sites have cell-specific effects
+        cell_sites = (rng.random(n_sites) < 0.03)[site_rows]
+        effect = shared + rng.normal(0, 0.3, len(site_rows)) - 3 * cell_sites
+        effects[cell] = numpy.where(is_wildtype, 0.0, numpy.clip(effect, -8, 1.5))
+    binding = rng.normal(0, 0.3, len(site_rows)) - 2 * (rng.random(n_sites) < 0.02)[site_rows]
+    effects["binding"] = numpy.where(is_wildtype, 0.0, binding)
+    return pd.DataFrame(effects)
+
+
+def selection_names(cell, n_replicates):
+    """Selections for a cell, keyed by (library, date, replicate)."""
+    return {
+        (library, date, replicate): f"{cell.replace('_', '-')}-{library}-{date}-func-{replicate}"
+        for library, date in zip(LIBRARIES, ["240101", "240201"])
+        for replicate in range(1, n_replicates + 1)
+    }
+
+
+def func_effects_by_selection(effects, cell, rng, noise=0.4):
+    """Effects in one selection like those in ``results/func_effects/by_selection``."""
+    muts = effects.query("mutant != wildtype")
+    times_seen = rng.poisson(4, len(muts)) + 1
+    functional_effect = numpy.clip(
+        muts[cell].to_numpy() + rng.normal(0, noise, len(muts)) / numpy.sqrt(times_seen),
+        -10,
+        2,
+    )
+    times_seen_singlemut = rng.binomial(times_seen, 0.3)
+    return pd.DataFrame(
+        {
+            "latent_phenotype_effect": functional_effect + rng.normal(-0.5, 0.3, len(muts)),
+            "functional_effect": functional_effect,
+            "times_seen": times_seen,
+            "wildtype": muts["wildtype"].to_numpy(),
+            "site": muts["site"].to_numpy(),
+            "mutant": muts["mutant"].to_numpy(),
+            "functional_effect_singlemut": numpy.where(
+                times_seen_singlemut > 0,
+                functional_effect + rng.normal(0, noise, len(muts)),
+                numpy.nan,
+            ),
+            "times_seen_singlemut": times_seen_singlemut,
+        }
+    )
+
+
+def random_barcodes(n, rng, length=16):
+    """`n` unique random nucleotide barcodes."""
+    barcodes = set()
+    while len(barcodes) < n:
+        codes = rng.integers(4, size=(n - len(barcodes), length))
+        barcodes.update("".join("ACGT"[i] for i in row) for row in codes)
+    return sorted(barcodes)
+
+
+def library_variants(effects, n_variants, rng, mean_n_muts=1.5):
+    """Barcoded variants with random amino-acid substitutions.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns are "barcode", "aa_substitutions" (space delimited, like
+        "D151(E1)I"), "n_aa_substitutions", "n_codon_substitutions", and "row_index",
+        a list of the rows of `effects` of the substitutions.
+
+    """
+    muts = effects.query("mutant != wildtype")
+    n_muts = rng.poisson(mean_n_muts, n_variants)
+    rows = []
+    for n in n_muts:
+        # at most one substitution per site
+        mut_rows = rng.choice(len(muts), n, replace=False) if n else []
+        mut_rows = sorted(
+            {muts["sequential_site"].iat[i]: i for i in mut_rows}.values(),
+            key=lambda i: muts["sequential_site"].iat[i],
+        )
+        rows.append(mut_rows)
+    subs = (muts["wildtype"] + muts["site"] + muts["mutant"]).to_numpy()
+    n_aa = numpy.array([len(r) for r in rows])
+    return pd.DataFrame(
+        {
+            "barcode": random_barcodes(n_variants, rng),
+            "aa_substitutions": [" ".join(subs[r]) for r in rows],
+            "n_aa_substitutions": n_aa,
+            "n_codon_substitutions": n_aa + rng.poisson(0.2, n_variants),
+            "row_index": [muts.index.to_numpy()[r] for r in rows],
+        }
+    )
+
+
+def func_scores(variants, effects, cell, rng):
+    """Functional scores of variants like those in ``results/func_scores``."""
+    latent = numpy.array(
+        [effects[cell].to_numpy()[r].sum() if len(r) else 0.0 for r in variants["row_index"]]
+    )
+    # sigmoidal global epistasis, so scores saturate for very deleterious variants
+    observed = 4 / (1 + numpy.exp(-(latent + 2))) - 4 / (1 + numpy.exp(-2))
+    func_score_var = rng.gamma(2, 0.02, len(variants))
+    return pd.DataFrame(
+        {
+            "func_score": observed + rng.normal(0, numpy.sqrt(func_score_var)),
+            "func_score_var": func_score_var,
+            "barcode": variants["barcode"],
+            "aa_substitutions": variants["aa_substitutions"],
+            "n_aa_substitutions": variants["n_aa_substitutions"],
+            "n_codon_substitutions": variants["n_codon_substitutions"],
+        }
+    )
+
+
+def barcode_counts(barcodes, scores, rng, depth=200):
+    """Counts of barcodes like those in ``results/barcode_counts``, sorted by count."""
+    frequency = rng.gamma(2, 1, len(barcodes)) * 2**scores
+    counts = rng.poisson(depth * frequency / frequency.mean())
+    return (
+        pd.DataFrame({"barcode": barcodes, "count": counts})
+        .sort_values("count", ascending=False, kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def func_effects_config_yaml(selections):
+    """Text of ``func_effects_config.yml`` with `avg_func_effects` for selections."""
+    lines = ["avg_func_effects:"]
+    for condition, condition_selections in selections.items():
+        lines += [
+            f"  {condition}:",
+            "    avg_method: median",
+            "    floor_for_effect_std: -4",
+            "    selections:",
+            *[f"      - {s}" for s in condition_selections],
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def make_dataset(
+    outdir,
+    *,
+    n_sites=1000,
+    n_mutants=19,
+    n_cells=3,
+    n_replicates=2,
+    n_variants=10000,
+    seed=1,
+):
+    """Write a synthetic data set.
+
+    Parameters
+    ----------
+    outdir : str
+        Files are written under this directory, in ``data/`` and ``results/`` as in
+        the pipeline.
+    n_sites : int
+    n_mutants : int
+        Mutants (other than the wildtype) at each site, at most 19.
+    n_cells : int
+    n_replicates : int
+        Replicate selections per library (there are two libraries) for each cell.
+    n_variants : int
+        Barcoded variants per library. If 0, no barcode counts or functional scores
+        are written.
+    seed : int
+
+    Returns
+    -------
+    dict
+        Paths of the files keyed by "site_numbering_map", "addtl_site_annotations",
+        "func_effects_config", "summary", and "averages" (a dict keyed by cell), and
+        the "cells" and "selections" (a dict keyed by cell).
+
+    """
+    rng = numpy.random.default_rng(seed)
+    cells = cell_names(n_cells)
+    paths = {
+        "site_numbering_map": os.path.join(outdir, "data/site_numbering_map.csv"),
+        "addtl_site_annotations": os.path.join(outdir, "data/addtl_site_annotations.csv"),
+        "func_effects_config": os.path.join(outdir, "data/func_effects_config.yml"),
+        "summary": os.path.join(outdir, "results/summaries/entry_binding.csv"),
+        "averages": {},
+        "cells": cells,
+        "selections": {},
+    }
+    for subdir in [
+        "data",
+        "results/summaries",
+        "results/func_effects/by_selection",
+        "results/func_effects/averages",
+        "results/func_scores",
+        "results/barcode_counts",
+    ]:
+        os.makedirs(os.path.join(outdir, subdir), exist_ok=True)
+
+    sitemap = site_numbering_map(n_sites, rng)
+    sitemap.to_csv(paths["site_numbering_map"], index=False)
+    addtl_site_annotations(sitemap, rng).to_csv(paths["addtl_site_annotations"], index=False)
+    effects = mutation_effects(sitemap, n_mutants, cells, rng)
+    codec = mut_codec.MutationCodec.from_site_numbering_map(sitemap, replicate_averages.ALPHABET)
+    print(f"Simulated {len(effects)} mutations at {n_sites} sites in {cells=}")
+
+    variants = {
+        library: library_variants(effects, n_variants, rng) for library in LIBRARIES
+    } if n_variants else {}
+
+    summary = {}
+    for cell in cells:
+        selections = selection_names(cell, n_replicates)
+        paths["selections"][cell] = list(selections.values())
+        selection_csvs = {}
+        for (library, date, replicate), selection in selections.items():
+            selection_csvs[selection] = os.path.join(
+                outdir, f"results/func_effects/by_selection/{selection}_func_effects.csv"
+            )
+            fast_csv.write_csv(
+                func_effects_by_selection(effects, cell, rng),
+                selection_csvs[selection],
+                float_format="%.4g",
+            )
+            if variants:
+                scores = func_scores(variants[library], effects, cell, rng)
+                fast_csv.write_csv(
+                    scores,
+                    os.path.join(outdir, f"results/func_scores/{selection}_func_scores.csv"),
+                    float_format="%.4g",
+                )
+                for sample, sample_scores in [
+                    (f"{library}-{date}-{cell}_VSVG-{replicate}", numpy.zeros(len(scores))),
+                    (f"{library}-{date}-{cell}_no_antibody-{replicate}", scores["func_score"]),
+                ]:
+                    barcode_counts(scores["barcode"], sample_scores, rng).to_csv(
+                        os.path.join(outdir, f"results/barcode_counts/{sample}_counts.csv"),
+                        index=False,
+                    )
+        paths["averages"][cell] = os.path.join(
+            outdir, f"results/func_effects/averages/{cell.replace('_', '-')}_entry_func_effects.csv"
+        )
+        averages = replicate_averages.FuncEffects(
+            codec, selection_csvs, floor_for_effect_std=-4
+        ).averages()
+        fast_csv.write_csv(averages, paths["averages"][cell], float_format="%.4g")
+        summary[f"entry in {cell} cells"] = averages.set_index(["site", "wildtype", "mutant"])["effect"]
+        print(f"Wrote {len(selections)} selections and averages for {cell}")
+
+    with open(paths["func_effects_config"], "w") as f:
+        f.write(
+            func_effects_config_yaml(
+                {f"{cell.replace('_', '-')}_entry": paths["selections"][cell] for cell in cells}
+            )
+        )
+
+    # summary has the averaged entry effects, and zero for wildtypes, like the pipeline
+    keys = effects[["site", "wildtype", "mutant"]]
+    summary_df = keys.copy()
+    for col, values in summary.items():
+        summary_df[col] = values.reindex(pd.MultiIndex.from_frame(keys)).to_numpy()
+        summary_df.loc[keys["mutant"] == keys["wildtype"], col] = 0.0
+    summary_df["binding to mouse Mxra8"] = effects["binding"].where(
+        effects[cells[0]] >= -4
+    )
+    summary_df["sequential_site"] = effects["sequential_site"]
+    summary_df["region"] = effects["region"]
+    fast_csv.write_csv(summary_df, paths["summary"], float_format="%.4g")
+    print(f"Wrote summary of {len(summary_df)} mutations to {paths['summary']}")
+    return paths
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic deep mutational scanning data."
+    )
+    parser.add_argument("--outdir", required=True, help="Write data set here.")
+    parser.add_argument("--n-sites", type=int, default=1000)
+    parser.add_argument("--n-mutants", type=int, default=19, help="Mutants per site.")
+    parser.add_argument("--n-cells", type=int, default=3)
+    parser.add_argument("--n-replicates", type=int, default=2, help="Per library.")
+    parser.add_argument("--n-variants", type=int, default=10000, help="Per library.")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point of the script."""
+    args = parse_arguments()
+    make_dataset(
+        args.outdir,
+        n_sites=args.n_sites,
+        n_mutants=args.n_mutants,
+        n_cells=args.n_cells,
+        n_replicates=args.n_replicates,
+        n_variants=args.n_variants,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Row-wrapped heatmaps of mutation effects.
+
+The data is embedded once in the chart as named top-level CSV datasets that every
+row of the heatmap references: one row per site with the wildtype and the effect of
+each amino acid (folded to one row per mutation in the browser), and the mutations
+drawn dark gray. The gray background for unmeasured mutations and the wildtype
+markers are drawn from the per-site rows, so nothing is imputed in the browser.
+
+:func:`make_all_heatmaps` makes a batch of heatmaps, reading and filtering each input
+CSV once and rendering the heatmaps in a pool of processes.
+
+"""
+
+
+import collections
+import concurrent.futures
+
+import altair as alt
+
+import pandas as pd
+
+
+SITES_DATASET = "wrapped_heatmap_sites"
+DARK_GRAY_DATASET = "wrapped_heatmap_dark_gray"
+
+
+def prep_data(
+    data,
+    effect_col,
+    alphabet,
+    sites_per_row,
+    data_query_str=None,
+    dark_gray_muts=None,
+    decimals=2,
+):
+    """Get per-site data and dark gray mutations for :func:`wrapped_heatmap`.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Has columns "site", "sequential_site", "wildtype", "mutant", `effect_col`,
+        and the column in `dark_gray_muts` if specified.
+    effect_col : str
+    alphabet : str or list
+    sites_per_row : int
+    data_query_str : None or str
+        Query on `data` before plotting.
+    dark_gray_muts : None or dict
+        Has keys "col" and "cutoff", mutations with "col" less than "cutoff" are
+        drawn dark gray rather than colored by effect.
+    decimals : int
+        Round effects to this many decimal places.
+
+    Returns
+    -------
+    sites : pandas.DataFrame
+        Columns "site", "wildtype", "row" (row of heatmap the site is in), and a
+        column for each amino acid in `alphabet` giving the effect of that mutation
+        (null if not measured or drawn dark gray), in order of sequential site.
+    dark_gray : pandas.DataFrame
+        Columns "site" and "mutant" for mutations drawn dark gray.
+
+    """
+    alphabet = list(alphabet)
+
+    if data_query_str:
+        data = data.query(data_query_str)
+
+    req_cols = ["site", "sequential_site", "wildtype", "mutant", effect_col]
+    assert set(req_cols).issubset(data.columns), f"{data.columns=} lacks {req_cols=}"
+    if dark_gray_muts:
+        if dark_gray_muts["col"] not in data.columns:
+            raise ValueError(f"{dark_gray_muts['col']=} not in {data.columns=}")
+        if dark_gray_muts["col"] not in req_cols:
+            req_cols.append(dark_gray_muts["col"])
+
+    data = data[data["mutant"].isin(alphabet) & data["wildtype"].isin(alphabet)]
+    data = data[req_cols]
+    assert len(data) == len(data.groupby(["site", "wildtype", "mutant"]))
+
+    sites = (
+        data[["site", "sequential_site", "wildtype"]]
+        .drop_duplicates()
+        .sort_values("sequential_site")
+        .reset_index(drop=True)
+    )
+    assert sites["site"].is_unique and sites["sequential_site"].is_unique
+    sites["row"] = sites.index // sites_per_row
+
+    # mutations with null `dark_gray_muts` column are neither colored nor dark gray
+    if dark_gray_muts:
+        is_dark_gray = data[dark_gray_muts["col"]] < dark_gray_muts["cutoff"]
+        is_colored = data[dark_gray_muts["col"]] >= dark_gray_muts["cutoff"]
+    else:
+        is_dark_gray = pd.Series(False, index=data.index)
+        is_colored = pd.Series(True, index=data.index)
+
+    effects = (
+        data[is_colored]
+        .pivot(index="site", columns="mutant", values=effect_col)
+        .reindex(columns=alphabet)
+        .round(decimals)
+    )
+    sites = sites.merge(effects, left_on="site", right_index=True, how="left")
+
+    dark_gray = data[is_dark_gray][["site", "mutant"]].reset_index(drop=True)
+
+    return sites[["site", "wildtype", "row", *alphabet]], dark_gray
+
+
+def wrapped_heatmap(
+    sites,
+    dark_gray,
+    *,
+    effect_col,
+    alphabet,
+    title,
+    site_label_freq,
+    color_scheme,
+    fixed_min,
+    fixed_max,
+):
+    """Row-wrapped heatmap.
+
+    Parameters
+    ----------
+    sites : pandas.DataFrame
+        From :func:`prep_data`.
+    dark_gray : pandas.DataFrame
+        From :func:`prep_data`.
+    effect_col : str
+    alphabet : str or list
+    title : str
+    site_label_freq : int
+        Label sites at this frequency.
+    color_scheme : str
+        Vega color scheme.
+    fixed_min : float
+    fixed_max : float
+
+    Returns
+    -------
+    altair.VConcatChart
+
+    """
+    alphabet = list(alphabet)
+
+    site_data = alt.Data(
+        name=SITES_DATASET,
+        format=alt.DataFormat(
+            type="csv",
+            parse={"site": "string", "row": "number", **{aa: "number" for aa in alphabet}},
+        ),
+    )
+    dark_gray_data = alt.Data(
+        name=DARK_GRAY_DATASET,
+        format=alt.DataFormat(type="csv", parse={"site": "string"}),
+    )
+    y = alt.Y("mutant:N", title="amino acid", scale=alt.Scale(domain=alphabet))
+
+    # rects with no y encoding fill the column for each site
+    heatmap_bg = alt.Chart(site_data).mark_rect(color="#E0E0E0", opacity=0.8)
+
+    heatmap_wildtype = (
+        alt.Chart(site_data)
+        .encode(alt.Y("wildtype:N", title="amino acid", scale=alt.Scale(domain=alphabet)))
+        .mark_text(text="x", color="black")
+    )
+
+    heatmap_muts = (
+        alt.Chart(site_data)
+        .transform_fold(alphabet, as_=["mutant", effect_col])
+        .transform_filter(f"isValid(datum['{effect_col}'])")
+        .encode(
+            y,
+            alt.Color(
+                f"{effect_col}:Q",
+                scale=alt.Scale(
+                    scheme=color_scheme,
+                    domainMid=0,
+                    domainMin=fixed_min,
+                    domainMax=fixed_max,
+                    clamp=True,
+                ),
+            ),
+            tooltip=[
+                "site:N",
+                "mutant:N",
+                "wildtype:N",
+                alt.Tooltip(f"{effect_col}:Q", format=".2f"),
+            ],
+        )
+        .mark_rect(stroke="black", opacity=1, strokeOpacity=1)
+    )
+
+    heatmap_dark_gray = (
+        alt.Chart(dark_gray_data)
+        .transform_lookup(lookup="site", from_=alt.LookupData(site_data, "site", ["row"]))
+        .encode(y, tooltip=["site:N", "mutant:N"])
+        .mark_rect(stroke="black", opacity=1, strokeOpacity=1, color="silver")
+    )
+
+    heatmap_rows = []
+    n_rows = sites["row"].max() + 1
+    for row, row_sites in sites.groupby("row")["site"]:
+        row_sites = row_sites.tolist()
+        last_row = row == n_rows - 1
+        row_charts = [heatmap_bg, heatmap_muts, heatmap_wildtype]
+        if len(dark_gray):
+            row_charts.insert(1, heatmap_dark_gray)
+        heatmap_rows.append(
+            alt.layer(
+                *[chart.transform_filter(alt.datum["row"] == row) for chart in row_charts]
+            )
+            .encode(
+                alt.X(
+                    "site:N",
+                    title="site" if last_row else None,
+                    scale=alt.Scale(domain=row_sites),
+                    axis=alt.Axis(values=row_sites[::site_label_freq], labelAngle=0),
+                ),
+            )
+            .properties(width=alt.Step(9), height=alt.Step(9))
+        )
+
+    datasets = {SITES_DATASET: sites.to_csv(index=False, float_format="%.4g")}
+    if len(dark_gray):
+        datasets[DARK_GRAY_DATASET] = dark_gray.to_csv(index=False)
+
+    return (
+        alt.vconcat(*heatmap_rows, spacing=6)
+        .properties(title=title, datasets=datasets)
+        .configure_axis(tickColor="black", tickSize=4, titleFontSize=16)
+        .configure_legend(
+            orient="bottom",
+            gradientStrokeWidth=1,
+            gradientStrokeColor="black",
+            titleAnchor="middle",
+            titleFontSize=16,
+            titleLimit=200,
+        )
+        .configure_title(anchor="middle", fontSize=18)
+    )
+
+
+def make_heatmap(data, params, chart_html):
+    """Make a heatmap from data that has already been read and queried.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Data for heatmap, already queried by any "data_query_str" in `params`.
+    params : dict
+        Configuration of heatmap as in ``data/wrapped_heatmap_config.yaml``.
+    chart_html : str
+        Heatmap saved to this file.
+
+    Returns
+    -------
+    tuple
+        Number of sites and dark gray mutations in heatmap.
+
+    """
+    sites, dark_gray = prep_data(
+        data,
+        params["effect_col"],
+        params["alphabet"],
+        params["sites_per_row"],
+        dark_gray_muts=params.get("dark_gray_muts"),
+    )
+    heatmap = wrapped_heatmap(
+        sites,
+        dark_gray,
+        effect_col=params["effect_col"],
+        alphabet=params["alphabet"],
+        title=params["title"],
+        site_label_freq=params["site_label_freq"],
+        color_scheme=params["color_scheme"],
+        fixed_min=params["fixed_min"],
+        fixed_max=params["fixed_max"],
+    )
+    heatmap.save(chart_html)
+    return len(sites), len(dark_gray)
+
+
+def make_all_heatmaps(heatmaps, chart_htmls, max_workers=1):
+    """Make a batch of heatmaps, reading and querying each input CSV once.
+
+    Parameters
+    ----------
+    heatmaps : dict
+        Keyed by heatmap name, values are configurations as in
+        ``data/wrapped_heatmap_config.yaml``.
+    chart_htmls : dict
+        Keyed by heatmap name, values are the files to which heatmaps are saved.
+    max_workers : int
+        Number of processes that render heatmaps.
+
+    """
+    if set(heatmaps) != set(chart_htmls):
+        raise ValueError(f"{heatmaps.keys()=} differs from {chart_htmls.keys()=}")
+
+    groups = collections.defaultdict(list)
+    for name, params in heatmaps.items():
+        groups[params["data_csv"]].append(name)
+    print(f"Making {len(heatmaps)} heatmaps from {len(groups)} data CSVs")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for data_csv, names in groups.items():
+            data = pd.read_csv(data_csv, dtype={"site": str})
+            print(f"Read {len(data)=} from {data_csv=}")
+            queried = {}
+            for name in names:
+                params = heatmaps[name]
+                query_str = params.get("data_query_str")
+                if query_str not in queried:
+                    queried[query_str] = data.query(query_str) if query_str else data
+                    print(f"After querying with {query_str=}, {len(queried[query_str])=}")
+                # only send the processes the columns the heatmap uses
+                cols = ["site", "sequential_site", "wildtype", "mutant"]
+                cols.append(params["effect_col"])
+                if params.get("dark_gray_muts"):
+                    cols.append(params["dark_gray_muts"]["col"])
+                cols = [c for c in dict.fromkeys(cols) if c in data.columns]
+                future = pool.submit(
+                    make_heatmap, queried[query_str][cols], params, chart_htmls[name]
+                )
+                futures[future] = name
+        for future in concurrent.futures.as_completed(futures):
+            n_sites, n_dark_gray = future.result()
+            name = futures[future]
+            print(
+                f"Saved {name} with {n_sites} sites and {n_dark_gray} dark gray "
+                f"mutations to {chart_htmls[name]}"
+            )
@@ -0,0 +1,95 @@
+"""Test decoded compact ``dms-viz`` JSONs match the CSVs given to ``configure-dms-viz``.
+
+Run with ``python -m pytest tests`` from the top directory. Besides a synthetic
+experiment, checks every compact JSON written by the ``configure_dms_viz`` rule.
+
+"""
+
+
+import glob
+import json
+import os
+import sys
+
+import numpy
+
+import pandas as pd
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../scripts"))
+
+import dms_viz_compact  # noqa: E402
+
+
+# as `dms_viz_compact_precision` in `custom_rules.smk`
+PRECISION = 3
+
+
+@pytest.fixture
+def dms_viz_files(tmp_path):
+    """A ``configure-dms-viz`` style JSON and the data CSV it was made from."""
+    rng = numpy.random.default_rng(1)
+    n = 200
+    data = pd.DataFrame(
+        {
+            "site": numpy.repeat(numpy.arange(1, n // 4 + 1), 4),
+            "wildtype": "A",
+            "mutant": numpy.tile(["C", "D", "E", "F"], n // 4),
+            "condition": rng.choice(["C2C12", "293T-Mxra8"], n),
+            "effect": rng.normal(-1, 1.5, n).round(4),
+            "times_seen": rng.integers(1, 10, n),
+        }
+    )
+    data.loc[3, "effect"] = numpy.nan
+    data_csv = tmp_path / "viz_data.csv"
+    data.to_csv(data_csv, index=False, float_format="%.4g")
+    records = (
+        pd.read_csv(data_csv)
+        .rename(columns={"site": "reference_site"})
+        .dropna()
+        .to_dict(orient="records")
+    )
+    dms_viz_json = tmp_path / "viz.json"
+    with open(dms_viz_json, "w") as f:
+        json.dump({"viz": {"mut_metric_df": records, "pdb": "ATOM\n"}}, f)
+    return dms_viz_json, data_csv
+
+
+def test_round_trip(dms_viz_files, tmp_path):
+    dms_viz_json, data_csv = dms_viz_files
+    compact = dms_viz_compact.write_compact_json(
+        dms_viz_json, tmp_path / "viz_compact.json", PRECISION, "viz.pdb.gz"
+    )
+    assert "pdb" not in compact["viz"]
+    assert compact["viz"]["pdb_asset"] == "viz.pdb.gz"
+    dms_viz_compact.check_against_csv(compact, data_csv, PRECISION)
+
+
+def test_mismatch_detected(dms_viz_files, tmp_path):
+    dms_viz_json, data_csv = dms_viz_files
+    compact = dms_viz_compact.write_compact_json(
+        dms_viz_json, tmp_path / "viz_compact.json", PRECISION, "viz.pdb.gz"
+    )
+    data = pd.read_csv(data_csv)
+    data.loc[0, "effect"] += 10 ** -(PRECISION - 1)
+    data.to_csv(data_csv, index=False)
+    with pytest.raises(ValueError, match="differs from source"):
+        dms_viz_compact.check_against_csv(compact, data_csv, PRECISION)
+
+
+@pytest.mark.parametrize(
+    "compact_json",
+    sorted(
+        glob.glob(
+            os.path.join(
+                os.path.dirname(__file__), "../results/dms-viz/*/*_compact.json"
+            )
+        )
+    ),
+)
+def test_pipeline_outputs(compact_json):
+    with open(compact_json) as f:
+        compact = json.load(f)
+    input_data_csv = compact_json.replace("_compact.json", "_data.csv")
+    dms_viz_compact.check_against_csv(compact, input_data_csv, PRECISION)